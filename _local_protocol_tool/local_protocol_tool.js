@@ -35,6 +35,7 @@
 //                                }
 //                                → { ok, blocks:[...] }
 //      - POST /api/check        : { filename, content } → { ok, error? }
+//      - GET  /api/check/stats  : 構文チェック結果キャッシュの { hits, misses, hit_rate, entries }
 //      - GET  /api/instructions : 履歴一覧（outroot/dirs/items）
 //      - POST /api/instructions/delete / GET /api/instructions/original
 //      → PY側のレスポンス形が変わると、履歴UIやコピー系が壊れる。
@@ -37,12 +37,18 @@
 # → 修正時は必ず html / js / py を「同時に」確認・更新すること
 # ============================================================
 
+import ast
 import json
 import hashlib
 import os
+import re
 import shutil
+import sqlite3
 import subprocess
+import sys
 import tempfile
+import traceback
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime
 from http.server import BaseHTTPRequestHandler, HTTPServer
@@ -79,6 +85,23 @@ DEFAULT_OUTROOT = "out_protocol_local_tool"
 # 超過分は「古い順」に自動削除する
 DEFAULT_MAX_LOG_DIRS = 50
 
+# 構文チェック結果のキャッシュ（outroot/_check_cache.sqlite3。件数上限を超えたら最後に使った順の古いものから消す）
+# - SYNTAX_CHECK_VERSION: チェックの判定規則を変えたら上げる（古い結果を使わない）
+CHECK_CACHE_FILENAME = "_check_cache.sqlite3"
+DEFAULT_CHECK_RESULT_CACHE_ENTRIES = 4096
+SYNTAX_CHECK_VERSION = 2
+# キャッシュの表の形を変えたら上げる（起動時に作り直す）
+CHECK_CACHE_SCHEMA_VERSION = 2
+
+# Python の構文チェック方式
+# - "compile": このプロセス内で compile() する（一時ファイル・python3 の起動なし。行/桁を構造化して返す）
+#   ※ compile() は途中で打ち切れない（巨大な入力ではその間サーバが止まる）
+# - "py_compile": 従来どおり一時ファイル + python3 -m py_compile（別プロセス。時間の上限を付けたいならこちら）
+PY_SYNTAX_CHECK_MODE = "compile"
+
+# Python 抽出用のアウトライン（def/class の行範囲表）をソースの sha256 ごとに何件まで覚えておくか
+DEFAULT_PY_OUTLINE_CACHE_ENTRIES = 32
+
 # ブラウザからのアクセスをローカルのみに限定（念のため）
 BIND_HOST = "127.0.0.1"
 BIND_PORT = 8787
@@ -1049,13 +1072,14 @@ def extract_function_whole(js_text: str, name: str) -> Tuple[bool, str, str]:
     return (True, header, body)
 
 
-def extract_python_block_whole(py_text: str, name: str) -> Tuple[bool, str, str]:
+def _extract_python_block_by_indent(py_text: str, name: str) -> Tuple[bool, str, str]:
     """
     Python の def / async def / class を “まるごと” 抽出（簡易・インデント依存）。
     - def NAME(...):
     - async def NAME(...):
     - class NAME(...):
     戻り値: (found, header, body)
+    ※ 構文エラーで ast が使えないソース用のフォールバック
     """
     s = str(py_text or "")
     target = str(name or "").strip()
@@ -1119,6 +1143,145 @@ def extract_python_block_whole(py_text: str, name: str) -> Tuple[bool, str, str]
     return (True, header, body)
 
 
+_RE_PY_NEWLINE = re.compile(r"\r\n|\r|\n")
+
+
+class PythonOutline:
+    """
+    Python ソース 1 つ分の def / async def / class の一覧（ast で 1 回だけ解析）。
+    - qualified 名（例: "Handler.do_POST"）→ (kind, 開始行, 終了行)
+    - 素の名前（例: "do_POST"）→ ソース上で最初に出てくる定義（従来の正規表現版と同じ選び方）
+    行番号は 1 始まり。開始行は def/class の行（デコレータは含めない）。
+    終了は ast の end_lineno から、従来のインデント版と同じく「def/class 行より深いインデントの行（コメント）と空行」を
+    次の浅い行の手前まで含める（抽出範囲 chars a..b は従来と同じ。複数行のシグネチャ等で従来が途中で切っていた箇所だけ変わる）。
+    """
+
+    def __init__(self, text: str, tree: ast.AST):
+        self.text = text
+        # 各行の先頭の文字位置（ast と同じく \r\n / \r / \n を改行として数える）
+        self.line_starts = [0] + [m.end(0) for m in _RE_PY_NEWLINE.finditer(text)]
+        self.by_qualname = {}
+        self.by_name = {}
+        self._walk(tree, "")
+
+    def _walk(self, node: ast.AST, prefix: str) -> None:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if isinstance(child, ast.ClassDef):
+                    kind = "class"
+                elif isinstance(child, ast.AsyncFunctionDef):
+                    kind = "async def"
+                else:
+                    kind = "def"
+                qualname = f"{prefix}.{child.name}" if prefix else child.name
+                span = (kind, int(child.lineno), int(child.end_lineno or child.lineno))
+                self.by_qualname.setdefault(qualname, span)
+                self.by_name.setdefault(child.name, (qualname,) + span)
+                self._walk(child, qualname)
+            else:
+                # if / try などの中の定義も拾う（名前の階層は増やさない）
+                self._walk(child, prefix)
+
+    def _line_offset(self, lineno: int) -> int:
+        if lineno - 1 < len(self.line_starts):
+            return self.line_starts[lineno - 1]
+        return len(self.text)
+
+    def _line(self, lineno: int) -> str:
+        return self.text[self._line_offset(lineno):self._line_offset(lineno + 1)]
+
+    @staticmethod
+    def _indent_len(ln: str) -> int:
+        # 従来のインデント版と同じ数え方（タブは 4）
+        n = 0
+        for ch in ln:
+            if ch == " ":
+                n += 1
+            elif ch == "\t":
+                n += 4
+            else:
+                break
+        return n
+
+    def _block_end_line(self, start_line: int, end_line: int) -> int:
+        """
+        end_lineno の後ろの空行と、def/class 行より深いインデントの行を含めた最終行を返す。
+        """
+        base_len = self._indent_len(self._line(start_line))
+        last = len(self.line_starts)
+        k = end_line + 1
+        while k <= last:
+            ln = self._line(k)
+            if ln.strip() != "" and self._indent_len(ln) <= base_len:
+                break
+            k += 1
+        return k - 1
+
+    def extract(self, name: str) -> Tuple[bool, str, str]:
+        target = str(name or "").strip()
+        if target == "":
+            return (False, "name is empty", "")
+
+        span = self.by_qualname.get(target)
+        if span is None:
+            hit = self.by_name.get(target)
+            if hit is None:
+                return (False, "not found", "")
+            span = hit[1:]
+
+        kind, start_line, end_line = span
+        end_line = self._block_end_line(start_line, end_line)
+        start_off = self._line_offset(start_line)
+        end_off = self._line_offset(end_line + 1)
+        body = self.text[start_off:end_off]
+
+        header = f"EXTRACT_PY_BLOCK: {kind} {target} (chars {start_off}..{end_off})"
+        return (True, header, body)
+
+
+_PY_OUTLINE_CACHE = OrderedDict()
+
+
+def get_python_outline(py_text: str) -> Optional[PythonOutline]:
+    """
+    ソースの sha256 ごとにアウトラインを作って覚えておく（件数上限を超えたら古いものから捨てる）。
+    構文エラーで ast.parse できないときは None（呼び出し側はインデント版にフォールバック）。
+    """
+    s = str(py_text or "")
+    key = sha256_hex(s)
+
+    cached = _PY_OUTLINE_CACHE.get(key)
+    if cached is not None:
+        _PY_OUTLINE_CACHE.move_to_end(key)
+        return cached
+
+    try:
+        tree = ast.parse(s)
+    except (SyntaxError, ValueError):
+        return None
+
+    outline = PythonOutline(s, tree)
+    _PY_OUTLINE_CACHE[key] = outline
+    while len(_PY_OUTLINE_CACHE) > DEFAULT_PY_OUTLINE_CACHE_ENTRIES:
+        _PY_OUTLINE_CACHE.popitem(last=False)
+    return outline
+
+
+def extract_python_block_whole(py_text: str, name: str, outline: Optional[PythonOutline] = None) -> Tuple[bool, str, str]:
+    """
+    Python の def / async def / class を “まるごと” 抽出。
+    - NAME は素の名前（"do_POST"）でも qualified 名（"Handler.do_POST"）でもよい
+    - ast のアウトラインから行範囲を引く（同じソースなら何シンボル抽出しても解析は 1 回）
+    - 構文エラーのソースは従来のインデント依存の抽出にフォールバック
+    戻り値: (found, header, body)
+    """
+    if outline is None:
+        outline = get_python_outline(py_text)
+    if outline is None:
+        return _extract_python_block_by_indent(py_text=py_text, name=name)
+    return outline.extract(name)
+
+
 def extract_context_around(js_text: str, needle: str, context_lines: int, max_matches: int) -> Tuple[int, List[Tuple[str, str]]]:
     """
     文字列 needle のヒット行を中心に ±context_lines 行を抽出する。
@@ -1814,10 +1977,212 @@ def check_py_syntax_with_py_compile(filename: str, content: str) -> Tuple[bool,
         return False, f"syntax check failed: {e}"
 
 
+def check_py_syntax_in_process(filename: str, content: str) -> Tuple[bool, str, Optional[int], Optional[int]]:
+    """
+    compile() をこのプロセス内で呼んで Python の構文チェックを行う（py_compile と同じ判定。コードは実行しない）。
+    - 先頭の BOM は外す（py_compile はファイルを utf-8-sig として読むので BOM 付きでも通る）
+    - エラー文は py_compile と同じ形（File "...", line N / ソース行 / ^ / SyntaxError: ...）
+    戻り値: (ok, message, line, offset)（line / offset は 1 始まり。分からなければ None）
+    """
+    name = str(filename or "input.py")
+    src = str(content or "")
+    if src.startswith("\ufeff"):
+        src = src[1:]
+
+    try:
+        compile(src, name, "exec", dont_inherit=True)
+        return (True, "OK", None, None)
+    except SyntaxError as e:
+        msg = "".join(traceback.format_exception_only(type(e), e)).rstrip()
+        return (False, msg, e.lineno, e.offset)
+    except (ValueError, RecursionError, MemoryError) as e:
+        return (False, f"{type(e).__name__}: {e}", None, None)
+
+
 def now_tag() -> str:
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
 
+# ============================================================
+# 構文チェック結果のキャッシュ（/api/check）
+# ------------------------------------------------------------
+# 同じ内容を数分前にチェック済みでも毎回 node / py_compile を起動していたのをやめ、
+# 結果を outroot/_check_cache.sqlite3 に残す。
+# - キー: (内容SHA256, チェッカ名, チェッカ版, ファイル名)
+#   チェッカ版は node / python3（compile モードではこのプロセス）のバージョンと SYNTAX_CHECK_VERSION
+#   ファイル名を含めるのは、拡張子で判定が変わり、エラー文にも名前が入るため
+# - 件数上限を超えたら最後に使った順（last_used）の古いものから消す（LRU）
+# - ヒット/ミス数は起動からの累計を持ち、GET /api/check/stats で返す
+# - node / python3 が無い等の「判定できなかった」結果は残さない
+# ============================================================
+class CheckResultCache:
+    def __init__(self, outroot: Path, max_entries: int) -> None:
+        self.db_path = Path(outroot) / CHECK_CACHE_FILENAME
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        safe_mkdir(Path(outroot))
+        try:
+            self._conn = self._open()
+        except sqlite3.DatabaseError:
+            # 壊れたキャッシュは捨てて作り直す
+            self.db_path.unlink(missing_ok=True)
+            self._conn = self._open()
+        self._clock = int(self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM results").fetchone()[0])
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path))
+        # ヒットのたびに last_used を書くので、コミットごとの fsync を避ける（落ちても失うのは直近の使用順だけ）
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if int(conn.execute("PRAGMA user_version").fetchone()[0]) != CHECK_CACHE_SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS results")
+            conn.execute(f"PRAGMA user_version = {int(CHECK_CACHE_SCHEMA_VERSION)}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "sha256 TEXT, checker TEXT, version TEXT, filename TEXT, ok INTEGER, message TEXT, "
+            "line INTEGER, offset INTEGER, last_used INTEGER, "
+            "PRIMARY KEY (sha256, checker, version, filename))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        conn.commit()
+        return conn
+
+    def get(self, sha256: str, checker: str, version: str, filename: str) -> Optional[Tuple[bool, str, Optional[int], Optional[int]]]:
+        key = (str(sha256), str(checker), str(version), str(filename))
+        row = self._conn.execute(
+            "SELECT ok, message, line, offset FROM results WHERE sha256 = ? AND checker = ? AND version = ? AND filename = ?", key,
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._clock += 1
+        self._conn.execute(
+            "UPDATE results SET last_used = ? WHERE sha256 = ? AND checker = ? AND version = ? AND filename = ?",
+            (self._clock,) + key,
+        )
+        self._conn.commit()
+        return (bool(row[0]), str(row[1]), row[2], row[3])
+
+    def put(
+        self,
+        sha256: str,
+        checker: str,
+        version: str,
+        filename: str,
+        ok: bool,
+        message: str,
+        line: Optional[int] = None,
+        offset: Optional[int] = None,
+    ) -> None:
+        self._clock += 1
+        self._conn.execute(
+            "INSERT OR REPLACE INTO results (sha256, checker, version, filename, ok, message, line, offset, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(sha256), str(checker), str(version), str(filename), 1 if ok else 0, str(message), line, offset, self._clock),
+        )
+        count = int(self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0])
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        entries = int(self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0])
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+
+_CHECK_CACHE: Optional[CheckResultCache] = None
+
+
+def get_check_result_cache(outroot: Path) -> CheckResultCache:
+    global _CHECK_CACHE
+    if _CHECK_CACHE is None:
+        _CHECK_CACHE = CheckResultCache(outroot, DEFAULT_CHECK_RESULT_CACHE_ENTRIES)
+    return _CHECK_CACHE
+
+
+_TOOL_VERSIONS: dict = {}
+
+# node --check / py_compile の出力が「構文の判定結果」か（起動失敗・例外などの判定できなかった NG はキャッシュしない）
+_RE_SYNTAX_ERROR_RESULT = re.compile(r"^(?:SyntaxError|IndentationError|TabError)\b", re.M)
+
+
+def tool_version(cmd: str) -> str:
+    """
+    "<cmd> --version" の出力（最初の1回だけ起動して覚える。コマンドが無ければ ""）
+    """
+    if cmd not in _TOOL_VERSIONS:
+        try:
+            p = subprocess.run([cmd, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            _TOOL_VERSIONS[cmd] = (p.stdout or "").strip() if p.returncode == 0 else ""
+        except Exception:
+            _TOOL_VERSIONS[cmd] = ""
+    return _TOOL_VERSIONS[cmd]
+
+
+def check_syntax_cached(outroot: Path, filename: str, content: str) -> Tuple[bool, str, Optional[int], Optional[int], bool]:
+    """
+    拡張子で Python / JS のチェッカを選んで構文チェックする（結果キャッシュを先に引く）。
+    - Python は PY_SYNTAX_CHECK_MODE に従う（"compile" ならこのプロセス内で判定し、行/桁も返す）
+    戻り値: (ok, message, line, offset, cached)（line / offset は分かるときだけ数値）
+    """
+    in_process = False
+    if str(filename or "").lower().strip().endswith(".py"):
+        if PY_SYNTAX_CHECK_MODE == "compile":
+            checker, version, in_process = "compile", sys.version, True
+        else:
+            checker, version = "py_compile", tool_version("python3")
+    else:
+        checker, version = "node", tool_version("node")
+
+    digest = sha256_hex(str(content or ""))
+    ver_key = f"{SYNTAX_CHECK_VERSION}/{version}"
+
+    # キャッシュ（SQLite）がロック・破損などで使えなくても、チェック自体は行って結果を返す
+    cache: Optional[CheckResultCache] = None
+    hit = None
+    try:
+        cache = get_check_result_cache(outroot)
+        hit = cache.get(digest, checker, ver_key, filename)
+    except Exception as e:
+        print("[CHECK][WARN] check cache get failed", repr(e))
+        cache = None
+    if hit is not None:
+        return hit + (True,)
+
+    line: Optional[int] = None
+    offset: Optional[int] = None
+    if in_process:
+        ok, msg, line, offset = check_py_syntax_in_process(filename=filename, content=content)
+        # 位置の無い NG（RecursionError 等）は残さない
+        keep = ok or line is not None
+    elif checker == "py_compile":
+        ok, msg = check_py_syntax_with_py_compile(filename=filename, content=content)
+        keep = version != "" and (ok or _RE_SYNTAX_ERROR_RESULT.search(str(msg)) is not None)
+    else:
+        ok, msg = check_js_syntax_with_node(filename=filename, content=content)
+        keep = version != "" and (ok or _RE_SYNTAX_ERROR_RESULT.search(str(msg)) is not None)
+
+    if keep and cache is not None:
+        try:
+            cache.put(digest, checker, ver_key, filename, ok, msg, line, offset)
+        except Exception as e:
+            # 保存できなくても判定結果はそのまま返す（次回は判定し直すだけ）
+            print("[CHECK][WARN] check cache put failed", repr(e))
+    return (ok, msg, line, offset, False)
+
+
 def enforce_max_log_dirs(outroot: Path, max_keep: int) -> Tuple[int, int]:
     """
     outroot 配下の RUN ディレクトリを max_keep 個までに制限し、
@@ -2252,6 +2617,20 @@ class Handler(BaseHTTPRequestHandler):
             self._send(200, body, "text/html; charset=utf-8")
             return
 
+        if self.path == "/api/check/stats":
+            # 追加した処理: 構文チェック結果キャッシュのヒット/ミス数（起動からの累計）と件数
+            outroot = Path(__file__).resolve().parent / DEFAULT_OUTROOT
+            try:
+                stats = get_check_result_cache(outroot).stats()
+            except Exception as e:
+                print("[CHECK][WARN] check cache stats failed", repr(e))
+                body = json.dumps({"ok": False, "error": f"check cache unavailable: {e}"}, ensure_ascii=False).encode("utf-8")
+                self._send(500, body, "application/json; charset=utf-8")
+                return
+            body = json.dumps(stats, ensure_ascii=False).encode("utf-8")
+            self._send(200, body, "application/json; charset=utf-8")
+            return
+
         # ------------------------------------------------------------
         # ★ 静的ファイル配信（同ディレクトリ限定）
         # - local_protocol_tool.html から参照される local_protocol_tool.js を返す
@@ -2497,16 +2876,13 @@ class Handler(BaseHTTPRequestHandler):
                 self._send(200, body, "application/json; charset=utf-8")
                 return
 
-            lower = str(filename or "").lower().strip()
-
-            if lower.endswith(".py"):
-                ok, msg = check_py_syntax_with_py_compile(filename=filename, content=content)
-                body = json.dumps({"ok": bool(ok), "error": "" if ok else str(msg)}, ensure_ascii=False).encode("utf-8")
-                self._send(200, body, "application/json; charset=utf-8")
-                return
-
-            ok, msg = check_js_syntax_with_node(filename=filename, content=content)
-            body = json.dumps({"ok": bool(ok), "error": "" if ok else str(msg)}, ensure_ascii=False).encode("utf-8")
+            # 追加した処理: 同じ内容・同じチェッカ版の結果が残っていれば、node / py_compile を起動せずに返す
+            outroot = Path(__file__).resolve().parent / DEFAULT_OUTROOT
+            ok, msg, line, offset, cached = check_syntax_cached(outroot, filename, content)
+            body = json.dumps(
+                {"ok": bool(ok), "error": "" if ok else str(msg), "line": line, "column": offset, "cached": bool(cached)},
+                ensure_ascii=False,
+            ).encode("utf-8")
             self._send(200, body, "application/json; charset=utf-8")
             return
 
@@ -2689,9 +3065,12 @@ class Handler(BaseHTTPRequestHandler):
                 # 1) 関数まるごと抽出（拡張子で JS / Python を切替）
                 src_lower = str(src_filename or "").lower().strip()
 
+                # 追加した処理: Python はアウトラインをソースごとに 1 回だけ作り、全シンボルをそこから引く
+                py_outline = get_python_outline(src_content) if src_lower.endswith(".py") else None
+
                 for name in symbols:
                     if src_lower.endswith(".py"):
-                        found, header, body = extract_python_block_whole(py_text=src_content, name=name)
+                        found, header, body = extract_python_block_whole(py_text=src_content, name=name, outline=py_outline)
                         blocks.append({
                             "kind": "python_block_whole",
                             "name": name,
@@ -28,6 +28,12 @@
 //                                  split_mode, iife_grace_ratio, instruction
 //                                }
 //                                → { session_id, parts:[{part_id,index,total,payload,part_sha8...}] }
+//                                  ※ stream:"ndjson" を付けると NDJSON で返す（opt-in）:
+//                                    1行1パート {type:"part", ...} → 最終行 {type:"summary", manifest, ...}
+//                                  ※ meta_only:true を付けると payload を含めずメタだけ返す（opt-in）
+//                                  ※ incremental:true（+ base_session）で前回版との差分から再分割（opt-in）:
+//                                    parts[].body_changed と incremental.changed_part_ids を返す
+//      - GET  /api/part         : ?session=<SessionID>&index=N（または output_dir=...&index=N）→ payload 本文
 //      - POST /api/extract      : {
 //                                  sources:[{ filename, content }],
 //                                  extract_from:[{ filename, content }],
@@ -35,6 +41,8 @@
 //                                }
 //                                → { ok, blocks:[...] }
 //      - POST /api/check        : { filename, content } → { ok, error? }
+//      - POST /api/check/batch  : { files:[{filename, content}] } → { ok, results:[{ filename, ok, error, line, column }] }
+//      - GET  /api/check/stats  : 構文チェック結果キャッシュの { hits, misses, hit_rate, entries }
 //      - GET  /api/instructions : 履歴一覧（outroot/dirs/items）
 //      - POST /api/instructions/delete / GET /api/instructions/original
 //      → PY側のレスポンス形が変わると、履歴UIやコピー系が壊れる。
@@ -37,17 +37,30 @@
 # → 修正時は必ず html / js / py を「同時に」確認・更新すること
 # ============================================================
 
+import base64
+import errno
 import json
 import hashlib
 import os
+import re
 import shutil
+import sqlite3
 import subprocess
+import sys
 import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
+from functools import lru_cache
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Callable, List, Tuple, Optional
 
 
 # ============================================================
@@ -79,10 +92,64 @@ DEFAULT_OUTROOT = "out_protocol_local_tool"
 # 超過分は「古い順」に自動削除する
 DEFAULT_MAX_LOG_DIRS = 50
 
+# split キャッシュ（内容SHA256 + 分割パラメータ → 分割境界/ヒット情報/SCOPE_INDEX）
+# - メモリ上は件数と合計文字数（概算）の両方で LRU、ディスク上（outroot 配下）は合計サイズで古い順に削除する
+SPLIT_CACHE_DIRNAME = "_split_cache"
+SPLIT_CACHE_VERSION = 3
+DEFAULT_SPLIT_CACHE_MAX_ENTRIES = 256
+DEFAULT_SPLIT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# メモリ側の合計文字数の上限（payload の memo は1件で最大 DEFAULT_CODE_PAYLOAD_MEMO_MAX_CHARS になる）
+DEFAULT_SPLIT_CACHE_MAX_MEM_CHARS = 64 * 1024 * 1024
+
+# /api/part（パート単位の遅延取得）用に、直近 RUN の payload をメモリに置いておく件数
+DEFAULT_PART_PAYLOAD_CACHE_ENTRIES = 512
+
+# 指示文だけ変えた再送用に、コード本文パートの payload をメモリへ残す上限（1セッションの合計文字数）
+# - 細かい分割では RECEIPT_INPUT の累積 PartID で payload 合計がパート数の2乗で増えるため、超えたら残さない
+DEFAULT_CODE_PAYLOAD_MEMO_MAX_CHARS = 16 * 1024 * 1024
+
+# /api/extract の関数定義インデックスを保持するソース数（メモリ LRU）
+DEFAULT_DEFINITION_INDEX_CACHE_ENTRIES = 64
+
+# 構文チェック結果のキャッシュ（outroot/_check_cache.sqlite3。件数上限を超えたら最後に使った順の古いものから消す）
+# - JS_SYNTAX_CHECK_VERSION: 事前チェック/常駐チェッカの判定規則を変えたら上げる（古い結果を使わない）
+CHECK_CACHE_FILENAME = "_check_cache.sqlite3"
+DEFAULT_CHECK_RESULT_CACHE_ENTRIES = 4096
+JS_SYNTAX_CHECK_VERSION = 3
+
+# RUN アーカイブの重複排除用 blob ストア（outroot/blobs/<sha256>）
+BLOB_STORE_DIRNAME = "blobs"
+
+# outroot 直下で RUN ディレクトリとして扱わない（一覧・ログ削除の対象外）ディレクトリ名
+OUTROOT_RESERVED_DIRNAMES = (SPLIT_CACHE_DIRNAME, BLOB_STORE_DIRNAME)
+
+# /api/instructions 用の RUN 索引（outroot/_run_index.sqlite3）
+# - generate_parts / ログ削除 / /api/instructions/delete が更新し、一覧は manifest.json を読まずに索引から返す
+# - スキーマを変えたら RUN_INDEX_VERSION を上げる（起動時に作り直して RUN ディレクトリから再構築する）
+RUN_INDEX_FILENAME = "_run_index.sqlite3"
+RUN_INDEX_VERSION = 2
+DEFAULT_INSTRUCTIONS_PAGE_SIZE = 50
+# instruction=preview のときに返す指示文の先頭文字数
+INSTRUCTION_PREVIEW_CHARS = 200
+
 # ブラウザからのアクセスをローカルのみに限定（念のため）
 BIND_HOST = "127.0.0.1"
 BIND_PORT = 8787
 
+# サーバの同時処理
+# - SERVER_THREADED: True ならリクエストごとにスレッドで処理する（遅い /api/check や大きい /api/split 中も UI 取得を止めない）
+# - DEFAULT_CPU_POOL_WORKERS: split の CPU 処理を逃がすプロセス数（0 ならプールを使わずリクエストスレッド内で実行）
+SERVER_THREADED = True
+DEFAULT_CPU_POOL_WORKERS = 2
+
+# パート payload の並列組み立て（opt-in。/api/split の parallel_render で1リクエストだけ切り替えも可）
+# - PARALLEL_PAYLOAD_RENDER: True なら payload の組み立てを CPU プールへ分けて渡し、parts/ への書き込みもスレッドで並行する
+# - PARALLEL_PAYLOAD_MIN_PARTS: 組み立てるパートがこれ未満なら逐次のまま（プロセス間の受け渡しの方が高くつく）
+# - PAYLOAD_WRITE_THREADS: parts/part_NN.txt を書くスレッド数
+PARALLEL_PAYLOAD_RENDER = False
+PARALLEL_PAYLOAD_MIN_PARTS = 64
+PAYLOAD_WRITE_THREADS = 4
+
 EXEC_TASK_PATCH_RULES = """【出力仕様（パッチ規約：厳守）】
 - 参照元のコードから「確実に検索できる」形で提示すること（検索しやすい連続行を含める）
 - 必ず参照元と「同じインデント」で提示すること
@@ -95,7 +162,65 @@ EXEC_TASK_PATCH_RULES = """【出力仕様（パッチ規約：厳守）】
 """
 
 
-@dataclass
+# ============================================================
+# 正規表現レジストリ
+# ------------------------------------------------------------
+# スキャナ類（PART_SCOPE_HINT / SCOPE_INDEX / extract）が呼び出しごとに
+# import re + compile / findall(文字列パターン) をしていたので、ここで一度だけ compile する。
+# 名前に依存するパターン（extract の関数定義 / needle の選択）は lru_cache でメモ化する。
+# ============================================================
+_JS_IDENT = r"[A-Za-z_$][A-Za-z0-9_$]*"
+
+_RE_JS_IDENT_TOKEN = re.compile(r"\b" + _JS_IDENT + r"\b")
+_RE_JS_IDENT_FULL = re.compile(_JS_IDENT)
+
+JS_RESERVED_WORDS = frozenset({
+    "await","break","case","catch","class","const","continue","debugger","default","delete",
+    "do","else","enum","export","extends","false","finally","for","function","if","import",
+    "in","instanceof","let","new","null","return","super","switch","this","throw","true",
+    "try","typeof","var","void","while","with","yield",
+    "implements","interface","package","private","protected","public","static",
+})
+
+# _part_defines の検索順（= 出力順）
+_RE_PART_DEFINES = (
+    re.compile(r"(^|\n)\s*function\s+(" + _JS_IDENT + r")\s*\(", re.MULTILINE),
+    re.compile(r"(^|\n)\s*async\s+function\s+(" + _JS_IDENT + r")\s*\(", re.MULTILINE),
+    re.compile(r"(^|\n)\s*function\s*\*\s*(" + _JS_IDENT + r")\s*\(", re.MULTILINE),
+    re.compile(r"(^|\n)\s*async\s+function\s*\*\s*(" + _JS_IDENT + r")\s*\(", re.MULTILINE),
+    re.compile(r"(^|\n)\s*class\s+(" + _JS_IDENT + r")\b", re.MULTILINE),
+    re.compile(r"(^|\n)\s*(?:var|let|const)\s+(" + _JS_IDENT + r")\s*=", re.MULTILINE),
+)
+
+# build_scope_index_block の文字列キー抽出（DOM / selector / storage key の11種を1本にまとめたもの）
+_RE_SCOPE_CALL = re.compile(
+    r"(getElementById|getElementsByClassName|getElementsByName|querySelectorAll|querySelector)"
+    r"\(\s*['\"]([^'\"]+)['\"]\s*\)"
+    r"|(localStorage|sessionStorage)\."
+    r"(?:(?:getItem|removeItem)\(\s*['\"]([^'\"]+)['\"]\s*\)"
+    r"|setItem\(\s*['\"]([^'\"]+)['\"]\s*,)"
+)
+
+# _RE_SCOPE_CALL の照合候補: (共通部分, 照合開始位置までの戻り幅)
+SCOPE_CALL_STEMS = (
+    ("getElement", (0,)),
+    ("querySelector", (0,)),
+    ("Storage.", (len("local"), len("session"))),
+)
+
+_RE_NEWLINE = re.compile("\n")
+_RE_NEWLINE_BYTES = re.compile(b"\n")
+_RE_SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+# 名前ごとのパターンを保持する上限（extract の symbols / needles はリクエストをまたいで繰り返されやすい）
+REGEX_MEMO_MAX_ENTRIES = 1024
+
+
+# パート表は 1セッションで数百〜数千件になるので、使える版では __slots__ 付きにして1件あたりの辞書を持たせない
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_SLOTS)
 class SplitPart:
     # ★ 追加した処理: 複数ファイルを「1セッション」に束ねるためのメタ
     source_filename: str
@@ -110,7 +235,8 @@ class SplitPart:
     total: int
 
     part_id: str
-    text: str
+    # 本文の入れ物。コードパートはファイル全文をそのまま共有し（コピーしない）、本文は text_span の範囲
+    source_text: str
     start_offset: int
     end_offset: int
 
@@ -127,6 +253,32 @@ class SplitPart:
     first_line: str
     last_line: str
 
+    # PART_SCOPE_HINT（頻出識別子, 定義名）。split キャッシュから復元した場合のみ入る（None なら本文から計算）
+    scope_hints: Optional[Tuple[str, str]] = None
+
+    # 差分再分割（incremental）時のみ: 前回版に同じ本文のパートが無ければ True（None = 比較していない）
+    body_changed: Optional[bool] = None
+
+    # source_text 内の本文範囲（None なら source_text 全体が本文 = 前文 / 抽出 / EXEC_TASK パート）
+    text_span: Optional[Tuple[int, int]] = None
+
+    @property
+    def text(self) -> str:
+        """
+        パート本文。コードパートはここで初めてスライスを作る（payload を組み立てるときだけ呼ぶ）。
+        """
+        if self.text_span is None:
+            return self.source_text
+        a, b = self.text_span
+        return self.source_text[a:b]
+
+    @property
+    def text_len(self) -> int:
+        if self.text_span is None:
+            return len(self.source_text)
+        a, b = self.text_span
+        return b - a
+
 
 def sha256_hex(s: str) -> str:
     h = hashlib.sha256()
@@ -134,6 +286,13 @@ def sha256_hex(s: str) -> str:
     return h.hexdigest()
 
 
+def sha256_hex_bytes(data) -> str:
+    """
+    エンコード済みの bytes / memoryview の SHA256（str を経由しないので再エンコードしない）
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
 def sha256_8(s: str) -> str:
     return sha256_hex(s)[:8].upper()
 
@@ -200,9 +359,6 @@ def _part_top_identifiers(js_chunk: str, top_n: int) -> List[Tuple[str, int]]:
     """
     s = str(js_chunk or "")
 
-    import re
-    from collections import Counter
-
     try:
         n = int(top_n)
     except Exception:
@@ -210,15 +366,9 @@ def _part_top_identifiers(js_chunk: str, top_n: int) -> List[Tuple[str, int]]:
     if n <= 0:
         n = 12
 
-    tokens = re.findall(r"\b[A-Za-z_$][A-Za-z0-9_$]*\b", s)
+    tokens = _RE_JS_IDENT_TOKEN.findall(s)
 
-    reserved = {
-        "await","break","case","catch","class","const","continue","debugger","default","delete",
-        "do","else","enum","export","extends","false","finally","for","function","if","import",
-        "in","instanceof","let","new","null","return","super","switch","this","throw","true",
-        "try","typeof","var","void","while","with","yield",
-        "implements","interface","package","private","protected","public","static",
-    }
+    reserved = JS_RESERVED_WORDS
 
     ident_list = [t for t in tokens if t and t not in reserved]
     c = Counter(ident_list)
@@ -236,8 +386,6 @@ def _part_defines(js_chunk: str, max_items: int) -> List[str]:
     """
     s = str(js_chunk or "")
 
-    import re
-
     try:
         mx = int(max_items)
     except Exception:
@@ -247,18 +395,9 @@ def _part_defines(js_chunk: str, max_items: int) -> List[str]:
 
     names: List[str] = []
 
-    patterns = [
-        re.compile(r"(^|\n)\s*function\s+([A-Za-z_$][A-Za-z0-9_$]*)\s*\(", re.MULTILINE),
-        re.compile(r"(^|\n)\s*async\s+function\s+([A-Za-z_$][A-Za-z0-9_$]*)\s*\(", re.MULTILINE),
-        re.compile(r"(^|\n)\s*function\s*\*\s*([A-Za-z_$][A-Za-z0-9_$]*)\s*\(", re.MULTILINE),
-        re.compile(r"(^|\n)\s*async\s+function\s*\*\s*([A-Za-z_$][A-Za-z0-9_$]*)\s*\(", re.MULTILINE),
-        re.compile(r"(^|\n)\s*class\s+([A-Za-z_$][A-Za-z0-9_$]*)\b", re.MULTILINE),
-        re.compile(r"(^|\n)\s*(?:var|let|const)\s+([A-Za-z_$][A-Za-z0-9_$]*)\s*=", re.MULTILINE),
-    ]
-
     seen = set()
 
-    for rg in patterns:
+    for rg in _RE_PART_DEFINES:
         for m in rg.finditer(s):
             nm = str(m.group(2) if m.lastindex and m.lastindex >= 2 else m.group(1)).strip()
             if nm == "":
@@ -276,130 +415,553 @@ def make_session_id(prefix: str, file_text: str) -> str:
     digest8 = sha256_hex(file_text)[:8].upper()
     return f"{prefix}-{digest8}"
     
+def hash_split_targets(prefix: str, targets: List[dict]) -> Tuple[str, List[str]]:
+    """
+    SessionID と各ファイルの内容SHA256 をまとめて作る。
+    - 各ファイルは UTF-8 へ1回だけエンコードし、同じバイト列を両方のハッシュへ流す
+    - エンコード結果はファイルごとに捨てる（全ファイル分のバイト列をセッション中に抱えない）
+    戻り値: (session_id, [content_sha256, ...])  ※ targets と同じ順
+    """
+    # 追加した処理: 全ファイルを "\n" で結合した文字列は作らず、同じバイト列を順にハッシュへ流す（ダイジェストは従来と同一）
+    h = hashlib.sha256()
+    first = True
+    content_sha256s: List[str] = []
+    for t in targets:
+        fn = str(t.get("filename") or "")
+        ct = str(t.get("content") or "")
+        data = ct.encode("utf-8")
+        content_sha256s.append(sha256_hex_bytes(data))
+        for piece in (b"===FILE_BEGIN===", fn.encode("utf-8"), str(len(ct)).encode("ascii"), data, b"===FILE_END==="):
+            if not first:
+                h.update(b"\n")
+            h.update(piece)
+            first = False
+        del data
+    digest8 = h.hexdigest()[:8].upper()
+    return f"{prefix}-{digest8}", content_sha256s
+
+
 def make_session_id_multi(prefix: str, targets: List[dict]) -> str:
     """
     ★ 追加した処理: 複数JSを「1セッション」に束ねる共通 SessionID を作る。
     - ファイル順序も含めて固定化（順序が変わると別IDになる）
     - instruction には依存させない（“同じJS束”なら同じSessionIDにしたい想定）
     """
-    lines: List[str] = []
-    for t in targets:
-        fn = str(t.get("filename") or "")
-        ct = str(t.get("content") or "")
-        lines.append("===FILE_BEGIN===")
-        lines.append(fn)
-        lines.append(str(len(ct)))
-        lines.append(ct)
-        lines.append("===FILE_END===")
-    base = "\n".join(lines)
-    digest8 = sha256_hex(base)[:8].upper()
-    return f"{prefix}-{digest8}"
+    return hash_split_targets(prefix, targets)[0]
 
 def safe_mkdir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
 
+class LineIndex:
+    """
+    1ソースにつき1回だけ作る行インデックス（行番号 ⇔ オフセット変換用）。
+    - split / PART_SCOPE_HINT / extract がこれを共有し、全文の splitlines や改行数えを繰り返さない
+    - 行の開始オフセットを array('I') で持ち、検索は bisect のみ
+    - 行の区切りは \\n のみ（splitlines の \\r 単独などは区切りにしない）
+    """
+
+    __slots__ = ("text", "starts", "line_count")
+
+    def __init__(self, text: str) -> None:
+        s = str(text or "")
+        self.text = s
+        # starts[k] = k行目（0-based）の開始オフセット。starts[0] は常に 0
+        self.starts = array("I", [0])
+        self.starts.extend(m.end() for m in _RE_NEWLINE.finditer(s))
+        # 行数（= s.splitlines(True) の要素数。末尾が改行なら最後の空行は数えない）
+        if s == "":
+            self.line_count = 0
+        elif s.endswith("\n"):
+            self.line_count = len(self.starts) - 1
+        else:
+            self.line_count = len(self.starts)
+
+    def offset_to_line(self, offset: int) -> int:
+        """
+        offset が属する行（0-based）を返す（最終行以降は最終行扱い）
+        """
+        li = bisect_right(self.starts, offset) - 1
+        return li if li > 0 else 0
+
+    def line_end(self, line_idx: int) -> int:
+        """
+        line_idx 行目の終端オフセット（改行を含む直後位置）を返す
+        """
+        k = line_idx + 1
+        if k < len(self.starts):
+            return self.starts[k]
+        return len(self.text)
+
+    def slice_lines(self, a: int, b: int) -> str:
+        """
+        "".join(text.splitlines(True)[a:b]) と同じ文字列を、オフセットの切り出しだけで返す
+        """
+        if b <= a:
+            return ""
+        return self.text[self.starts[a]:self.line_end(b - 1)]
+
+    def next_newline(self, pos: int) -> int:
+        """
+        text.find("\\n", pos) と同じ結果を返す
+        """
+        k = bisect_right(self.starts, pos)
+        if k < len(self.starts):
+            return self.starts[k] - 1
+        return -1
+
+    def last_newline(self, start_pos: int, end_pos: int) -> int:
+        """
+        text.rfind("\\n", start_pos, end_pos) と同じ結果を返す
+        """
+        k = bisect_right(self.starts, end_pos) - 1
+        if k >= 1 and self.starts[k] - 1 >= start_pos:
+            return self.starts[k] - 1
+        return -1
+
+    def end_after_lines(self, pos: int, count: int) -> int:
+        """
+        pos 以降の count 個目の改行の直後オフセットを返す（改行が足りなければ末尾）
+        """
+        k = bisect_right(self.starts, pos) + count - 1
+        if k < len(self.starts):
+            return self.starts[k]
+        return len(self.text)
+
+    def first_last_line(self, start_pos: int, end_pos: int) -> Tuple[str, str]:
+        """
+        text[start_pos:end_pos].splitlines() の先頭行・末尾行を、区間全体を分割せずに返す
+        （PART の FirstLine / LastLine 用）
+        """
+        s = self.text
+        if end_pos <= start_pos:
+            return ("", "")
+
+        nl = self.next_newline(start_pos)
+        first_end = nl if (nl != -1 and nl < end_pos) else end_pos
+        head = s[start_pos:first_end].splitlines()
+        first = head[0] if head else ""
+
+        if s[end_pos - 1] == "\n":
+            nl2 = self.last_newline(start_pos, end_pos - 1)
+            seg = s[(nl2 + 1 if nl2 != -1 else start_pos):end_pos]
+        else:
+            nl2 = self.last_newline(start_pos, end_pos)
+            seg = s[(nl2 + 1 if nl2 != -1 else start_pos):end_pos]
+        tail = seg.splitlines()
+        last = tail[-1] if tail else ""
+        return (first, last)
+
+
+class Utf8Source:
+    """
+    1ソースを UTF-8 に1回だけエンコードして持ち、部分区間の SHA256 を memoryview のスライスで取る。
+    - 区間ごとに str をスライスして encode し直さない（パート本文の SHA256 用）
+    - 文字オフセット → バイトオフセットは、行頭どうしの対応（\n は UTF-8 でも1バイト）＋行内の端数だけエンコードして求める
+    - ASCII のみのソースは文字オフセット = バイトオフセットなので表を作らない
+    """
+
+    __slots__ = ("text", "data", "line_index", "_byte_starts", "_ascii")
+
+    def __init__(self, text: str, line_index: Optional[LineIndex] = None, data: Optional[bytes] = None) -> None:
+        s = str(text or "")
+        self.text = s
+        self.data = data if data is not None else s.encode("utf-8")
+        self.line_index = line_index
+        self._ascii = s.isascii()
+        self._byte_starts: Optional[array] = None
+
+    def sha256(self) -> str:
+        return sha256_hex_bytes(self.data)
+
+    def byte_offset(self, offset: int) -> int:
+        """
+        文字オフセット offset に対応するバイトオフセット（= len(text[:offset].encode("utf-8"))）
+        """
+        if self._ascii:
+            return offset
+        if self.line_index is None:
+            self.line_index = LineIndex(self.text)
+        if self._byte_starts is None:
+            bs = array("I", [0])
+            bs.extend(m.end() for m in _RE_NEWLINE_BYTES.finditer(self.data))
+            self._byte_starts = bs
+        k = self.line_index.offset_to_line(offset)
+        line_start = self.line_index.starts[k]
+        b = self._byte_starts[k]
+        if offset > line_start:
+            b += len(self.text[line_start:offset].encode("utf-8"))
+        return b
+
+    def sha256_span(self, start: int, end: int) -> str:
+        """
+        text[start:end] の SHA256（sha256_hex(text[start:end]) と同じ値）
+        """
+        with memoryview(self.data) as mv:
+            return sha256_hex_bytes(mv[self.byte_offset(start):self.byte_offset(end)])
+
+
+# ============================================================
+# 字句スキャナ（split_by_limits 用：1ファイルにつき1回だけ走らせる）
+# - 文字列 / テンプレ / コメント 内の { } は数えない（従来の簡易スキャナと同じ規則）
+# - 1文字ずつの Python ループではなく、正規表現で「次の特殊文字」まで一気に飛ばす
+# - 結果は配列で持ち、split 側は二分探索で境界を選ぶ（再スキャンしない）
+# ============================================================
+_RE_SCAN_SPECIAL = re.compile(r"[\n{}'\"`/]")
+_RE_SCAN_SQ_BODY = re.compile(r"[^'\\]*(?:\\[\s\S][^'\\]*)*")
+_RE_SCAN_DQ_BODY = re.compile(r'[^"\\]*(?:\\[\s\S][^"\\]*)*')
+_RE_SCAN_TPL_BODY = re.compile(r"[^`\\]*(?:\\[\s\S][^`\\]*)*")
+
+
+@dataclass
+class JsBraceScan:
+    # コード上（文字列/テンプレ/ブロックコメント外）の改行の「直後」オフセット = depth==0 境界の候補
+    cut_offsets: array
+    # その改行時点のブレース深さ
+    cut_depths: array
+    # 直前の候補改行からこの改行までに現れた深さの最小値（窓内 depth==0 判定用）
+    cut_mins: array
+
+    # コード上の { } の位置と、その直後の深さ
+    brace_offsets: array
+    brace_depths: array
+
+    # 文字列 / テンプレ / コメントとして読み飛ばした範囲 [start, end)（閉じられていないものは末尾まで）
+    # mode C の窓探索で、窓の開始位置が読み飛ばし範囲の途中かどうか（= 窓単位の走査と状態がずれるか）を引く
+    skip_starts: array
+    skip_ends: array
+
+    # 走査開始地点（コード上の改行の直後 or 0）とそこでの深さ
+    base_offset: int = 0
+    base_depth: int = 0
+
+
+def scan_js_braces(text: str, start_pos: int = 0, start_depth: int = 0) -> JsBraceScan:
+    """
+    JS 全文を1回だけ走査し、split が必要とする配列をまとめて作る。
+    - ブレース深さは 0 未満にしない（従来どおり）
+    - 閉じられていない文字列/コメントは末尾まで続くものとして扱う（従来どおり）
+    - start_pos / start_depth: 差分再分割用。start_pos は「コード上の改行の直後」（cut_offsets の要素）で、
+      そこでの深さが start_depth であること。start_pos より前の配列は作らない。
+    """
+    s = str(text or "")
+    n = len(s)
+
+    cut_offsets = array("I")
+    cut_depths = array("i")
+    cut_mins = array("i")
+    brace_offsets = array("I")
+    brace_depths = array("i")
+    skip_starts = array("I")
+    skip_ends = array("I")
+
+    depth = max(0, int(start_depth))
+    seg_min = depth
+    pos = max(0, int(start_pos))
+
+    find_special = _RE_SCAN_SPECIAL.search
+
+    while True:
+        m = find_special(s, pos)
+        if not m:
+            break
+        i = m.start()
+        ch = s[i]
+
+        if ch == "\n":
+            cut_offsets.append(i + 1)
+            cut_depths.append(depth)
+            cut_mins.append(seg_min)
+            seg_min = depth
+            pos = i + 1
+            continue
+
+        if ch == "{":
+            depth += 1
+            brace_offsets.append(i)
+            brace_depths.append(depth)
+            pos = i + 1
+            continue
+
+        if ch == "}":
+            depth -= 1
+            if depth < 0:
+                depth = 0
+            brace_offsets.append(i)
+            brace_depths.append(depth)
+            if depth < seg_min:
+                seg_min = depth
+            pos = i + 1
+            continue
+
+        if ch == "/":
+            nx = s[i + 1] if i + 1 < n else ""
+            if nx == "/":
+                # 行コメント: 終端の改行そのものはコード上の改行として扱う（従来どおり境界候補になる）
+                nl = s.find("\n", i + 2)
+                skip_starts.append(i)
+                skip_ends.append(n if nl == -1 else nl)
+                if nl == -1:
+                    break
+                pos = nl
+                continue
+            if nx == "*":
+                ce = s.find("*/", i + 2)
+                skip_starts.append(i)
+                skip_ends.append(n if ce == -1 else ce + 2)
+                if ce == -1:
+                    break
+                pos = ce + 2
+                continue
+            pos = i + 1
+            continue
+
+        # 文字列 / テンプレ（エスケープは次の1文字を無条件に飛ばす）
+        if ch == "'":
+            body = _RE_SCAN_SQ_BODY
+        elif ch == '"':
+            body = _RE_SCAN_DQ_BODY
+        else:
+            body = _RE_SCAN_TPL_BODY
+        e = body.match(s, i + 1).end()
+        skip_starts.append(i)
+        if e >= n or s[e] != ch:
+            skip_ends.append(n)
+            break
+        skip_ends.append(e + 1)
+        pos = e + 1
+
+    return JsBraceScan(
+        cut_offsets=cut_offsets,
+        cut_depths=cut_depths,
+        cut_mins=cut_mins,
+        brace_offsets=brace_offsets,
+        brace_depths=brace_depths,
+        skip_starts=skip_starts,
+        skip_ends=skip_ends,
+        base_offset=max(0, int(start_pos)),
+        base_depth=max(0, int(start_depth)),
+    )
+
+
+def _scan_depth_at(scan: JsBraceScan, offset: int) -> int:
+    """
+    offset の文字を処理する「直前」のブレース深さを返す。
+    """
+    j = bisect_left(scan.brace_offsets, offset)
+    if j <= 0:
+        return int(scan.base_depth)
+    return int(scan.brace_depths[j - 1])
+
+
+def _scan_window_last_depth0_cut(text: str, start_pos: int, end_pos: int) -> int:
+    """
+    start_pos..end_pos だけを新しい字句状態（コード・深さ 0）から走査し、
+    brace depth==0 の「改行境界（\\n の直後）」のうち最後の地点を返す。見つからなければ -1。
+    ※従来の窓スキャナと同じ規則（正規表現リテラルは知らないので、その中の引用符で文字列が始まることがある。
+      その場合も窓ごとに状態が戻るので、次の窓では回復する）。
+    """
+    s = text
+    n2 = end_pos
+    d = 0
+    last_cut = -1
+    pos = start_pos
+
+    find_special = _RE_SCAN_SPECIAL.search
+
+    while True:
+        m = find_special(s, pos, n2)
+        if not m:
+            return last_cut
+        i = m.start()
+        ch = s[i]
+
+        if ch == "\n":
+            if d == 0:
+                last_cut = i + 1
+            pos = i + 1
+            continue
+
+        if ch == "{":
+            d += 1
+            pos = i + 1
+            continue
+
+        if ch == "}":
+            d -= 1
+            if d < 0:
+                d = 0
+            pos = i + 1
+            continue
+
+        if ch == "/":
+            nx = s[i + 1] if i + 1 < n2 else ""
+            if nx == "/":
+                nl = s.find("\n", i + 2, n2)
+                if nl == -1:
+                    return last_cut
+                pos = nl
+                continue
+            if nx == "*":
+                ce = s.find("*/", i + 2, n2)
+                if ce == -1:
+                    return last_cut
+                pos = ce + 2
+                continue
+            pos = i + 1
+            continue
+
+        if ch == "'":
+            body = _RE_SCAN_SQ_BODY
+        elif ch == '"':
+            body = _RE_SCAN_DQ_BODY
+        else:
+            body = _RE_SCAN_TPL_BODY
+        e = body.match(s, i + 1, n2).end()
+        if e >= n2 or s[e] != ch:
+            return last_cut
+        pos = e + 1
+
+
+def _scan_last_depth0_cut(scan: JsBraceScan, start_pos: int, end_pos: int, text: str = "") -> int:
+    """
+    start_pos..end_pos で、brace depth==0 の位置にある「改行境界（\\n の直後）」のうち、
+    最後の地点を返す。見つからなければ -1。
+    ※深さは start_pos を 0 とした相対値（0 未満にはしない）で判定する（従来の窓スキャナと同じ意味）。
+      相対深さが 0 ⇔ その地点の深さが start_pos 以降の最小値に等しい、なので配列だけで判定できる。
+    ※従来の窓スキャナは窓の先頭から字句状態をやり直す。start_pos が全文走査で読み飛ばした範囲
+      （文字列/コメント）の途中なら両者の状態がずれるので、text から窓だけを走査し直す。
+    """
+    j = bisect_right(scan.skip_starts, start_pos) - 1
+    if j >= 0 and scan.skip_starts[j] < start_pos < scan.skip_ends[j]:
+        return _scan_window_last_depth0_cut(text, start_pos, end_pos)
+
+    cuts = scan.cut_offsets
+    k0 = bisect_left(cuts, start_pos + 1)
+    k1 = bisect_right(cuts, end_pos)
+    if k0 >= k1:
+        return -1
+
+    run_min = _scan_depth_at(scan, start_pos)
+    j0 = bisect_left(scan.brace_offsets, start_pos)
+    j1 = bisect_left(scan.brace_offsets, cuts[k0] - 1)
+    if j1 > j0:
+        run_min = min(run_min, min(scan.brace_depths[j0:j1]))
+
+    depths = scan.cut_depths
+    mins = scan.cut_mins
+    last_cut = -1
+    for k in range(k0, k1):
+        if k > k0 and mins[k] < run_min:
+            run_min = mins[k]
+        d = depths[k]
+        if d <= run_min:
+            run_min = d
+            last_cut = cuts[k]
+    return last_cut
+
+
+# IIFE終端として扱う候補（モードA/Bはこれだけを“強く”探す）
+IIFE_END_TOKENS = (
+    "\n})();\n",
+    "})();\n",
+    "\n})();",
+    "})();",
+)
+
+
+def normalize_split_mode(split_mode: str, iife_grace_ratio: float) -> Tuple[str, float]:
+    """
+    split_mode（A/B/C 以外は C）と iife_grace_ratio（不正値は 0.30）を正規化する。
+    """
+    mode = str(split_mode or "C").strip().upper()
+    if mode not in ("A", "B", "C"):
+        mode = "C"
+
+    try:
+        grace = float(iife_grace_ratio)
+    except Exception:
+        grace = 0.30
+    if not (grace >= 0.0):
+        grace = 0.30
+    return mode, grace
+
+
 def split_by_limits(
     text: str,
     max_chars: int,
     max_lines: int,
     split_mode: str = "C",
     iife_grace_ratio: float = 0.30,
+    line_index: Optional[LineIndex] = None,
+    scan: Optional[JsBraceScan] = None,
+    start_offset: int = 0,
 ) -> List[Tuple[int, int, str, int, int]]:
+    """
+    text を max_chars / max_lines を目安に分割する。
+    戻り値: [(start, end, chunk, brace_depth_start, brace_depth_end), ...]
+    - scan / start_offset: 差分再分割用。start_offset から先だけを分割して返す
+      （start_offset は前回の境界で、scan はそこから走査したものを渡す）
+    """
     if max_chars <= 0:
         raise ValueError("max_chars must be > 0")
     if max_lines <= 0:
         raise ValueError("max_lines must be > 0")
 
-    mode = str(split_mode or "C").strip().upper()
-    if mode not in ("A", "B", "C"):
-        mode = "C"
-
-    try:
-        grace = float(iife_grace_ratio)
-    except Exception:
-        grace = 0.30
-    if not (grace >= 0.0):
-        grace = 0.30
+    mode, grace = normalize_split_mode(split_mode, iife_grace_ratio)
 
     n = len(text)
     if n == 0:
         return [(0, 0, "")]
 
     parts: List[Tuple[int, int, str, int, int]] = []
-    start = 0
+    start = max(0, int(start_offset))
 
     # ============================================================
     # ブレース深さトラッキング（PART_SCOPE_HINT / depth==0境界 用）
-    # - 文字列 / テンプレ / コメント を極力避けて数える（簡易）。
-    # - splitは先頭→末尾へ進むので、状態は継続して持つ（チャンク跨ぎ対応）。
+    # - 全文を1回だけスキャンし、以降は配列の二分探索で引く。
+    # - splitは先頭→末尾へ進むが、深さは全文基準なのでチャンク跨ぎも正しい。
+    # - 行インデックスは呼び出し側（generate_parts）と共有できる（無ければここで作る）
     # ============================================================
-    depth = 0
-    in_squote = False
-    in_dquote = False
-    in_tpl = False
-    in_line_cmt = False
-    in_block_cmt = False
-    esc = False
-
-    # IIFE終端として扱う候補（モードA/Bはこれだけを“強く”探す）
-    iife_tokens = [
-        "\n})();\n",
-        "})();\n",
-        "\n})();",
-        "})();",
-    ]
+    if scan is None:
+        scan = scan_js_braces(text)
+    lix = line_index if line_index is not None else LineIndex(text)
 
-    while start < n:
-        # ------------------------------------------------------------
-        # 連続行（1行）をパート境界で絶対に切らないための補助関数
-        # ------------------------------------------------------------
-        def _snap_end_to_newline(start_pos: int, end_pos: int) -> int:
-            """
-            end_pos を「改行境界（\\n の直後）」へ丸める。
-            - 行の途中で分割しないことを保証する。
-            - end_pos が行途中なら、次の \\n まで前進して含める（見つからなければ n）。
-            - start_pos と同じ位置に戻ってしまう場合は、最低でも次の改行または n へ進める。
-            """
-            e = int(end_pos)
-            if e <= start_pos:
-                # ここで止まると無限ループになるため、必ず前進させる
-                nl2 = text.find("\n", start_pos, n)
-                if nl2 != -1:
-                    return nl2 + 1
-                return n
-
-            if e >= n:
-                return n
+    iife_tokens = IIFE_END_TOKENS
 
+    # ------------------------------------------------------------
+    # 連続行（1行）をパート境界で絶対に切らないための補助関数
+    # ------------------------------------------------------------
+    def _snap_end_to_newline(start_pos: int, end_pos: int) -> int:
+        """
+        end_pos を「改行境界（\\n の直後）」へ丸める。
+        - 行の途中で分割しないことを保証する。
+        - end_pos が行途中なら、次の \\n まで前進して含める（見つからなければ n）。
+        - start_pos と同じ位置に戻ってしまう場合は、最低でも次の改行または n へ進める。
+        """
+        e = int(end_pos)
+        if e <= start_pos:
+            # ここで止まると無限ループになるため、必ず前進させる
+            e = start_pos
+        elif e >= n:
+            return n
+        elif text[e - 1] == "\n":
             # すでに改行境界（直前が \n）ならそのまま
-            if text[e - 1] == "\n":
-                return e
+            return e
 
-            # 行途中なら、次の改行まで進めて「改行を含める」
-            nl = text.find("\n", e, n)
-            if nl != -1:
-                return nl + 1
+        # 行途中なら、次の改行まで進めて「改行を含める」
+        nl = lix.next_newline(e)
+        if nl != -1:
+            return nl + 1
 
-            # もう改行が無い（= 最終行が超長行など）なら末尾まで
-            return n
+        # もう改行が無い（= 最終行が超長行など）なら末尾まで
+        return n
 
+    while start < n:
         end_by_chars = min(start + max_chars, n)
 
-        end_by_lines = n
-        if start < n:
-            pos = start
-            newlines = 0
-            while True:
-                nl = text.find("\n", pos, n)
-                if nl == -1:
-                    end_by_lines = n
-                    break
-                newlines += 1
-                if newlines >= max_lines:
-                    end_by_lines = nl + 1
-                    break
-                pos = nl + 1
+        # start 以降の max_lines 個目の改行の直後（無ければ n）
+        end_by_lines = lix.end_after_lines(start, max_lines)
 
         tentative_end = min(end_by_chars, end_by_lines)
 
@@ -445,7 +1007,7 @@ def split_by_limits(
                     # IIFE終端が見つからない場合の扱い
                     # A: ファイル末尾までに見つからないなら、仕方ないので従来の改行優先へ戻す
                     # B: 既定どおり妥協して改行優先へ戻す
-                    nl = text.rfind("\n", start, tentative_end)
+                    nl = lix.last_newline(start, tentative_end)
                     if nl == -1 or nl <= start:
                         end = tentative_end
                     else:
@@ -457,129 +1019,6 @@ def split_by_limits(
                 #   1) depth==0 の「改行境界」（構文的に自立しやすい）
                 #   2) 従来の boundary_candidates（終端っぽいトークン）
                 #   3) 最後の改行（従来どおり）
-                def _find_last_depth0_newline(start_pos: int, end_pos: int) -> int:
-                    """
-                    start_pos..end_pos で、brace depth==0 の位置にある「改行境界（\\n の直後）」のうち、
-                    最後の地点を返す。見つからなければ -1。
-                    ※簡易スキャナ。文字列/テンプレ/コメント内の { } は数えない。
-                    """
-                    i = start_pos
-                    n2 = end_pos
-
-                    d = 0
-                    sq = False
-                    dq = False
-                    tp = False
-                    lc = False
-                    bc = False
-                    es = False
-
-                    last_cut = -1
-
-                    while i < n2:
-                        ch = text[i]
-
-                        if lc:
-                            if ch == "\n":
-                                lc = False
-                                if d == 0:
-                                    last_cut = i + 1
-                            i += 1
-                            continue
-
-                        if bc:
-                            if ch == "*" and i + 1 < n2 and text[i + 1] == "/":
-                                bc = False
-                                i += 2
-                                continue
-                            i += 1
-                            continue
-
-                        if sq:
-                            if es:
-                                es = False
-                                i += 1
-                                continue
-                            if ch == "\\":
-                                es = True
-                                i += 1
-                                continue
-                            if ch == "'":
-                                sq = False
-                            i += 1
-                            continue
-
-                        if dq:
-                            if es:
-                                es = False
-                                i += 1
-                                continue
-                            if ch == "\\":
-                                es = True
-                                i += 1
-                                continue
-                            if ch == '"':
-                                dq = False
-                            i += 1
-                            continue
-
-                        if tp:
-                            if es:
-                                es = False
-                                i += 1
-                                continue
-                            if ch == "\\":
-                                es = True
-                                i += 1
-                                continue
-                            if ch == "`":
-                                tp = False
-                            i += 1
-                            continue
-
-                        # 文字列/コメント外
-                        if ch == "/" and i + 1 < n2 and text[i + 1] == "/":
-                            lc = True
-                            i += 2
-                            continue
-                        if ch == "/" and i + 1 < n2 and text[i + 1] == "*":
-                            bc = True
-                            i += 2
-                            continue
-                        if ch == "'":
-                            sq = True
-                            i += 1
-                            continue
-                        if ch == '"':
-                            dq = True
-                            i += 1
-                            continue
-                        if ch == "`":
-                            tp = True
-                            i += 1
-                            continue
-
-                        if ch == "{":
-                            d += 1
-                            i += 1
-                            continue
-                        if ch == "}":
-                            d -= 1
-                            if d < 0:
-                                d = 0
-                            i += 1
-                            continue
-
-                        if ch == "\n":
-                            if d == 0:
-                                last_cut = i + 1
-                            i += 1
-                            continue
-
-                        i += 1
-
-                    return last_cut
-
                 boundary_candidates = [
                     "\n})();\n",
                     "\n});\n",
@@ -590,7 +1029,7 @@ def split_by_limits(
                 depth0_found = -1
                 depth0_search_from = max(start, tentative_end - 12000)
                 depth0_search_to = tentative_end
-                pos0 = _find_last_depth0_newline(depth0_search_from, depth0_search_to)
+                pos0 = _scan_last_depth0_cut(scan, depth0_search_from, depth0_search_to, text)
                 if pos0 != -1 and pos0 > start:
                     depth0_found = pos0
 
@@ -612,7 +1051,7 @@ def split_by_limits(
                         end = boundary_found
                     else:
                         # 3) 最後の改行
-                        nl = text.rfind("\n", start, tentative_end)
+                        nl = lix.last_newline(start, tentative_end)
                         if nl == -1 or nl <= start:
                             end = tentative_end
                         else:
@@ -622,107 +1061,10 @@ def split_by_limits(
             end = _snap_end_to_newline(start, end)
 
         # ============================================================
-        # このパートの brace depth（開始→終了）を確定
-        # - split は先頭→末尾へ進むため、状態を引き継いで正確性を上げる
+        # このパートの brace depth（開始→終了）を確定（全文スキャン結果から引く）
         # ============================================================
-        depth_start = depth
-
-        i = start
-        while i < end:
-            ch = text[i]
-
-            if in_line_cmt:
-                if ch == "\n":
-                    in_line_cmt = False
-                i += 1
-                continue
-
-            if in_block_cmt:
-                if ch == "*" and i + 1 < end and text[i + 1] == "/":
-                    in_block_cmt = False
-                    i += 2
-                    continue
-                i += 1
-                continue
-
-            if in_squote:
-                if esc:
-                    esc = False
-                    i += 1
-                    continue
-                if ch == "\\":
-                    esc = True
-                    i += 1
-                    continue
-                if ch == "'":
-                    in_squote = False
-                i += 1
-                continue
-
-            if in_dquote:
-                if esc:
-                    esc = False
-                    i += 1
-                    continue
-                if ch == "\\":
-                    esc = True
-                    i += 1
-                    continue
-                if ch == '"':
-                    in_dquote = False
-                i += 1
-                continue
-
-            if in_tpl:
-                if esc:
-                    esc = False
-                    i += 1
-                    continue
-                if ch == "\\":
-                    esc = True
-                    i += 1
-                    continue
-                if ch == "`":
-                    in_tpl = False
-                i += 1
-                continue
-
-            # 文字列/コメント外
-            if ch == "/" and i + 1 < end and text[i + 1] == "/":
-                in_line_cmt = True
-                i += 2
-                continue
-            if ch == "/" and i + 1 < end and text[i + 1] == "*":
-                in_block_cmt = True
-                i += 2
-                continue
-            if ch == "'":
-                in_squote = True
-                i += 1
-                continue
-            if ch == '"':
-                in_dquote = True
-                i += 1
-                continue
-            if ch == "`":
-                in_tpl = True
-                i += 1
-                continue
-
-            if ch == "{":
-                depth += 1
-                i += 1
-                continue
-            if ch == "}":
-                depth -= 1
-                if depth < 0:
-                    depth = 0
-                i += 1
-                continue
-
-            i += 1
-
-        depth_end = depth
+        depth_start = _scan_depth_at(scan, start)
+        depth_end = _scan_depth_at(scan, end)
 
         chunk = text[start:end]
         parts.append((start, end, chunk, depth_start, depth_end))
@@ -736,47 +1078,7 @@ def build_part_id(session_id: str, global_idx: int, global_total: int) -> str:
     return f"{session_id}-P{global_idx:02d}-of-{global_total:02d}"
 
 
-def _line_start_offsets(s: str) -> List[int]:
-    """
-    各行の開始オフセット配列を作る（行番号→オフセット変換用）
-    """
-    offs = [0]
-    i = 0
-    n = len(s)
-    while i < n:
-        j = s.find("\n", i)
-        if j == -1:
-            break
-        offs.append(j + 1)
-        i = j + 1
-    return offs
-
-
-def _offset_to_line_index(line_starts: List[int], offset: int) -> int:
-    """
-    offset が属する行（0-based）を返す
-    """
-    lo = 0
-    hi = len(line_starts) - 1
-    if hi < 0:
-        return 0
-    if offset <= 0:
-        return 0
-    if offset >= line_starts[hi]:
-        # 最終行以降は最終行扱い
-        return hi
-
-    while lo <= hi:
-        mid = (lo + hi) // 2
-        a = line_starts[mid]
-        b = line_starts[mid + 1] if mid + 1 < len(line_starts) else 10**18
-        if a <= offset < b:
-            return mid
-        if offset < a:
-            hi = mid - 1
-        else:
-            lo = mid + 1
-    return max(0, min(len(line_starts) - 1, lo))
+_RE_BRACE_SPECIAL = re.compile(r"[{}'\"`/]")
 
 
 def _find_matching_brace_end(s: str, start_pos: int) -> int:
@@ -784,220 +1086,437 @@ def _find_matching_brace_end(s: str, start_pos: int) -> int:
     start_pos 以降で最初に現れる '{' を起点に、対応する '}' の直後位置を返す。
     - 文字列 / テンプレ / コメント を極力避けて数える（簡易）。
     - 見つからない場合は -1。
+    - 1文字ずつではなく、正規表現で「次の特殊文字」まで飛ばす（規則は scan_js_braces と同じ）。
     """
     n = len(s)
-    i = start_pos
+    depth = 0
+    pos = start_pos
 
-    # 1) まず最初の '{' を探す（コメント/文字列はざっくりスキップ）
-    in_squote = False
-    in_dquote = False
-    in_tpl = False
-    in_line_cmt = False
-    in_block_cmt = False
-    esc = False
+    find_special = _RE_BRACE_SPECIAL.search
 
-    while i < n:
+    while True:
+        m = find_special(s, pos)
+        if not m:
+            return -1
+        i = m.start()
         ch = s[i]
 
-        if in_line_cmt:
-            if ch == "\n":
-                in_line_cmt = False
-            i += 1
+        if ch == "{":
+            depth += 1
+            pos = i + 1
             continue
 
-        if in_block_cmt:
-            if ch == "*" and i + 1 < n and s[i + 1] == "/":
-                in_block_cmt = False
-                i += 2
-                continue
-            i += 1
+        if ch == "}":
+            # 最初の '{' より前の '}' は数えない
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            pos = i + 1
             continue
 
-        if in_squote:
-            if esc:
-                esc = False
-                i += 1
+        if ch == "/":
+            nx = s[i + 1] if i + 1 < n else ""
+            if nx == "/":
+                nl = s.find("\n", i + 2)
+                if nl == -1:
+                    return -1
+                pos = nl + 1
                 continue
-            if ch == "\\":
-                esc = True
-                i += 1
+            if nx == "*":
+                ce = s.find("*/", i + 2)
+                if ce == -1:
+                    return -1
+                pos = ce + 2
                 continue
-            if ch == "'":
-                in_squote = False
-            i += 1
+            pos = i + 1
             continue
 
-        if in_dquote:
-            if esc:
-                esc = False
-                i += 1
-                continue
-            if ch == "\\":
-                esc = True
-                i += 1
-                continue
-            if ch == '"':
-                in_dquote = False
-            i += 1
-            continue
+        # 文字列 / テンプレ（閉じられていなければ末尾まで続く = 見つからない）
+        if ch == "'":
+            body = _RE_SCAN_SQ_BODY
+        elif ch == '"':
+            body = _RE_SCAN_DQ_BODY
+        else:
+            body = _RE_SCAN_TPL_BODY
+        q = body.match(s, i + 1).end()
+        if q >= n or s[q] != ch:
+            return -1
+        pos = q + 1
 
-        if in_tpl:
-            if esc:
-                esc = False
-                i += 1
-                continue
-            if ch == "\\":
-                esc = True
-                i += 1
-                continue
-            if ch == "`":
-                in_tpl = False
-            i += 1
-            continue
 
-        # 文字列/コメント外
-        if ch == "/" and i + 1 < n and s[i + 1] == "/":
-            in_line_cmt = True
-            i += 2
-            continue
-        if ch == "/" and i + 1 < n and s[i + 1] == "*":
-            in_block_cmt = True
-            i += 2
-            continue
-        if ch == "'":
-            in_squote = True
-            i += 1
-            continue
-        if ch == '"':
-            in_dquote = True
-            i += 1
-            continue
-        if ch == "`":
-            in_tpl = True
-            i += 1
-            continue
+# ============================================================
+# JS 構造の事前チェック（/api/check 用。node に渡す前の軽い判定）
+# ------------------------------------------------------------
+# パッチで壊れやすい「括弧の対応」「文字列/テンプレ/コメント/正規表現リテラルの閉じ忘れ」だけを
+# scan_js_braces と同じ「次の特殊文字まで正規表現で飛ばす」走査で調べる。
+# - NG が確実なときだけ node を呼ばずに返す（エラー表示は node と同じ "file:LINE / ソース行 / ^" 形式）
+# - / が正規表現か割り算か文脈で決めきれない箇所（) や } の直後など）を通った後の NG は不確実として node に任せる
+# - OK でも文法全体を見たわけではないので、node --check は従来どおり行う
+# ============================================================
+_RE_STRUCT_SPECIAL = re.compile(r"[{}()\[\]'\"`/]")
+# 行継続（\ + 改行）は \r\n もまとめて1つのエスケープとして飛ばす
+_RE_STRUCT_SQ_BODY = re.compile(r"[^'\\\n]*(?:\\(?:\r\n|[\s\S])[^'\\\n]*)*")
+_RE_STRUCT_DQ_BODY = re.compile(r'[^"\\\n]*(?:\\(?:\r\n|[\s\S])[^"\\\n]*)*')
+# テンプレ本文: ` か ${ の手前まで
+_RE_STRUCT_TPL_BODY = re.compile(r"[^`\\$]*(?:(?:\\[\s\S]|\$(?!\{))[^`\\$]*)*")
+# 正規表現リテラル本文: 文字クラス [...] の中の / は終端にならない。改行は含められない
+_RE_STRUCT_REGEX_BODY = re.compile(r"(?:[^/\\\[\n]|\\[^\n]|\[(?:[^\]\\\n]|\\[^\n])*\])*")
+_RE_STRUCT_REGEX_FLAGS = re.compile(r"[A-Za-z0-9_$]*")
+_RE_STRUCT_WORD_TAIL = re.compile(r"[A-Za-z0-9_$]+$")
+
+JS_REGEX_FLAGS = frozenset("dgimsuvy")
+# 直後の / が正規表現リテラルの開始になるキーワード
+JS_KEYWORDS_BEFORE_EXPR = frozenset({
+    "return", "typeof", "instanceof", "in", "new", "delete", "void",
+    "throw", "case", "do", "else",
+})
+# 文脈によっては変数名にもなる語（let of = 4; of / 2 は割り算）。正規表現として読むが不確実扱い
+JS_CONTEXTUAL_KEYWORDS_BEFORE_EXPR = frozenset({"of", "yield", "await"})
+_JS_CLOSERS = {"(": ")", "[": "]", "{": "}"}
+_JS_WS = " \t\r\n\v\f\u00a0\ufeff\u2028\u2029"
 
-        if ch == "{":
-            break
 
-        i += 1
+@dataclass
+class JsStructureIssue:
+    message: str
+    offset: int
+    # 正規表現/割り算を推測した箇所を通った後の NG（node で確かめ直す）
+    certain: bool
 
-    if i >= n or s[i] != "{":
-        return -1
 
-    # 2) 対応する '}' を探す
-    depth = 0
-    in_squote = False
-    in_dquote = False
-    in_tpl = False
-    in_line_cmt = False
-    in_block_cmt = False
-    esc = False
-
-    while i < n:
+def _regex_allowed_before(s: str, i: int, comment_span: Tuple[int, int]) -> Tuple[bool, bool]:
+    """
+    s[i] の / が正規表現リテラルの開始になり得るかを、直前の有効な文字から推測する。
+    戻り値: (正規表現として読むか, 推測が不確実か)
+    """
+    uncertain = False
+    j = i - 1
+    while True:
+        while j >= 0 and s[j] in _JS_WS:
+            j -= 1
+        # 直前がコメントなら、その手前を見る（コメントが続く場合まで追わないので不確実扱い）
+        if comment_span[0] <= j < comment_span[1]:
+            j = comment_span[0] - 1
+            uncertain = True
+            continue
+        break
+
+    if j < 0:
+        return (True, uncertain)
+    c = s[j]
+    if c in ")}":
+        # if (...) /re/ と (a) / b、ブロック末尾の /re/ とオブジェクトリテラル / b は字面だけでは区別できない
+        return (c == "}", True)
+    if c == "]" or c in "'\"`":
+        return (False, uncertain)
+    if c == ".":
+        # 1./2 のような数値の直後は割り算（obj./re/ は元々文法違反なので node に任せる）
+        return (False, True)
+    if c in "+-" and j > 0 and s[j - 1] == c:
+        return (False, True)
+    if c.isalnum() or c in "_$" or ord(c) > 127:
+        m = _RE_STRUCT_WORD_TAIL.search(s, max(0, j - 32), j + 1)
+        word = m.group(0) if m else ""
+        if word in JS_KEYWORDS_BEFORE_EXPR or word in JS_CONTEXTUAL_KEYWORDS_BEFORE_EXPR:
+            k = j - len(word)
+            prev = s[k] if k >= 0 else ""
+            # obj.return / 2 のようなプロパティ名は割り算
+            if prev == ".":
+                return (False, uncertain)
+            # this.#return / 2 や ñreturn / 2（_RE_STRUCT_WORD_TAIL は ASCII だけなので識別子の途中の可能性）は割り算寄り。
+            # 字面だけでは確かめきれないので不確実扱い
+            if prev == "#" or prev.isalnum() or prev in "_$\\" or (prev != "" and ord(prev) > 127):
+                return (False, True)
+            return (True, uncertain or word in JS_CONTEXTUAL_KEYWORDS_BEFORE_EXPR)
+        return (False, uncertain)
+    return (True, uncertain)
+
+
+def check_js_structure(text: str) -> Optional[JsStructureIssue]:
+    """
+    括弧・文字列・テンプレ・コメント・正規表現リテラルの対応を調べ、最初の問題を返す（問題なしなら None）。
+    """
+    s = str(text or "")
+    n = len(s)
+    pos = 0
+    # 先頭の #! 行は node が読み飛ばす
+    if s.startswith("#!"):
+        nl = s.find("\n")
+        pos = n if nl == -1 else nl
+
+    # (閉じ括弧, 開き位置, テンプレの ${ か)
+    stack: List[Tuple[str, int, bool]] = []
+    guessed = False
+    comment_span = (-1, -1)
+    find_special = _RE_STRUCT_SPECIAL.search
+
+    # HTML 風コメント（<!-- と行頭の -->。スクリプトでは行コメント扱い）はこの走査では扱わないので、
+    # それより後ろで見つかった NG は不確実として node に任せる
+    html_cmt_at = min((p for p in (s.find("<!--"), s.find("-->")) if p != -1), default=-1)
+
+    def issue(message: str, offset: int, found_at: int = -1) -> JsStructureIssue:
+        # found_at: 問題に気づいた走査位置（閉じ忘れは開き位置 offset より後ろで分かる）
+        at = max(offset, found_at)
+        certain = not guessed and not (html_cmt_at != -1 and html_cmt_at < at)
+        return JsStructureIssue(message=message, offset=offset, certain=certain)
+
+    def scan_template(start: int) -> Tuple[int, Optional[JsStructureIssue]]:
+        # start はテンプレ本文の先頭（` または } の直後）。戻り値: 次の走査位置
+        e = _RE_STRUCT_TPL_BODY.match(s, start).end()
+        if e >= n:
+            return (n, issue("Unterminated template literal", start - 1, n))
+        if s[e] == "`":
+            return (e + 1, None)
+        stack.append(("}", e, True))
+        return (e + 2, None)
+
+    while True:
+        m = find_special(s, pos)
+        if not m:
+            break
+        i = m.start()
         ch = s[i]
 
-        if in_line_cmt:
-            if ch == "\n":
-                in_line_cmt = False
-            i += 1
+        if ch in "([{":
+            stack.append((_JS_CLOSERS[ch], i, False))
+            pos = i + 1
             continue
 
-        if in_block_cmt:
-            if ch == "*" and i + 1 < n and s[i + 1] == "/":
-                in_block_cmt = False
-                i += 2
+        if ch in ")]}":
+            if not stack:
+                return issue(f"Unexpected token '{ch}'", i)
+            closer, at, in_tpl = stack.pop()
+            if closer != ch:
+                return issue(f"Unexpected token '{ch}' (expected '{closer}')", i)
+            if in_tpl:
+                pos, err = scan_template(i + 1)
+                if err is not None:
+                    return err
                 continue
-            i += 1
+            pos = i + 1
             continue
 
-        if in_squote:
-            if esc:
-                esc = False
-                i += 1
-                continue
-            if ch == "\\":
-                esc = True
-                i += 1
+        if ch == "/":
+            nx = s[i + 1] if i + 1 < n else ""
+            if nx == "/":
+                nl = s.find("\n", i + 2)
+                end = n if nl == -1 else nl
+                comment_span = (i, end)
+                pos = end
                 continue
-            if ch == "'":
-                in_squote = False
-            i += 1
-            continue
-
-        if in_dquote:
-            if esc:
-                esc = False
-                i += 1
+            if nx == "*":
+                ce = s.find("*/", i + 2)
+                if ce == -1:
+                    return issue("Unterminated comment", i, n)
+                comment_span = (i, ce + 2)
+                pos = ce + 2
                 continue
-            if ch == "\\":
-                esc = True
-                i += 1
+            is_regex, uncertain = _regex_allowed_before(s, i, comment_span)
+            if uncertain:
+                guessed = True
+            if not is_regex:
+                pos = i + 1
                 continue
-            if ch == '"':
-                in_dquote = False
-            i += 1
+            e = _RE_STRUCT_REGEX_BODY.match(s, i + 1).end()
+            if e >= n or s[e] != "/":
+                return issue("Invalid regular expression: missing /", i, e)
+            fe = _RE_STRUCT_REGEX_FLAGS.match(s, e + 1).end()
+            flags = s[e + 1:fe]
+            if any(f not in JS_REGEX_FLAGS for f in flags) or len(set(flags)) != len(flags):
+                return issue("Invalid regular expression flags", i)
+            pos = fe
             continue
 
-        if in_tpl:
-            if esc:
-                esc = False
-                i += 1
-                continue
-            if ch == "\\":
-                esc = True
-                i += 1
-                continue
-            if ch == "`":
-                in_tpl = False
-            i += 1
-            continue
-
-        # 文字列/コメント外
-        if ch == "/" and i + 1 < n and s[i + 1] == "/":
-            in_line_cmt = True
-            i += 2
-            continue
-        if ch == "/" and i + 1 < n and s[i + 1] == "*":
-            in_block_cmt = True
-            i += 2
-            continue
-        if ch == "'":
-            in_squote = True
-            i += 1
-            continue
-        if ch == '"':
-            in_dquote = True
-            i += 1
-            continue
         if ch == "`":
-            in_tpl = True
-            i += 1
+            pos, err = scan_template(i + 1)
+            if err is not None:
+                return err
             continue
 
-        if ch == "{":
-            depth += 1
-            i += 1
-            continue
-        if ch == "}":
-            depth -= 1
-            i += 1
-            if depth == 0:
-                return i
-            continue
+        body = _RE_STRUCT_SQ_BODY if ch == "'" else _RE_STRUCT_DQ_BODY
+        e = body.match(s, i + 1).end()
+        if e >= n or s[e] != ch:
+            return issue("Invalid or unexpected token", i, e)
+        pos = e + 1
+
+    if stack:
+        closer, at, in_tpl = stack[-1]
+        if in_tpl:
+            return issue("Unterminated template literal", at, n)
+        return issue(f"Unexpected end of input ('{s[at]}' is not closed)", at, n)
+    return None
+
+
+def format_js_structure_issue(filename: str, text: str, found: JsStructureIssue) -> str:
+    """
+    node の SyntaxError と同じ形（"file:LINE" / ソース行 / 桁位置の ^ / SyntaxError: ...）の文字列にする
+    """
+    s = str(text or "")
+    line_start = s.rfind("\n", 0, found.offset) + 1
+    line_end = s.find("\n", found.offset)
+    if line_end == -1:
+        line_end = len(s)
+    line_no = s.count("\n", 0, found.offset) + 1
+    src_line = s[line_start:line_end].rstrip("\r")
+    # タブはそのまま残す（node と同じく ^ の位置が見た目でも揃う）
+    pad = "".join(c if c == "\t" else " " for c in s[line_start:found.offset])
+    return f"{filename}:{line_no}\n{src_line}\n{pad}^\n\nSyntaxError: {found.message}"
+
+
+# 事前チェックの回帰確認用: node --check が通す JS（事前チェックが「確実な NG」を出してはいけない）
+# - 変数名としての of / await / yield の後の割り算
+# - 数値 "1." の直後の割り算
+# - #return / ñreturn のようにキーワードで終わる識別子の後の割り算
+# - HTML 風コメント（<!-- / -->）の中の引用符など
+JS_STRUCTURE_VALID_SAMPLES = (
+    "let of = 4; var x = of / 2;",
+    "var await = 4; x = await / 2;",
+    "var yield = 4; x = yield / 2;",
+    "var x = 1./2;",
+    "var of = 4; x = of / 2; y = '/';",
+    "function* g() { yield /ab/g; }",
+    "async function f() { await /x/.test('x'); }",
+    # private 名 / 非 ASCII 識別子の末尾がキーワードと同じ綴り
+    "class A{ #return=1; m(){ return this.#return / 2 } }",
+    "var \u00f1return = 4; x = \u00f1return / 2;",
+    # HTML 風コメント
+    "<!-- it's a comment\nvar x=1;",
+)
+
+
+def js_structure_self_check() -> List[str]:
+    """
+    JS_STRUCTURE_VALID_SAMPLES のうち、事前チェックが確実な NG を出してしまうものを返す（起動時に確認する）。
+    """
+    failed = []
+    for src in JS_STRUCTURE_VALID_SAMPLES:
+        found = check_js_structure(src)
+        if found is not None and found.certain:
+            failed.append(src)
+    return failed
+
+
+# ============================================================
+# 関数定義インデックス（/api/extract の symbols 用）
+# ------------------------------------------------------------
+# extract_function_whole は「シンボルごとに8パターンを全文検索」していたため、
+# symbols × sources 回の全文走査になっていた。
+# ソース1つにつき、パターン種別ごとに名前を一般化した正規表現で1回だけ走査し、
+# 「名前 → 最初の定義位置」を引けるようにする（内容SHA256ごとにメモリ LRU へ載せる）。
+# ============================================================
+# extract_function_whole の検索順（= 優先順）と同じ並び。{name} に名前の正規表現が入る
+_JS_DEF_PATTERN_TEMPLATES = (
+    # 追加した処理: async / export / export default / generator 付きの関数宣言も拾う（現実のJSで頻出）
+    r"(^|\n)\s*(?:export\s+default\s+)?(?:export\s+)?function\s+{name}\s*\(",
+    r"(^|\n)\s*(?:export\s+default\s+)?(?:export\s+)?async\s+function\s+{name}\s*\(",
+    r"(^|\n)\s*(?:export\s+default\s+)?(?:export\s+)?function\s*\*\s*{name}\s*\(",
+    r"(^|\n)\s*(?:export\s+default\s+)?(?:export\s+)?async\s+function\s*\*\s*{name}\s*\(",
+
+    # 既存: 通常の function NAME( ももちろん拾う（上の export 系で拾えないケースの保険ではなく、素直な網羅）
+    r"(^|\n)\s*function\s+{name}\s*\(",
+
+    # 既存: var/let/const NAME = function(
+    r"(^|\n)\s*(?:var|let|const)\s+{name}\s*=\s*function\s*\(",
+
+    # 既存: var/let/const NAME = (...) => { / NAME = x => { （ブロックarrowのみ = “まるごと”抽出できる）
+    r"(^|\n)\s*(?:var|let|const)\s+{name}\s*=\s*\([^)]*\)\s*=>\s*{{",
+    r"(^|\n)\s*(?:var|let|const)\s+{name}\s*=\s*[A-Za-z_$][A-Za-z0-9_$]*\s*=>\s*{{",
+)
 
-        i += 1
+_RE_JS_DEF_GENERIC = [
+    re.compile(t.format(name="(?P<name>" + _JS_IDENT + ")"), re.MULTILINE)
+    for t in _JS_DEF_PATTERN_TEMPLATES
+]
 
-    return -1
 
+@lru_cache(maxsize=REGEX_MEMO_MAX_ENTRIES)
+def _re_js_def_patterns_for(name: str) -> Tuple["re.Pattern", ...]:
+    """
+    name 固定の関数定義パターン（_JS_DEF_PATTERN_TEMPLATES と同じ並び）。
+    """
+    return tuple(re.compile(t.format(name=re.escape(name)), re.MULTILINE) for t in _JS_DEF_PATTERN_TEMPLATES)
+
+
+@lru_cache(maxsize=REGEX_MEMO_MAX_ENTRIES)
+def _re_needle_alternation(needles: Tuple[str, ...]) -> "re.Pattern":
+    """
+    needle 群の選択パターン（長い順。同じ位置では長い needle を優先する）。
+    """
+    return re.compile("|".join(re.escape(nd) for nd in sorted(needles, key=len, reverse=True)))
+
+
+class JsDefinitionIndex:
+    """
+    1ソース分の「名前 → 定義の (開始, ヘッダ末尾)」表と、対応ブレース終端のメモ。
+    - パターン種別ごとに「その名前で最初にマッチした位置」だけを持つ（extract_function_whole の re.search と同じ）
+    - 対応ブレース終端は引かれたときに初めて計算し、以降は使い回す（= コストは出力サイズに比例）
+    """
+
+    __slots__ = ("text", "first_by_kind", "_brace_ends")
+
+    def __init__(self, text: str) -> None:
+        s = str(text or "")
+        self.text = s
+        self.first_by_kind: List[dict] = []
+        self._brace_ends: dict = {}
+
+        for rx in _RE_JS_DEF_GENERIC:
+            first: dict = {}
+            pos = 0
+            while True:
+                m = rx.search(s, pos)
+                if not m:
+                    break
+                nm = m.group("name")
+                if nm not in first:
+                    first[nm] = (m.start(0), m.end(0))
+                # 同じ開始位置の別解釈は無いので、次の開始候補から探し直す（取りこぼし防止のため名前まで飛ばさない）
+                pos = m.start(0) + 1
+            self.first_by_kind.append(first)
+
+    def find(self, name: str) -> Optional[Tuple[int, int]]:
+        """
+        name の定義（検索順で最初の種別の、最初のマッチ）の (開始, ヘッダ末尾) を返す。無ければ None。
+        """
+        for first in self.first_by_kind:
+            hit = first.get(name)
+            if hit is not None:
+                return hit
+        return None
+
+    def brace_end(self, header_end: int) -> int:
+        """
+        _find_matching_brace_end(text, header_end) のメモ化版。
+        """
+        end = self._brace_ends.get(header_end)
+        if end is None:
+            end = _find_matching_brace_end(self.text, header_end)
+            self._brace_ends[header_end] = end
+        return end
+
+
+def get_js_definition_index(js_text: str) -> JsDefinitionIndex:
+    """
+    内容SHA256ごとに JsDefinitionIndex を作って使い回す。
+    """
+    s = str(js_text or "")
+    key = sha256_hex(s)
+    idx = _DEFINITION_INDEX_CACHE.get(key)
+    if idx is None:
+        idx = JsDefinitionIndex(s)
+        _DEFINITION_INDEX_CACHE.put(key, idx, persist=False)
+    return idx
 
-def extract_function_whole(js_text: str, name: str) -> Tuple[bool, str, str]:
+
+def extract_function_whole(js_text: str, name: str, def_index: Optional[JsDefinitionIndex] = None) -> Tuple[bool, str, str]:
     """
     関数 “まるごと” 抽出（簡易）
     - function NAME(...) {...}
     - var NAME = function(...) {...}
     - const NAME = (...) => {...}
     - let NAME = (...) => {...}
+    - def_index を渡すと、同じソースに対する複数シンボルで定義インデックスを使い回す
     戻り値: (found, header, body)
     """
     s = str(js_text or "")
@@ -1005,42 +1524,31 @@ def extract_function_whole(js_text: str, name: str) -> Tuple[bool, str, str]:
     if target == "":
         return (False, "name is empty", "")
 
-    import re
-
-    patterns = [
-        # 追加した処理: async / export / export default / generator 付きの関数宣言も拾う（現実のJSで頻出）
-        re.compile(r"(^|\n)\s*(?:export\s+default\s+)?(?:export\s+)?function\s+" + re.escape(target) + r"\s*\(", re.MULTILINE),
-        re.compile(r"(^|\n)\s*(?:export\s+default\s+)?(?:export\s+)?async\s+function\s+" + re.escape(target) + r"\s*\(", re.MULTILINE),
-        re.compile(r"(^|\n)\s*(?:export\s+default\s+)?(?:export\s+)?function\s*\*\s*" + re.escape(target) + r"\s*\(", re.MULTILINE),
-        re.compile(r"(^|\n)\s*(?:export\s+default\s+)?(?:export\s+)?async\s+function\s*\*\s*" + re.escape(target) + r"\s*\(", re.MULTILINE),
-
-        # 既存: 通常の function NAME( ももちろん拾う（上の export 系で拾えないケースの保険ではなく、素直な網羅）
-        re.compile(r"(^|\n)\s*function\s+" + re.escape(target) + r"\s*\(", re.MULTILINE),
-
-        # 既存: var/let/const NAME = function(
-        re.compile(r"(^|\n)\s*(?:var|let|const)\s+" + re.escape(target) + r"\s*=\s*function\s*\(", re.MULTILINE),
-
-        # 既存: var/let/const NAME = (...) => { / NAME = x => { （ブロックarrowのみ = “まるごと”抽出できる）
-        re.compile(r"(^|\n)\s*(?:var|let|const)\s+" + re.escape(target) + r"\s*=\s*\([^)]*\)\s*=>\s*{", re.MULTILINE),
-        re.compile(r"(^|\n)\s*(?:var|let|const)\s+" + re.escape(target) + r"\s*=\s*[A-Za-z_$][A-Za-z0-9_$]*\s*=>\s*{", re.MULTILINE),
-    ]
+    if def_index is not None and def_index.text == s and _RE_JS_IDENT_FULL.fullmatch(target):
+        hit = def_index.find(target)
+        if hit is None:
+            return (False, "not found", "")
+        start_pos, header_end = hit
+        end_pos = def_index.brace_end(header_end)
+    else:
+        # 識別子でない名前（a.b など）はインデックスに載らないので、従来どおり名前ごとに検索する
+        best = None
+        for rg in _re_js_def_patterns_for(target):
+            m = rg.search(s)
+            if m:
+                best = m
+                break
 
-    best = None
-    for rg in patterns:
-        m = rg.search(s)
-        if m:
-            best = m
-            break
+        if not best:
+            return (False, "not found", "")
 
-    if not best:
-        return (False, "not found", "")
+        start_pos = best.start(0)
+        end_pos = _find_matching_brace_end(s, best.end(0))
 
-    start_pos = best.start(0)
     # start_pos が "\n" を含むマッチの場合、行頭から取る
     if start_pos > 0 and s[start_pos] == "\n":
         start_pos = start_pos + 1
 
-    end_pos = _find_matching_brace_end(s, best.end(0))
     if end_pos == -1:
         return (False, "found start but brace not closed", "")
 
@@ -1049,9 +1557,16 @@ def extract_function_whole(js_text: str, name: str) -> Tuple[bool, str, str]:
     return (True, header, body)
 
 
-def extract_context_around(js_text: str, needle: str, context_lines: int, max_matches: int) -> Tuple[int, List[Tuple[str, str]]]:
+def extract_context_around(
+    js_text: str,
+    needle: str,
+    context_lines: int,
+    max_matches: int,
+    line_index: Optional[LineIndex] = None,
+) -> Tuple[int, List[Tuple[str, str]]]:
     """
     文字列 needle のヒット行を中心に ±context_lines 行を抽出する。
+    - line_index を渡すと、同じソースに対する複数 needle で行インデックスを使い回す
     戻り値: (hit_count, blocks[(header, body)])
     """
     s = str(js_text or "")
@@ -1070,8 +1585,7 @@ def extract_context_around(js_text: str, needle: str, context_lines: int, max_ma
     if mm <= 0:
         mm = DEFAULT_EXTRACT_MAX_MATCHES
 
-    line_starts = _line_start_offsets(s)
-    lines = s.splitlines(True)
+    lix = line_index if line_index is not None else LineIndex(s)
 
     blocks: List[Tuple[str, str]] = []
     hit_count = 0
@@ -1085,11 +1599,11 @@ def extract_context_around(js_text: str, needle: str, context_lines: int, max_ma
 
         hit_count += 1
         if hit_count <= mm:
-            li = _offset_to_line_index(line_starts, j)
+            li = lix.offset_to_line(j)
             a = max(0, li - ctx)
-            b = min(len(lines), li + ctx + 1)
+            b = min(lix.line_count, li + ctx + 1)
 
-            body = "".join(lines[a:b])
+            body = lix.slice_lines(a, b)
             header = f"EXTRACT_CONTEXT: '{nd}' hit_line={li + 1} range_lines={a + 1}..{b}"
             blocks.append((header, body))
 
@@ -1102,6 +1616,91 @@ def extract_context_around(js_text: str, needle: str, context_lines: int, max_ma
     return (hit_count, blocks)
 
 
+def extract_contexts_multi(
+    js_text: str,
+    needles: List[str],
+    context_lines: int,
+    max_matches: int,
+    line_index: Optional[LineIndex] = None,
+) -> dict:
+    """
+    extract_context_around を複数 needle まとめて1回の走査で行う。
+    - 全 needle の選択（長い順）を1本の正規表現にして、ヒット候補位置だけを順に拾う
+    - 各 needle のヒット判定（重ならない / max_matches で打ち切り）は extract_context_around と同じ
+    戻り値: {needle: (hit_count, blocks[(header, body)])}
+    """
+    s = str(js_text or "")
+    nds = []
+    for x in needles or []:
+        nd = str(x or "")
+        if nd != "" and nd not in nds:
+            nds.append(nd)
+
+    out: dict = {}
+    if not nds:
+        return out
+
+    try:
+        ctx = int(context_lines)
+    except Exception:
+        ctx = DEFAULT_EXTRACT_CONTEXT_LINES
+    if ctx < 0:
+        ctx = 0
+
+    try:
+        mm = int(max_matches)
+    except Exception:
+        mm = DEFAULT_EXTRACT_MAX_MATCHES
+    if mm <= 0:
+        mm = DEFAULT_EXTRACT_MAX_MATCHES
+
+    lix = line_index if line_index is not None else LineIndex(s)
+
+    hit_counts = {nd: 0 for nd in nds}
+    next_pos = {nd: 0 for nd in nds}
+    blocks_by = {nd: [] for nd in nds}
+    active = list(nds)
+
+    rx = _re_needle_alternation(tuple(active))
+
+    pos = 0
+    n = len(s)
+    while active and pos < n:
+        m = rx.search(s, pos)
+        if not m:
+            break
+        j = m.start()
+
+        done = False
+        for nd in active:
+            if j < next_pos[nd] or not s.startswith(nd, j):
+                continue
+
+            hit_counts[nd] += 1
+            li = lix.offset_to_line(j)
+            a = max(0, li - ctx)
+            b = min(lix.line_count, li + ctx + 1)
+            header = f"EXTRACT_CONTEXT: '{nd}' hit_line={li + 1} range_lines={a + 1}..{b}"
+            blocks_by[nd].append((header, lix.slice_lines(a, b)))
+
+            next_pos[nd] = j + len(nd)
+            if hit_counts[nd] >= mm:
+                done = True
+
+        if done:
+            # 打ち切った needle は候補から外す（残りが無ければ走査終了）
+            active = [nd for nd in active if hit_counts[nd] < mm]
+            if active:
+                rx = _re_needle_alternation(tuple(active))
+
+        # 別の needle が途中から始まる可能性があるので、1文字ずつ進めて次の候補を探す
+        pos = j + 1
+
+    for nd in nds:
+        out[nd] = (hit_counts[nd], blocks_by[nd])
+    return out
+
+
 def build_expected_partids(parts: List[SplitPart]) -> List[str]:
     return [p.part_id for p in parts]
 
@@ -1111,6 +1710,20 @@ def build_cumulative_partids(parts: List[SplitPart], upto_index_inclusive: int)
     return [p.part_id for p in parts if p.global_index <= upto_index_inclusive]
 
 
+def build_partid_prefix_index(parts: List[SplitPart]) -> Tuple[List[int], List[str]]:
+    """
+    global_index 昇順の (global_index 列, PartID 列)。
+    パートごとに build_cumulative_partids で全件を舐め直す代わりに、二分探索 + スライスで累積リストを引く。
+    """
+    order = sorted(parts, key=lambda x: x.global_index)
+    return ([int(x.global_index) for x in order], [x.part_id for x in order])
+
+
+def cumulative_partids_from_index(prefix_index: Tuple[List[int], List[str]], upto_index_inclusive: int) -> List[str]:
+    gis, ids = prefix_index
+    return ids[:bisect_right(gis, upto_index_inclusive)]
+
+
 def build_scope_index_block(full_js_text: str) -> str:
     """
     連結後JS（= 元のフルJS）に「探索用の索引」を埋め込む。
@@ -1124,61 +1737,128 @@ def build_scope_index_block(full_js_text: str) -> str:
       - 厳密な構文解析（AST）はしない（速度優先・依存ゼロ）。
       - 「存在確認/検索補助」用途に徹し、過剰な出力は上限で抑える。
     """
-    s = str(full_js_text or "")
+    return render_scope_index_block(scan_scope_index(full_js_text))
 
-    import re
-    from collections import Counter
 
-    # ----------------------------
-    # 1) JS識別子（宣言/参照問わず）
-    # ----------------------------
-    tokens = re.findall(r"\b[A-Za-z_$][A-Za-z0-9_$]*\b", s)
-
-    reserved = {
-        "await","break","case","catch","class","const","continue","debugger","default","delete",
-        "do","else","enum","export","extends","false","finally","for","function","if","import",
-        "in","instanceof","let","new","null","return","super","switch","this","throw","true",
-        "try","typeof","var","void","while","with","yield",
-        "implements","interface","package","private","protected","public","static",
+@dataclass
+class ScopeIndexData:
+    # 識別子（予約語除外）の出現回数。挿入順 = 初出順（most_common の同数時の並びに効く）
+    ident_counter: Counter
+    dom_ids: set
+    dom_classes: set
+    dom_names: set
+    selectors_1: set
+    selectors_all: set
+    ls_keys: set
+    ss_keys: set
+
+
+def scan_scope_index(full_js_text: str) -> ScopeIndexData:
+    """
+    SCOPE_INDEX の材料を集める（従来の識別子 findall + 文字列キー findall x11 と同じ結果）。
+    - 識別子: 1回の findall をそのまま Counter に渡し、予約語のキーだけ後から消す（挿入順 = 初出順は保たれる）
+    - 文字列キー: 呼び出し名の共通部分を str.find で探し、見つかった位置だけ11種をまとめたパターンで照合して振り分ける
+      （選択パターンのまま全文を search すると、リテラル先頭の高速化が効かず 11 回の findall より遅い）
+    """
+    s = str(full_js_text or "")
+
+    data = new_scope_index_data()
+
+    ident_counter = data.ident_counter
+    ident_counter.update(_RE_JS_IDENT_TOKEN.findall(s))
+    for w in JS_RESERVED_WORDS:
+        ident_counter.pop(w, None)
+    dom_sets = {
+        "getElementById": data.dom_ids,
+        "getElementsByClassName": data.dom_classes,
+        "getElementsByName": data.dom_names,
+        "querySelector": data.selectors_1,
+        "querySelectorAll": data.selectors_all,
     }
+    store_sets = {"localStorage": data.ls_keys, "sessionStorage": data.ss_keys}
+
+    match_call = _RE_SCOPE_CALL.match
+    for stem, backs in SCOPE_CALL_STEMS:
+        i = s.find(stem)
+        while i != -1:
+            for back in backs:
+                m = match_call(s, i - back) if i >= back else None
+                if m is None:
+                    continue
+                dom, dom_v, store, store_v, store_set_v = m.groups()
+                if dom:
+                    dom_sets[dom].add(dom_v)
+                else:
+                    store_sets[store].add(store_v or store_set_v)
+                break
+            i = s.find(stem, i + 1)
+
+    return data
+
+
+def new_scope_index_data() -> ScopeIndexData:
+    return ScopeIndexData(
+        ident_counter=Counter(),
+        dom_ids=set(),
+        dom_classes=set(),
+        dom_names=set(),
+        selectors_1=set(),
+        selectors_all=set(),
+        ls_keys=set(),
+        ss_keys=set(),
+    )
 
-    ident_list = [t for t in tokens if t and t not in reserved]
-    ident_counter = Counter(ident_list)
-    ident_uniq = sorted(set(ident_list))
 
-    # ----------------------------
-    # 2) DOM / selector / localStorage key（文字列抽出）
-    #    ※「見落としやすいが、実作業で必要になりがち」なので索引化する
-    # ----------------------------
-    def _uniq_sorted(xs):
-        return sorted({str(x) for x in xs if str(x).strip() != ""})
+_SCOPE_INDEX_SET_FIELDS = ("dom_ids", "dom_classes", "dom_names", "selectors_1", "selectors_all", "ls_keys", "ss_keys")
+
+
+def merge_scope_index(into: ScopeIndexData, other: ScopeIndexData) -> None:
+    """
+    other を into に足し込む（O(索引サイズ)）。
+    テキストを連結してから scan_scope_index したのと同じ結果になる（識別子の初出順も other の順で後ろに付く）。
+    """
+    into.ident_counter.update(other.ident_counter)
+    for f in _SCOPE_INDEX_SET_FIELDS:
+        getattr(into, f).update(getattr(other, f))
 
-    # getElementById("...") / getElementsByClassName("...") / getElementsByName("...")
-    dom_ids = re.findall(r"getElementById\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
-    dom_classes = re.findall(r"getElementsByClassName\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
-    dom_names = re.findall(r"getElementsByName\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
 
-    # querySelector("...") / querySelectorAll("...")
-    qs_1 = re.findall(r"querySelector\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
-    qs_all = re.findall(r"querySelectorAll\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
+def scope_index_to_json(data: ScopeIndexData) -> dict:
+    """
+    split キャッシュに置ける形にする（識別子は初出順の [name, count] 列）。
+    """
+    out = {"version": SPLIT_CACHE_VERSION, "idents": [[k, int(v)] for k, v in data.ident_counter.items()]}
+    for f in _SCOPE_INDEX_SET_FIELDS:
+        out[f] = sorted(getattr(data, f))
+    return out
+
+
+def scope_index_from_json(obj: dict) -> ScopeIndexData:
+    data = new_scope_index_data()
+    for k, v in obj.get("idents") or []:
+        data.ident_counter[str(k)] = int(v)
+    for f in _SCOPE_INDEX_SET_FIELDS:
+        getattr(data, f).update(str(x) for x in (obj.get(f) or []))
+    return data
 
-    # localStorage/sessionStorage keys
-    ls_get = re.findall(r"localStorage\.getItem\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
-    ls_set = re.findall(r"localStorage\.setItem\(\s*['\"]([^'\"]+)['\"]\s*,", s)
-    ls_rm = re.findall(r"localStorage\.removeItem\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
 
-    ss_get = re.findall(r"sessionStorage\.getItem\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
-    ss_set = re.findall(r"sessionStorage\.setItem\(\s*['\"]([^'\"]+)['\"]\s*,", s)
-    ss_rm = re.findall(r"sessionStorage\.removeItem\(\s*['\"]([^'\"]+)['\"]\s*\)", s)
+def render_scope_index_block(data: ScopeIndexData) -> str:
+    """
+    ScopeIndexData から SCOPE_INDEX ブロック本文を作る（上限付き）。
+    """
+    def _uniq_sorted(xs):
+        return sorted({str(x) for x in xs if str(x).strip() != ""})
+
+    ident_counter = data.ident_counter
+    ident_uniq = sorted(ident_counter)
 
-    dom_ids_u = _uniq_sorted(dom_ids)
-    dom_classes_u = _uniq_sorted(dom_classes)
-    dom_names_u = _uniq_sorted(dom_names)
-    qs_1_u = _uniq_sorted(qs_1)
-    qs_all_u = _uniq_sorted(qs_all)
+    dom_ids_u = _uniq_sorted(data.dom_ids)
+    dom_classes_u = _uniq_sorted(data.dom_classes)
+    dom_names_u = _uniq_sorted(data.dom_names)
+    qs_1_u = _uniq_sorted(data.selectors_1)
+    qs_all_u = _uniq_sorted(data.selectors_all)
 
-    ls_keys_u = _uniq_sorted(ls_get + ls_set + ls_rm)
-    ss_keys_u = _uniq_sorted(ss_get + ss_set + ss_rm)
+    ls_keys_u = _uniq_sorted(data.ls_keys)
+    ss_keys_u = _uniq_sorted(data.ss_keys)
 
     # ----------------------------
     # 3) 出力（上限付き）
@@ -1412,16 +2092,17 @@ def build_receipt_input_block(
     lines.append(f"RECEIVED_TOTAL: {len(cumulative_ids)}")
     lines.append("")
     lines.append("CUMULATIVE_RECEIVED_PARTIDS:")
-    for pid in cumulative_ids:
-        lines.append(f"- {pid}")
+    lines.extend(["- " + pid for pid in cumulative_ids])
 
     if is_last:
         lines.append("")
         lines.append("EXPECTED_PARTIDS_WITH_SHA256:")
+        # PartID → SHA256 の対応表（受領検証用）。同じ PartID が複数あれば先頭を使う
+        sha_by_partid: dict = {}
+        for x in parts:
+            sha_by_partid.setdefault(x.part_id, x.part_sha256)
         for p in expected_ids:
-            # PartID → SHA256 の対応表（受領検証用）
-            part = next(x for x in parts if x.part_id == p)
-            lines.append(f"- {part.part_id} | {part.part_sha256}")
+            lines.append(f"- {p} | {sha_by_partid[p]}")
 
     lines.append("")
     lines.append("【ChatGPTへの強制ルール】")
@@ -1526,6 +2207,22 @@ def build_protocol_epilogue() -> str:
     return "\n".join(lines)
 
 
+def build_part_scope_hints(part_text: str) -> Tuple[str, str]:
+    """
+    PART_SCOPE_HINT 強化（パート本文だけから抽出）
+    - TopIdentifiers: 頻出識別子TopN
+    - Defines: このパート内で定義している可能性が高い名前
+    戻り値: (top_ident_str, defines_str)
+    """
+    top_items = _part_top_identifiers(part_text, 12)
+    top_ident_str = ", ".join([f"{name}:{cnt}" for (name, cnt) in top_items]) if top_items else ""
+
+    defines_list = _part_defines(part_text, 40)
+    defines_str = ", ".join(defines_list) if defines_list else ""
+
+    return (top_ident_str, defines_str)
+
+
 def make_part_payload(
     part: SplitPart,
     language_tag: str,
@@ -1533,16 +2230,14 @@ def make_part_payload(
     receipt_input_block: str,
     protocol_epilogue: str,
 ) -> str:
-    # ============================================================
-    # PART_SCOPE_HINT 強化（パート本文だけから抽出）
-    # - TopIdentifiers: 頻出識別子TopN
-    # - Defines: このパート内で定義している可能性が高い名前
-    # ============================================================
-    top_items = _part_top_identifiers(part.text, 12)
-    top_ident_str = ", ".join([f"{name}:{cnt}" for (name, cnt) in top_items]) if top_items else ""
+    # 本文はここで1回だけ切り出す（パート表は offsets だけを持つ）
+    text = part.text
 
-    defines_list = _part_defines(part.text, 40)
-    defines_str = ", ".join(defines_list) if defines_list else ""
+    # 追加した処理: split キャッシュ済みのヒントがあればそれを使い、パート本文の再走査を省く
+    scope_hints = part.scope_hints
+    if scope_hints is None:
+        scope_hints = build_part_scope_hints(text)
+    top_ident_str, defines_str = scope_hints
 
     header_lines: List[str] = []
     header_lines.append("<<<PART_BEGIN>>>")
@@ -1552,11 +2247,11 @@ def make_part_payload(
     # 追加した処理: 各パートが「どの入力ファイル由来か」をヘッダに明示し、貼り付け後も由来を一目で追えるようにする
     header_lines.append(f"SourceFile: {part.source_filename}")
     header_lines.append(f"PartSHA256: {part.part_sha256}")
-    header_lines.append(f"Range: chars {part.start_offset}..{part.end_offset} (len={len(part.text)})")
+    header_lines.append(f"Range: chars {part.start_offset}..{part.end_offset} (len={len(text)})")
     header_lines.append(f"FirstLine: {part.first_line}")
     header_lines.append(f"LastLine: {part.last_line}")
     # 追加した処理: パート末尾に“実際の改行”が存在するかを明記し、JOIN時に暗黙改行を挿入させないための根拠にする
-    header_lines.append(f"EndNewline: {'YES' if part.text.endswith(chr(10)) else 'NO'}")
+    header_lines.append(f"EndNewline: {'YES' if text.endswith(chr(10)) else 'NO'}")
     header_lines.append(f"PART_SCOPE_HINT: LineRange=L{part.start_line}..L{part.end_line} | BraceDepth={part.brace_depth_start}->{part.brace_depth_end}")
 
     # 追加した処理: パート内の探索効率を上げる（頻出識別子 / 定義名）
@@ -1584,7 +2279,78 @@ def make_part_payload(
         footer_lines.append(f"【分割コード({part.global_index})の終了】→ これで最後です（全{part.global_total}分割）")
         footer_lines.append(protocol_epilogue)
 
-    return header_text + "\n" + part.text + "\n" + "\n".join(footer_lines) + "\n"
+    return header_text + "\n" + text + "\n" + "\n".join(footer_lines) + "\n"
+
+
+# コード本文ではないパート（本文は text 扱い）
+NON_CODE_PART_SOURCES = ("PROTOCOL_PREAMBLE", "SCOPE_CHECK_EXTRACT_CODE", "EXEC_TASK")
+
+
+def render_part_payload(
+    part: SplitPart,
+    lang: str,
+    cumulative_ids: List[str],
+    expected_ids: List[str],
+    parts: List[SplitPart],
+    exec_task_text: str,
+    scope_index_block: str,
+    protocol_epilogue: str,
+) -> str:
+    """
+    1パート分の payload（RECEIPT_INPUT 込み）を組み立てる。
+    - EXEC_TASK / SCOPE_INDEX / SHA256 対応表を載せるのは全体の最終パートだけ（parts はその対応表にだけ使う）
+    """
+    # ★ 追加した処理: EXEC_TASK を載せるのは “全体の最終パートだけ”（最終パートは EXEC_TASK 専用）
+    is_last_overall = (part.global_index == part.global_total)
+
+    # 追加した処理: PROTOCOL_PREAMBLE / 抽出追加パート / EXEC_TASK はコード本文ではないため text 扱いにする
+    lang_tag = "text" if str(part.source_filename) in NON_CODE_PART_SOURCES else lang
+
+    receipt_input = build_receipt_input_block(
+        cumulative_ids=cumulative_ids,
+        expected_ids=expected_ids,
+        is_last=bool(is_last_overall),
+        exec_task_text=exec_task_text if is_last_overall else "",
+        parts=parts,
+        scope_index_block=scope_index_block if is_last_overall else "",
+        scope_extract_code="",
+    )
+
+    # 追加した処理: protocol_preamble は前文専用パートの本文として出すため、
+    #               make_part_payload() 側へ混在させない（常に空を渡す）
+    return make_part_payload(
+        part=part,
+        language_tag=lang_tag,
+        protocol_preamble="",
+        receipt_input_block=receipt_input,
+        protocol_epilogue=protocol_epilogue,
+    )
+
+
+def render_part_payload_batch(
+    batch: List[SplitPart],
+    lang: str,
+    partid_prefix_index: Tuple[List[int], List[str]],
+    expected_ids: List[str],
+    protocol_epilogue: str,
+) -> List[str]:
+    """
+    最終パート以外の payload をまとめて組み立てる（CPU プール用）。
+    累積 PartID はワーカー側で前置インデックスから引く（パートごとの累積リストを受け渡さない）。
+    """
+    return [
+        render_part_payload(
+            part=p,
+            lang=lang,
+            cumulative_ids=cumulative_partids_from_index(partid_prefix_index, p.global_index),
+            expected_ids=expected_ids,
+            parts=[],
+            exec_task_text="",
+            scope_index_block="",
+            protocol_epilogue=protocol_epilogue,
+        )
+        for p in batch
+    ]
 
 
 def write_manifest_json(
@@ -1601,7 +2367,11 @@ def write_manifest_json(
     project_id: str,
     task_id: str,
     request_id: str,
-) -> None:
+    originals: Optional[List[dict]] = None,
+) -> dict:
+    """
+    RUN ディレクトリに manifest.json を書き、書いた内容（dict）を返す（RUN 索引の更新にも使う）。
+    """
     manifest = {
         "session_id": session_id,
         "created_at": datetime.now().isoformat(timespec="seconds"),
@@ -1613,7 +2383,7 @@ def write_manifest_json(
         },
         "input": {
             "filename": input_filename,
-            "size_chars": sum(len(p.text) for p in parts),
+            "size_chars": sum(p.text_len for p in parts),
             "sha256": original_sha256,
             "saved_copy": str(original_saved_relpath),
         },
@@ -1632,13 +2402,17 @@ def write_manifest_json(
                 "part_sha256": p.part_sha256,
                 "start_offset": p.start_offset,
                 "end_offset": p.end_offset,
-                "len_chars": len(p.text),
+                "len_chars": p.text_len,
                 "file": f"parts/part_{p.global_index:02d}.txt",
             }
             for p in parts
         ],
     }
+    # 追加した処理: 全入力ファイルの内容SHA256（= blobs/<sha256>）を記録する（先頭ファイル以外も追えるようにする）
+    if originals is not None:
+        manifest["originals"] = list(originals)
     (out_dir / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    return manifest
 
 
 from pathlib import Path
@@ -1701,48 +2475,1547 @@ def check_js_syntax_with_node(filename: str, content: str) -> Tuple[bool, str]:
         return False, f"syntax check failed: {e}"
 
 
-def now_tag() -> str:
-    return datetime.now().strftime("%Y%m%d_%H%M%S")
+# ============================================================
+# 常駐 node 構文チェッカ（/api/check 用）
+# ------------------------------------------------------------
+# node --check をリクエストごとに起動すると、起動だけで 40〜80ms かかる。
+# node を1つ常駐させ、stdin/stdout の「4バイト長（big endian）+ UTF-8 JSON」フレームでソースを渡して構文だけ判定する。
+# - 要求: {"id", "filename", "source"} / 応答: {"id", "ok", "error"}（"fallback": true は従来の node --check で判定し直す）
+# - 応答は id で対応付けるので、複数ファイルは書き込みを先に全部流して結果をまとめて待てる（パイプライン）
+# - プロセスが落ちたら次の要求で起動し直す（落ちたときに待っていた要求は1回だけ再送する）
+# - argv を差し替えれば、同じプロトコルを話すスタブで node の代わりにできる
+# ============================================================
+NODE_CHECK_WORKER_JS = r"""
+const vm = require("vm");
+const CJS_PARAMS = ["exports", "require", "module", "__filename", "__dirname"];
+// node --check の .js は CJS で通らないとき、この種のエラーなら ESM として判定し直す
+const ESM_HINT = /Cannot use import statement|Unexpected token 'export'|import\.meta|await is only valid/;
+
+function formatError(e) {
+  const s = String((e && e.stack) || e);
+  const i = s.indexOf("\n    at ");
+  return i >= 0 ? s.slice(0, i) : s;
+}
+
+function checkModule(source, filename) {
+  // ESM の SyntaxError には位置が付かないので、NG のときは node --check で判定し直してもらう
+  if (typeof vm.SourceTextModule !== "function") return { fallback: true };
+  try {
+    new vm.SourceTextModule(source, { identifier: filename });
+    return { ok: true };
+  } catch (e) {
+    return { ok: false, fallback: true };
+  }
+}
+
+function checkSource(filename, source) {
+  const lower = filename.toLowerCase();
+  // 先頭の #! 行は関数本体としては通らないので、同じ長さのコメントにする
+  if (source.startsWith("#!")) source = "//" + source.slice(2);
+  if (lower.endsWith(".mjs")) return checkModule(source, filename);
+  try {
+    vm.compileFunction(source, CJS_PARAMS, { filename });
+    return { ok: true };
+  } catch (e) {
+    if (lower.endsWith(".cjs") || !ESM_HINT.test(String(e && e.message))) {
+      return { ok: false, error: formatError(e) };
+    }
+    return checkModule(source, filename);
+  }
+}
+
+function send(obj) {
+  const body = Buffer.from(JSON.stringify(obj), "utf8");
+  const head = Buffer.alloc(4);
+  head.writeUInt32BE(body.length, 0);
+  process.stdout.write(Buffer.concat([head, body]));
+}
+
+let chunks = [];
+let total = 0;
+process.stdin.on("data", (chunk) => {
+  chunks.push(chunk);
+  total += chunk.length;
+  while (total >= 4) {
+    let buf = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks, total);
+    const n = buf.readUInt32BE(0);
+    if (total < 4 + n) {
+      chunks = [buf];
+      break;
+    }
+    const msg = JSON.parse(buf.subarray(4, 4 + n).toString("utf8"));
+    buf = buf.subarray(4 + n);
+    chunks = buf.length ? [buf] : [];
+    total = buf.length;
+    let res;
+    try {
+      res = checkSource(String(msg.filename || "input.js"), String(msg.source || ""));
+    } catch (e) {
+      res = { ok: false, fallback: true };
+    }
+    res.id = msg.id;
+    send(res);
+  }
+});
+process.stdin.on("end", () => process.exit(0));
+"""
+
+# 常駐チェッカの起動コマンド（スタブに差し替える場合は同じフレーム形式を話すコマンドにする）
+NODE_CHECK_WORKER_CMD = ("node", "--experimental-vm-modules", "--no-warnings", "-e", NODE_CHECK_WORKER_JS)
+
+# 1ファイルの判定を待つ上限（超えたら常駐プロセスを落として起動し直す）
+NODE_CHECK_TIMEOUT_SEC = 30.0
+
+# 常駐チェッカの数（/api/check/batch はファイルをこの数のプロセスへ分けて同時に判定する）
+NODE_CHECK_POOL_SIZE = 2
+
+
+def _read_exact(stream, n: int) -> Optional[bytes]:
+    """
+    stream から n バイト読む（途中で EOF なら None）
+    """
+    data = stream.read(n)
+    if data is None or len(data) < n:
+        return None
+    return data
+
+
+class NodeCheckWorker:
+    def __init__(self, argv) -> None:
+        self.argv = list(argv)
+        # _state_lock: プロセス/待ち表の入れ替え用（短時間だけ持つ）
+        # _write_lock: stdin へのフレーム書き込みの直列化用（大きいソースの書き込み中も応答の読み取りは止めない）
+        self._state_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._pending: dict = {}
+        self._next_id = 0
+
+    def _ensure_started(self) -> subprocess.Popen:
+        # 呼び出し側で self._state_lock を取っていること
+        proc = self._proc
+        if proc is not None and proc.poll() is None:
+            return proc
+        proc = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._proc = proc
+        threading.Thread(target=self._read_loop, args=(proc,), daemon=True).start()
+        return proc
+
+    def _read_loop(self, proc: subprocess.Popen) -> None:
+        try:
+            while True:
+                head = _read_exact(proc.stdout, 4)
+                if head is None:
+                    break
+                body = _read_exact(proc.stdout, int.from_bytes(head, "big"))
+                if body is None:
+                    break
+                msg = json.loads(body.decode("utf-8"))
+                with self._state_lock:
+                    ent = self._pending.pop(msg.get("id"), None)
+                if ent is not None:
+                    ent[0].set_result(msg)
+        except Exception:
+            pass
+
+        # プロセスが終了した: このプロセス宛ての待ちを全部失敗にする（呼び出し側が起動し直して再送する）
+        with self._state_lock:
+            if self._proc is proc:
+                self._proc = None
+            dead = [k for k, (_, p) in self._pending.items() if p is proc]
+            futs = [self._pending.pop(k)[0] for k in dead]
+        for f in futs:
+            if not f.done():
+                f.set_exception(RuntimeError("node check worker exited"))
+
+    def submit(self, filename: str, content: str) -> Future:
+        """
+        1ファイルを常駐プロセスへ送り、応答 dict の Future を返す（node が無ければ FileNotFoundError）
+        """
+        fut: Future = Future()
+        with self._state_lock:
+            proc = self._ensure_started()
+            self._next_id += 1
+            rid = self._next_id
+            self._pending[rid] = (fut, proc)
+
+        data = json.dumps({"id": rid, "filename": str(filename or "input.js"), "source": str(content or "")}).encode("utf-8")
+        try:
+            with self._write_lock:
+                proc.stdin.write(len(data).to_bytes(4, "big"))
+                proc.stdin.write(data)
+                proc.stdin.flush()
+        except (OSError, ValueError) as e:
+            with self._state_lock:
+                self._pending.pop(rid, None)
+            if not fut.done():
+                fut.set_exception(RuntimeError(f"node check worker write failed: {e}"))
+        return fut
+
+    def kill(self) -> None:
+        """
+        常駐プロセスを止める（応答待ちは読み取りスレッドが失敗にする）
+        """
+        with self._state_lock:
+            proc = self._proc
+            self._proc = None
+        if proc is not None:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+    def check_many(self, items: List[Tuple[str, str]], timeout: float = NODE_CHECK_TIMEOUT_SEC) -> List[Optional[dict]]:
+        """
+        items = [(filename, content), ...] をまとめて送り、応答 dict を同じ順で返す。
+        - 判定できなかったもの（プロセスが2回続けて落ちた/タイムアウト）は None
+        """
+        results: List[Optional[dict]] = [None] * len(items)
+        todo = list(range(len(items)))
+        for _attempt in range(2):
+            futs = [(i, self.submit(items[i][0], items[i][1])) for i in todo]
+            retry: List[int] = []
+            for i, f in futs:
+                try:
+                    results[i] = f.result(timeout=timeout)
+                except FutureTimeoutError:
+                    # 固まったプロセスは落として、残りは起動し直したプロセスで判定する
+                    self.kill()
+                except Exception:
+                    retry.append(i)
+            todo = retry
+            if not todo:
+                break
+        return results
+
+
+_NODE_CHECK_WORKERS: List[NodeCheckWorker] = []
+_NODE_CHECK_WORKER_LOCK = threading.Lock()
+
+
+def get_node_check_workers() -> List[NodeCheckWorker]:
+    """
+    常駐チェッカ NODE_CHECK_POOL_SIZE 個を返す（プロセスは最初の要求で起動する）
+    """
+    with _NODE_CHECK_WORKER_LOCK:
+        if not _NODE_CHECK_WORKERS:
+            _NODE_CHECK_WORKERS.extend(NodeCheckWorker(NODE_CHECK_WORKER_CMD) for _ in range(max(1, int(NODE_CHECK_POOL_SIZE))))
+        return list(_NODE_CHECK_WORKERS)
+
+
+def shutdown_node_check_worker() -> None:
+    with _NODE_CHECK_WORKER_LOCK:
+        workers = list(_NODE_CHECK_WORKERS)
+        _NODE_CHECK_WORKERS.clear()
+    for w in workers:
+        w.kill()
+
+
+def check_js_syntax_many(items: List[Tuple[str, str]]) -> List[Tuple[bool, str]]:
+    """
+    複数の (filename, content) をまとめて構文チェックする（戻り値は check_js_syntax_with_node と同じ形を同じ順で）。
+    - 先に check_js_structure で括弧/文字列/コメント等の崩れを調べ、確実に NG なものは node に渡さない
+    - 残りは常駐 node で判定する
+    """
+    out: List[Optional[Tuple[bool, str]]] = [None] * len(items)
+    rest: List[int] = []
+    for i, (fn, ct) in enumerate(items):
+        found = check_js_structure(ct)
+        if found is not None and found.certain:
+            out[i] = (False, format_js_structure_issue(str(fn or "input.js"), ct, found))
+        else:
+            rest.append(i)
+
+    if rest:
+        for i, res in zip(rest, check_js_syntax_many_with_node([items[i] for i in rest])):
+            out[i] = res
+    return out
+
+
+def check_js_syntax_many_with_node(items: List[Tuple[str, str]]) -> List[Tuple[bool, str]]:
+    """
+    複数の (filename, content) を常駐 node でまとめて構文チェックする（戻り値は check_js_syntax_with_node と同じ形を同じ順で）。
+    - ファイルは常駐チェッカ（最大 NODE_CHECK_POOL_SIZE 個）へ大きさが偏らないよう分け、同時に判定する
+    - 常駐チェッカが判定できなかったもの（ESM の NG など）だけ従来の node --check で判定し直す
+    """
+    if not items:
+        return []
+
+    workers = get_node_check_workers()[:len(items)]
+    groups: List[List[int]] = [[] for _ in workers]
+    loads = [0] * len(workers)
+    for i in sorted(range(len(items)), key=lambda k: -len(items[k][1])):
+        w = loads.index(min(loads))
+        groups[w].append(i)
+        loads[w] += len(items[i][1])
+
+    def _run(w_idx: int) -> List[Optional[dict]]:
+        return workers[w_idx].check_many([items[i] for i in groups[w_idx]])
+
+    replies: List[Optional[dict]] = [None] * len(items)
+    try:
+        if len(workers) == 1:
+            group_replies = [_run(0)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(workers)) as ex:
+                group_replies = list(ex.map(_run, range(len(workers))))
+        for g, rs in zip(groups, group_replies):
+            for i, r in zip(g, rs):
+                replies[i] = r
+    except FileNotFoundError:
+        return [(False, "node not found: Node.js が未インストールのため構文チェックできません")] * len(items)
+    except Exception:
+        pass
+
+    out: List[Optional[Tuple[bool, str]]] = [None] * len(items)
+    fallback: List[int] = []
+    for i, r in enumerate(replies):
+        if r is None or r.get("fallback"):
+            fallback.append(i)
+        elif r.get("ok"):
+            out[i] = (True, "OK")
+        else:
+            out[i] = (False, str(r.get("error") or "").strip() or "node --check failed (no stderr)")
+
+    if fallback:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(fallback), int(NODE_CHECK_POOL_SIZE)))) as ex:
+            for i, res in zip(fallback, ex.map(lambda k: check_js_syntax_with_node(filename=items[k][0], content=items[k][1]), fallback)):
+                out[i] = res
+    return out
+
+
+_RE_NODE_ERROR_LOCATION = re.compile(r"\A[^\n]*:(\d+)\n[^\n]*\n([ \t]*)\^")
+
+
+def node_error_location(message: str) -> Tuple[Optional[int], Optional[int]]:
+    """
+    node の SyntaxError 表示（"file:LINE" / ソース行 / "   ^^^"）から (行, 桁) を取り出す（1始まり。取れなければ None）
+    """
+    m = _RE_NODE_ERROR_LOCATION.match(str(message or ""))
+    if not m:
+        return (None, None)
+    return (int(m.group(1)), len(m.group(2)) + 1)
+
+
+def now_tag() -> str:
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+# ============================================================
+# blob ストア（RUN アーカイブの重複排除）
+# ------------------------------------------------------------
+# 同じ original / 同じパート本文を RUN ごとに何度も書かないため、
+# 実体は outroot/blobs/<sha256> に1回だけ置き、RUN 側のファイルはそのハードリンクにする。
+# - 参照数はハードリンク数（st_nlink）そのもの。RUN ディレクトリを消せば自動で減る。
+# - st_nlink が 1（= blobs/ からしか参照されていない）になった blob は gc_blob_store で消す。
+# ============================================================
+_BLOB_LOCK = threading.Lock()
+# ハードリンクを作れなかった blobs/ ディレクトリ（以後は blob を作らず dest に直接書く）
+_BLOB_LINK_UNSUPPORTED = set()
+# ファイルシステムがハードリンク自体を扱えないことを示す errno（これ以外の失敗はその1回だけ直接書く）
+_BLOB_LINK_UNSUPPORTED_ERRNOS = frozenset(
+    e for e in (
+        errno.EPERM,
+        errno.EXDEV,
+        getattr(errno, "ENOTSUP", None),
+        getattr(errno, "EOPNOTSUPP", None),
+    ) if e is not None
+)
+
+
+def store_text_via_blob(outroot: Path, dest: Path, text: str, sha256: str = "", data: Optional[bytes] = None) -> str:
+    """
+    dest に text を保存する（実体は blobs/<sha256>、dest はそのハードリンク）。
+    - sha256 が分かっている場合は渡すと再計算しない
+    - data: text を UTF-8 にしたもの（エンコード済みなら渡すと再エンコードしない）
+      sha256 を渡した場合、blob が既にあってリンクだけで済むときはエンコードもしない
+    - ハードリンクを作れないファイルシステムでは dest に実体を書く（従来と同じ保存形式）
+    戻り値: 保存した内容の sha256
+    """
+    if data is None and not sha256:
+        data = str(text or "").encode("utf-8")
+    digest = str(sha256 or "") or sha256_hex_bytes(data)
+
+    def _data() -> bytes:
+        nonlocal data
+        if data is None:
+            data = str(text or "").encode("utf-8")
+        return data
+
+    blob_dir = outroot / BLOB_STORE_DIRNAME
+    blob = blob_dir / digest
+
+    if str(blob_dir) in _BLOB_LINK_UNSUPPORTED:
+        if dest.exists():
+            dest.unlink()
+        dest.write_bytes(_data())
+        return digest
+
+    # 本体の書き込みはロックの外で行う（並列書き込み時にロック待ちで直列化しないよう、tmp 名はスレッドごとに分ける）
+    tmp = None
+    if not blob.exists():
+        safe_mkdir(blob_dir)
+        tmp = blob_dir / f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp.write_bytes(_data())
+
+    with _BLOB_LOCK:
+        if not blob.exists():
+            if tmp is not None and tmp.exists():
+                os.replace(tmp, blob)
+            else:
+                # ロック外で確認した後に GC で blob / tmp が消えた場合は、ここで書き直す
+                safe_mkdir(blob_dir)
+                blob.write_bytes(_data())
+        elif tmp is not None and tmp.exists():
+            tmp.unlink()
+
+        if dest.exists():
+            dest.unlink()
+        try:
+            os.link(blob, dest)
+        except OSError as e:
+            dest.write_bytes(_data())
+            # リンク数上限（EMLINK）や一時的な ENOENT / EEXIST では重複排除を止めない
+            if e.errno in _BLOB_LINK_UNSUPPORTED_ERRNOS:
+                _BLOB_LINK_UNSUPPORTED.add(str(blob_dir))
+            # どこからも参照されない blob を残さない（他の RUN が参照中なら st_nlink > 1 なので残る）
+            try:
+                if blob.stat().st_nlink <= 1:
+                    blob.unlink()
+            except OSError:
+                pass
+
+    return digest
+
+
+def gc_blob_store(outroot: Path) -> int:
+    """
+    どの RUN からも参照されていない blob（ハードリンク数 1）を削除する。
+    戻り値: 削除した blob 数
+    """
+    blob_dir = outroot / BLOB_STORE_DIRNAME
+    if not blob_dir.is_dir():
+        return 0
+
+    removed = 0
+    with _BLOB_LOCK:
+        for b in blob_dir.iterdir():
+            try:
+                if b.is_file() and b.stat().st_nlink <= 1:
+                    b.unlink()
+                    removed += 1
+            except Exception:
+                # 削除失敗は握りつぶす（次回の実行で再トライされる）
+                pass
+    return removed
+
+
+def list_run_dirs(outroot: Path) -> List[Path]:
+    """
+    outroot 直下の RUN ディレクトリ一覧を返す（キャッシュ等の予約ディレクトリは除外）。
+    """
+    return [p for p in outroot.iterdir() if p.is_dir() and p.name not in OUTROOT_RESERVED_DIRNAMES]
+
+
+def enforce_max_log_dirs(outroot: Path, max_keep: int) -> Tuple[int, int]:
+    """
+    outroot 配下の RUN ディレクトリを max_keep 個までに制限し、
+    超過分は「古い順」に削除する。
+
+    戻り値:
+      (deleted_count, kept_count)
+    """
+    try:
+        mk = int(max_keep)
+    except Exception:
+        mk = 0
+
+    if mk <= 0:
+        return (0, 0)
+
+    safe_mkdir(outroot)
+
+    dirs = list_run_dirs(outroot)
+    if not dirs:
+        return (0, 0)
+
+    # 新しい順（mtime降順）
+    dirs.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+
+    keep = dirs[:mk]
+    drop = dirs[mk:]
+
+    deleted = 0
+    for d in drop:
+        try:
+            shutil.rmtree(d)
+            deleted += 1
+        except Exception:
+            # 削除失敗は握りつぶす（次回の実行で再トライされる）
+            continue
+        # 追加した処理: 消した RUN を一覧の索引からも外す
+        remove_run_from_index(outroot, d)
+        # 追加した処理: 消した RUN の payload を /api/part のメモリからも外す
+        forget_run_payloads(d)
+
+    # 追加した処理: 削除した RUN からしか参照されていなかった blob を片付ける
+    gc_blob_store(outroot)
+
+    return (deleted, len(keep))
+
+
+# ============================================================
+# RUN 索引（/api/instructions 用）
+# ------------------------------------------------------------
+# 一覧のたびに outroot を列挙・stat して manifest.json を最大50個読むのをやめ、
+# RUN ごとの一覧項目を SQLite（標準ライブラリ）の1テーブルに持つ。
+# - RUN ディレクトリ名をキーにする（output_dir は outroot + 名前で組み立てる。resolve の違いに影響されない）
+# - 並び順は従来と同じ「RUN ディレクトリの mtime 降順」（記録時に1回だけ stat した値）
+# - ページングは (mtime, run_name) のカーソル（OFFSET と違い、途中で RUN が増減しても重複・抜けが出ない）
+# - プロセス起動後の最初の利用時に RUN ディレクトリと突き合わせる（既存アーカイブを拾う）
+# - 以降も一覧のたびに outroot の mtime と項目数だけを見て、前回の突き合わせから変わっていればやり直す
+#   （別プロセス・手作業での RUN の削除/コピーを、サーバ再起動なしで一覧へ反映する）
+# ============================================================
+class RunIndex:
+    _COLUMNS = (
+        "run_name",
+        "session_id",
+        "created_at",
+        "mtime",
+        "target_file",
+        "target_files",
+        "original_sha256",
+        "original_saved_copy",
+        "project_id",
+        "task_id",
+        "request_id",
+        "instruction",
+    )
+
+    def __init__(self, outroot: Path) -> None:
+        self.outroot = Path(outroot)
+        self.db_path = self.outroot / RUN_INDEX_FILENAME
+        self._lock = threading.Lock()
+        self.has_fts = False
+        # 最後に突き合わせたときの outroot の状態（None = 次の一覧で必ず突き合わせる）
+        self._disk_stamp: Optional[Tuple[int, int]] = None
+        safe_mkdir(self.outroot)
+        try:
+            self._conn = self._open()
+        except sqlite3.DatabaseError:
+            # 壊れた索引は捨てて作り直す（中身は RUN ディレクトリから再構築できる）
+            self.db_path.unlink(missing_ok=True)
+            self._conn = self._open()
+        self.sync_with_disk()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        version = int(conn.execute("PRAGMA user_version").fetchone()[0])
+        if version != RUN_INDEX_VERSION:
+            conn.execute("DROP TABLE IF EXISTS runs")
+            conn.execute("DROP TABLE IF EXISTS runs_fts")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "run_name TEXT PRIMARY KEY, session_id TEXT, created_at TEXT, mtime REAL, "
+            "target_file TEXT, target_files TEXT, original_sha256 TEXT, original_saved_copy TEXT, "
+            "project_id TEXT, task_id TEXT, request_id TEXT, instruction TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS runs_mtime ON runs (mtime DESC, run_name DESC)")
+        conn.execute("CREATE INDEX IF NOT EXISTS runs_project ON runs (project_id, task_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS runs_session ON runs (session_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS runs_created ON runs (created_at)")
+
+        # 追加した処理: 指示文・対象ファイル名の全文検索（FTS5 の trigram = 日本語でも部分一致で引ける）
+        # - FTS5 / trigram が無い SQLite では LIKE の全件走査に落とす（結果は同じ、速度だけ違う）
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS runs_fts USING fts5("
+                "run_name UNINDEXED, instruction, target_files, tokenize='trigram')"
+            )
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+
+        conn.execute(f"PRAGMA user_version = {int(RUN_INDEX_VERSION)}")
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def row_from_manifest(run_dir: Path, manifest: dict, mtime: float) -> tuple:
+        """
+        manifest.json の内容から一覧項目の1行を作る（項目は従来の /api/instructions と同じ + 全入力ファイル名）
+        """
+        inp = manifest.get("input") or {}
+        wk = manifest.get("work") or {}
+        names = [str(o.get("filename") or "") for o in (manifest.get("originals") or []) if isinstance(o, dict)]
+        if not names:
+            names = [str(inp.get("filename") or "")]
+        return (
+            Path(run_dir).name,
+            str(manifest.get("session_id") or ""),
+            str(manifest.get("created_at") or ""),
+            float(mtime),
+            str(inp.get("filename") or ""),
+            "\n".join(nm for nm in names if nm),
+            str(inp.get("sha256") or ""),
+            str(inp.get("saved_copy") or ""),
+            str(wk.get("project_id") or ""),
+            str(wk.get("task_id") or ""),
+            str(wk.get("request_id") or ""),
+            str(manifest.get("instruction") or ""),
+        )
+
+    def _write_rows(self, rows: List[tuple]) -> None:
+        # 呼び出し側で self._lock を取っていること
+        cols = ", ".join(self._COLUMNS)
+        marks = ", ".join("?" for _ in self._COLUMNS)
+        self._conn.executemany(f"INSERT OR REPLACE INTO runs ({cols}) VALUES ({marks})", rows)
+        if self.has_fts:
+            self._conn.executemany("DELETE FROM runs_fts WHERE run_name = ?", [(r[0],) for r in rows])
+            self._conn.executemany(
+                "INSERT INTO runs_fts (run_name, instruction, target_files) VALUES (?, ?, ?)",
+                [(r[0], r[11], r[5]) for r in rows],
+            )
+
+    def _delete_names(self, names: List[str]) -> None:
+        # 呼び出し側で self._lock を取っていること
+        keys = [(nm,) for nm in names]
+        self._conn.executemany("DELETE FROM runs WHERE run_name = ?", keys)
+        if self.has_fts:
+            self._conn.executemany("DELETE FROM runs_fts WHERE run_name = ?", keys)
+
+    def record_run(self, run_dir: Path, manifest: dict) -> None:
+        """
+        RUN を索引へ追加（同名があれば置き換え）する。
+        """
+        row = self.row_from_manifest(run_dir, manifest, Path(run_dir).stat().st_mtime)
+        with self._lock:
+            self._write_rows([row])
+            self._conn.commit()
+
+    def remove_run(self, run_dir: Path) -> None:
+        with self._lock:
+            self._delete_names([Path(run_dir).name])
+            self._conn.commit()
+
+    def disk_stamp(self) -> Tuple[int, int]:
+        """
+        outroot の (mtime_ns, 直下の項目数)。RUN の追加/削除があれば変わる（中身は読まない）。
+        """
+        st = os.stat(self.outroot)
+        return (int(st.st_mtime_ns), len(os.listdir(self.outroot)))
+
+    def mark_stale(self) -> None:
+        """
+        次の sync_if_changed で必ず突き合わせる（索引の更新に失敗したとき用）。
+        """
+        with self._lock:
+            self._disk_stamp = None
+
+    def sync_if_changed(self) -> None:
+        """
+        前回の突き合わせから outroot が変わっていれば sync_with_disk する。
+        """
+        with self._lock:
+            last = self._disk_stamp
+        if last is None or last != self.disk_stamp():
+            self.sync_with_disk()
+
+    def sync_with_disk(self) -> None:
+        """
+        RUN ディレクトリ一覧と索引を突き合わせる（無くなった RUN を消し、索引に無い RUN は manifest.json から足す）。
+        """
+        # 列挙の前に状態を取る（突き合わせ中の変更は次回の一覧で拾う）
+        stamp = self.disk_stamp()
+        dirs = {d.name: d for d in list_run_dirs(self.outroot)}
+        with self._lock:
+            known = set(r[0] for r in self._conn.execute("SELECT run_name FROM runs"))
+            gone = [nm for nm in known if nm not in dirs]
+            rows = []
+            for nm, d in dirs.items():
+                if nm in known:
+                    continue
+                mf = d / "manifest.json"
+                try:
+                    data = json.loads(mf.read_text(encoding="utf-8"))
+                    rows.append(self.row_from_manifest(d, data, d.stat().st_mtime))
+                except Exception:
+                    # manifest.json が無い/壊れている RUN は従来どおり一覧に出さない
+                    continue
+            self._delete_names(gone)
+            self._write_rows(rows)
+            self._conn.commit()
+            self._disk_stamp = stamp
+
+    def count_runs(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0])
+
+    @staticmethod
+    def encode_cursor(mtime: float, run_name: str) -> str:
+        raw = json.dumps([float(mtime), str(run_name)], ensure_ascii=False).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[float, str]:
+        """
+        next_cursor を (mtime, run_name) に戻す（壊れていれば ValueError）
+        """
+        try:
+            mtime, run_name = json.loads(base64.urlsafe_b64decode(str(cursor).encode("ascii")).decode("utf-8"))
+            return float(mtime), str(run_name)
+        except Exception:
+            raise ValueError("invalid cursor")
+
+    def query_runs(
+        self,
+        project_id: str = "",
+        task_id: str = "",
+        session_id: str = "",
+        since: str = "",
+        until: str = "",
+        text: str = "",
+        limit: int = DEFAULT_INSTRUCTIONS_PAGE_SIZE,
+        cursor: str = "",
+        instruction_mode: str = "full",
+    ) -> Tuple[List[dict], int, str]:
+        """
+        一覧項目を mtime 降順で返す。
+        - project_id / task_id / session_id: 完全一致
+        - since / until: created_at の範囲（"2026-01-06" のような前方一致の日付でも可。until はその日を含む）
+        - text: 指示文・対象ファイル名の全文検索（空白区切りの語をすべて含むもの）
+        - cursor: 前回の next_cursor（その続きから limit 件）
+        - instruction_mode: "full"（全文）/ "preview"（先頭 INSTRUCTION_PREVIEW_CHARS 文字）/ "none"
+        戻り値: (items, 条件に合う総件数, next_cursor。続きが無ければ "")
+        """
+        where: List[str] = []
+        params: list = []
+        for col, val in (("project_id", project_id), ("task_id", task_id), ("session_id", session_id)):
+            if str(val or "") != "":
+                where.append(f"{col} = ?")
+                params.append(str(val))
+        if str(since or "") != "":
+            where.append("created_at >= ?")
+            params.append(str(since))
+        if str(until or "") != "":
+            where.append("substr(created_at, 1, length(?)) <= ?")
+            params.extend([str(until), str(until)])
+
+        terms = [t for t in str(text or "").split() if t]
+        for t in terms:
+            # trigram は3文字未満の語を引けないので、その語だけ LIKE で絞る
+            if self.has_fts and len(t) >= 3:
+                where.append("run_name IN (SELECT run_name FROM runs_fts WHERE runs_fts MATCH ?)")
+                params.append('"' + t.replace('"', '""') + '"')
+            else:
+                like = "%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                where.append("(instruction LIKE ? ESCAPE '\\' OR target_files LIKE ? ESCAPE '\\')")
+                params.extend([like, like])
+
+        where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+
+        page_where = list(where)
+        page_params = list(params)
+        if str(cursor or "") != "":
+            c_mtime, c_name = self.decode_cursor(cursor)
+            page_where.append("(mtime < ? OR (mtime = ? AND run_name < ?))")
+            page_params.extend([c_mtime, c_mtime, c_name])
+        page_sql = (" WHERE " + " AND ".join(page_where)) if page_where else ""
+
+        mode = str(instruction_mode or "full")
+        if mode == "preview":
+            instr_col = f"substr(instruction, 1, {int(INSTRUCTION_PREVIEW_CHARS)})"
+        elif mode == "none":
+            instr_col = "''"
+        else:
+            instr_col = "instruction"
+        cols = [c for c in self._COLUMNS if c not in ("instruction", "target_files")]
+        n = max(0, int(limit))
+
+        with self._lock:
+            matched = int(self._conn.execute(f"SELECT COUNT(*) FROM runs{where_sql}", params).fetchone()[0])
+            rows = self._conn.execute(
+                f"SELECT {', '.join(cols)}, length(instruction), {instr_col} FROM runs{page_sql} "
+                "ORDER BY mtime DESC, run_name DESC LIMIT ?",
+                page_params + [n + 1],
+            ).fetchall()
+
+        next_cursor = ""
+        if len(rows) > n:
+            rows = rows[:n]
+            if rows:
+                last = dict(zip(cols, rows[-1]))
+                next_cursor = self.encode_cursor(last["mtime"], last["run_name"])
+
+        items = []
+        for r in rows:
+            rec = dict(zip(cols, r))
+            item = {
+                "output_dir": str(self.outroot / rec["run_name"]),
+                "session_id": rec["session_id"],
+                "created_at": rec["created_at"],
+                "target_file": rec["target_file"],
+                "original_sha256": rec["original_sha256"],
+                "original_saved_copy": rec["original_saved_copy"],
+                "project_id": rec["project_id"],
+                "task_id": rec["task_id"],
+                "request_id": rec["request_id"],
+            }
+            if mode == "full":
+                item["instruction"] = r[-1]
+            elif mode == "preview":
+                item["instruction_preview"] = r[-1]
+                item["instruction_chars"] = int(r[-2] or 0)
+            items.append(item)
+        return items, matched, next_cursor
+
+
+_RUN_INDEXES: dict = {}
+_RUN_INDEXES_LOCK = threading.Lock()
+
+
+def get_run_index(outroot: Path) -> RunIndex:
+    """
+    outroot ごとに1つの RunIndex を返す（プロセス内で共有。初回だけ RUN ディレクトリと突き合わせる）。
+    """
+    key = str(Path(outroot).resolve())
+    with _RUN_INDEXES_LOCK:
+        idx = _RUN_INDEXES.get(key)
+        if idx is None:
+            idx = RunIndex(Path(outroot))
+            _RUN_INDEXES[key] = idx
+        return idx
+
+
+def remove_run_from_index(outroot: Path, run_dir: Path) -> None:
+    """
+    削除した RUN を索引から外す（索引の更新失敗で削除処理自体は失敗させない。次回の一覧時の突き合わせで直る）。
+    """
+    try:
+        get_run_index(outroot).remove_run(run_dir)
+    except Exception as e:
+        print("[RUN_INDEX][WARN] remove_run", Path(run_dir).name, repr(e))
+        mark_run_index_stale(outroot)
+
+
+def mark_run_index_stale(outroot: Path) -> None:
+    """
+    索引の更新に失敗したとき、次の一覧で RUN ディレクトリと突き合わせ直すよう印を付ける。
+    """
+    idx = _RUN_INDEXES.get(str(Path(outroot).resolve()))
+    if idx is not None:
+        idx.mark_stale()
+
+
+# ============================================================
+# split キャッシュ（内容アドレス方式）
+# ------------------------------------------------------------
+# split の結果は「ファイル内容 + maxchars/maxlines/split_mode/iife_grace_ratio」だけで決まる。
+# 指示文だけ変えて再送するケースが多いため、分割境界・深さ・パートSHA256・ヒント・SCOPE_INDEX を
+# 内容SHA256キーで保存し、同じ内容なら再分割/再索引をしない。
+# - メモリ: OrderedDict による LRU（件数上限 + 合計文字数の上限。文字数は JSON 化した長さ等での概算）
+# - ディスク: outroot/_split_cache/<key>.json（合計サイズ上限、mtime の古い順に削除）
+# ============================================================
+class SplitCache:
+    def __init__(self, cache_dir: Optional[Path], max_entries: int, max_bytes: int, max_mem_chars: int = 0) -> None:
+        self.cache_dir = cache_dir
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        # 0 以下なら文字数では制限しない
+        self.max_mem_chars = int(max_mem_chars)
+        self._mem: "OrderedDict[str, object]" = OrderedDict()
+        self._mem_sizes: dict = {}
+        self._mem_chars = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def approx_chars(value) -> int:
+        """
+        メモリ上の大きさの目安（文字数）。文字列の並び（payload の memo）は長さの合計、それ以外は JSON 化した長さ。
+        """
+        if isinstance(value, str):
+            return len(value)
+        if isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value):
+            return sum(len(v) for v in value)
+        try:
+            return len(json.dumps(value, ensure_ascii=False))
+        except Exception:
+            return 0
+
+    def _path(self, key: str) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+
+        p = self._path(key)
+        if p is None or not p.exists():
+            return None
+        try:
+            text = p.read_text(encoding="utf-8")
+            value = json.loads(text)
+            # 追加した処理: ディスク側も「最近使った」ことを mtime で残す（サイズ超過時の削除順に使う）
+            os.utime(p, None)
+        except Exception:
+            return None
+
+        self._remember(key, value, len(text))
+        return value
+
+    def put(self, key: str, value, persist: bool = True) -> None:
+        p = self._path(key)
+        if not persist or p is None:
+            # 文字数で制限しないキャッシュ（/api/part 等）では大きさを測らない
+            self._remember(key, value, self.approx_chars(value) if self.max_mem_chars > 0 else 0)
+            return
+
+        text = json.dumps(value, ensure_ascii=False)
+        self._remember(key, value, len(text))
+        try:
+            safe_mkdir(p.parent)
+            tmp = p.with_name(p.name + ".tmp")
+            tmp.write_text(text, encoding="utf-8")
+            os.replace(tmp, p)
+            self._enforce_disk_limit()
+        except Exception:
+            # キャッシュ書き込み失敗は握りつぶす（次回は再計算されるだけ）
+            pass
+
+    def _remember(self, key: str, value, size: int) -> None:
+        with self._lock:
+            self._mem_chars -= self._mem_sizes.get(key, 0)
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            self._mem_sizes[key] = int(size)
+            self._mem_chars += int(size)
+            # 件数・合計文字数のどちらかを超えたら古い順に捨てる（今入れた1件は残す）
+            while len(self._mem) > 1 and (
+                len(self._mem) > self.max_entries
+                or (self.max_mem_chars > 0 and self._mem_chars > self.max_mem_chars)
+            ):
+                old_key, _ = self._mem.popitem(last=False)
+                self._mem_chars -= self._mem_sizes.pop(old_key, 0)
+
+    def discard_where(self, pred: Callable[[str, object], bool]) -> int:
+        """
+        メモリ上のエントリのうち pred(key, value) が真のものを捨てる（ディスク側は触らない）。
+        戻り値: 捨てた件数
+        """
+        with self._lock:
+            keys = [k for k, v in self._mem.items() if pred(k, v)]
+            for k in keys:
+                del self._mem[k]
+                self._mem_chars -= self._mem_sizes.pop(k, 0)
+        return len(keys)
+
+    def _enforce_disk_limit(self) -> None:
+        if self.cache_dir is None or self.max_bytes <= 0:
+            return
+        files = []
+        total = 0
+        for f in self.cache_dir.glob("*.json"):
+            try:
+                st = f.stat()
+            except Exception:
+                continue
+            files.append((st.st_mtime, st.st_size, f))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        files.sort(key=lambda x: x[0])
+        for _mtime, size, f in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                f.unlink()
+                total -= size
+            except Exception:
+                pass
+
+
+_SPLIT_CACHES: dict = {}
+_SPLIT_CACHES_LOCK = threading.Lock()
+
+
+def get_split_cache(outroot: Path) -> SplitCache:
+    """
+    outroot ごとに1つの SplitCache を返す（プロセス内で共有）。
+    """
+    key = str(Path(outroot).resolve())
+    with _SPLIT_CACHES_LOCK:
+        c = _SPLIT_CACHES.get(key)
+        if c is None:
+            c = SplitCache(
+                cache_dir=Path(key) / SPLIT_CACHE_DIRNAME,
+                max_entries=DEFAULT_SPLIT_CACHE_MAX_ENTRIES,
+                max_bytes=DEFAULT_SPLIT_CACHE_MAX_BYTES,
+                max_mem_chars=DEFAULT_SPLIT_CACHE_MAX_MEM_CHARS,
+            )
+            _SPLIT_CACHES[key] = c
+        return c
+
+
+# ============================================================
+# 構文チェック結果のキャッシュ（/api/check と /api/check/batch）
+# ------------------------------------------------------------
+# 同じ内容を数分前にチェック済みでも毎回 node に渡していたのをやめ、結果を outroot/_check_cache.sqlite3 に残す。
+# - キー: (内容SHA256, チェッカ名, チェッカ版, ファイル名)
+#   チェッカ版は node のバージョンと JS_SYNTAX_CHECK_VERSION（事前チェック/常駐チェッカの規則の版）
+#   ファイル名を含めるのは、拡張子で CJS/ESM の判定が変わり、エラー文にも名前が入るため
+# - 件数上限を超えたら最後に使った順（last_used）の古いものから消す（LRU）
+# - ヒット/ミス数はプロセス起動からの累計を持ち、GET /api/check/stats で返す
+# - node が無い等の「判定できなかった」結果は残さない（入れた後に再チェックしたい）
+# ============================================================
+class CheckResultCache:
+    def __init__(self, outroot: Path, max_entries: int) -> None:
+        self.db_path = Path(outroot) / CHECK_CACHE_FILENAME
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._clock = 0
+        safe_mkdir(Path(outroot))
+        try:
+            self._conn = self._open()
+        except sqlite3.DatabaseError:
+            # 壊れたキャッシュは捨てて作り直す
+            self.db_path.unlink(missing_ok=True)
+            self._conn = self._open()
+        self._clock = int(self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM results").fetchone()[0])
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        # ヒットのたびに last_used を書くので、コミットごとの fsync を避ける（落ちても失うのは直近の使用順だけ）
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "sha256 TEXT, checker TEXT, version TEXT, filename TEXT, result TEXT, last_used INTEGER, "
+            "PRIMARY KEY (sha256, checker, version, filename))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        conn.commit()
+        return conn
+
+    def get(self, sha256: str, checker: str, version: str, filename: str) -> Optional[dict]:
+        key = (str(sha256), str(checker), str(version), str(filename))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM results WHERE sha256 = ? AND checker = ? AND version = ? AND filename = ?", key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            self._conn.execute(
+                "UPDATE results SET last_used = ? WHERE sha256 = ? AND checker = ? AND version = ? AND filename = ?",
+                (self._clock,) + key,
+            )
+            self._conn.commit()
+        try:
+            return json.loads(row[0])
+        except Exception:
+            return None
+
+    def put(self, sha256: str, checker: str, version: str, filename: str, result: dict) -> None:
+        with self._lock:
+            self._clock += 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (sha256, checker, version, filename, result, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (str(sha256), str(checker), str(version), str(filename), json.dumps(result, ensure_ascii=False), self._clock),
+            )
+            count = int(self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0])
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = int(self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0])
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": (hits / total) if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+
+_CHECK_CACHES: dict = {}
+_CHECK_CACHES_LOCK = threading.Lock()
+
+
+def get_check_result_cache(outroot: Path) -> CheckResultCache:
+    """
+    outroot ごとに1つの CheckResultCache を返す（プロセス内で共有）。
+    """
+    key = str(Path(outroot).resolve())
+    with _CHECK_CACHES_LOCK:
+        c = _CHECK_CACHES.get(key)
+        if c is None:
+            c = CheckResultCache(Path(outroot), DEFAULT_CHECK_RESULT_CACHE_ENTRIES)
+            _CHECK_CACHES[key] = c
+        return c
+
+
+_NODE_VERSION: Optional[str] = None
+
+
+def node_version() -> str:
+    """
+    node --version（最初の1回だけ起動して覚える。node が無ければ ""）
+    """
+    global _NODE_VERSION
+    if _NODE_VERSION is None:
+        try:
+            p = subprocess.run(["node", "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            _NODE_VERSION = (p.stdout or "").strip() if p.returncode == 0 else ""
+        except Exception:
+            _NODE_VERSION = ""
+    return _NODE_VERSION
+
+
+def js_check_version() -> str:
+    return f"{JS_SYNTAX_CHECK_VERSION}/{node_version()}"
+
+
+def check_js_files(outroot: Path, files: List[dict]) -> List[dict]:
+    """
+    files = [{"filename", "content"}, ...] を構文チェックし、ファイルごとの結果を同じ順で返す。
+    - 結果: {"filename", "ok", "error", "line", "column", "sha256", "cached"}（line / column は NG で位置が分かるときだけ数値）
+    - 結果キャッシュに無いものだけ check_js_syntax_many でまとめて判定する
+    - キャッシュ（SQLite）が使えないとき（ロック・破損・容量不足など）はキャッシュなしで判定する
+    """
+    try:
+        cache: Optional[CheckResultCache] = get_check_result_cache(outroot)
+    except Exception as e:
+        print("[CHECK][WARN] check cache unavailable", repr(e))
+        cache = None
+    version = js_check_version()
+
+    results: List[dict] = []
+    misses: List[int] = []
+    for f in files:
+        fn = str(f.get("filename") or "input.js")
+        digest = sha256_hex(str(f.get("content") or ""))
+        hit = None
+        if cache is not None:
+            try:
+                hit = cache.get(digest, "node", version, fn)
+            except Exception as e:
+                print("[CHECK][WARN] check cache get failed", repr(e))
+                cache = None
+        if hit is not None:
+            results.append(dict(hit, cached=True))
+            continue
+        misses.append(len(results))
+        results.append({"filename": fn, "sha256": digest})
+
+    if misses:
+        checked = check_js_syntax_many([(results[i]["filename"], str(files[i].get("content") or "")) for i in misses])
+        for i, (ok, msg) in zip(misses, checked):
+            line, column = (None, None) if ok else node_error_location(msg)
+            rec = {
+                "filename": results[i]["filename"],
+                "ok": bool(ok),
+                "error": "" if ok else str(msg),
+                "line": line,
+                "column": column,
+                "sha256": results[i]["sha256"],
+            }
+            if cache is not None and (ok or line is not None):
+                try:
+                    cache.put(rec["sha256"], "node", version, rec["filename"], rec)
+                except Exception as e:
+                    # 保存できなくても判定結果はそのまま返す（次回は node で判定し直すだけ）
+                    print("[CHECK][WARN] check cache put failed", repr(e))
+                    cache = None
+            results[i] = dict(rec, cached=False)
+    return results
+
+
+def split_cache_key(content_sha256: str, maxchars: int, maxlines: int, split_mode: str, iife_grace_ratio: float) -> str:
+    """
+    1ファイル分の split 結果のキャッシュキー（内容SHA256 + 分割パラメータ）。
+    """
+    mode = str(split_mode or "C").strip().upper()
+    base = f"split\n{SPLIT_CACHE_VERSION}\n{content_sha256}\n{int(maxchars)}\n{int(maxlines)}\n{mode}\n{float(iife_grace_ratio)!r}"
+    return sha256_hex(base)
+
+
+def scope_fragment_cache_key(content_sha256: str) -> str:
+    """
+    1ファイル分の SCOPE_INDEX 断片のキャッシュキー（内容SHA256 のみ。分割パラメータには依存しない）。
+    """
+    return sha256_hex(f"scope-fragment\n{SPLIT_CACHE_VERSION}\n{content_sha256}")
+
+
+def compute_scope_fragment(content: str) -> dict:
+    """
+    1ファイル分の SCOPE_INDEX 断片をキャッシュ形式で返す（CPU プール用）。
+    """
+    return scope_index_to_json(scan_scope_index(content))
+
+
+def build_split_cache_part(
+    chunk: Tuple[int, int, str, int, int],
+    line_index: LineIndex,
+    scan: JsBraceScan,
+    reuse: Optional[dict] = None,
+    source: Optional[Utf8Source] = None,
+) -> dict:
+    """
+    split_by_limits の1チャンクをキャッシュ形式の dict にする。
+    - reuse: 本文が同一と分かっている前回のパート dict（SHA256 / 先頭末尾行 / ヒントを再計算しない）
+    - source: エンコード済みの元ファイル（パートSHA256 をチャンクの再エンコードなしで取る）
+    """
+    st, ed, ch, depth_start, depth_end = chunk
+
+    # 差分再分割の再開地点に使えるか（= 開始位置が走査開始地点かコード上の改行直後。文字列/コメントの途中ではない）
+    k = bisect_left(scan.cut_offsets, st)
+    code_cut_start = (st == scan.base_offset) or (k < len(scan.cut_offsets) and int(scan.cut_offsets[k]) == st)
+
+    if reuse is not None:
+        part_sha256 = str(reuse["part_sha256"])
+        first_line, last_line = str(reuse["first_line"]), str(reuse["last_line"])
+        top_ident_str, defines_str = str(reuse["top_identifiers"]), str(reuse["defines"])
+    else:
+        part_sha256 = source.sha256_span(st, ed) if source is not None else sha256_hex(ch)
+        first_line, last_line = line_index.first_last_line(st, ed)
+        top_ident_str, defines_str = build_part_scope_hints(ch)
+
+    return {
+        "start_offset": int(st),
+        "end_offset": int(ed),
+        "brace_depth_start": int(depth_start),
+        "brace_depth_end": int(depth_end),
+        "start_line": line_index.offset_to_line(st) + 1,
+        "end_line": line_index.offset_to_line(max(st, ed - 1)) + 1,
+        "code_cut_start": bool(code_cut_start),
+        "part_sha256": part_sha256,
+        "first_line": first_line,
+        "last_line": last_line,
+        "top_identifiers": top_ident_str,
+        "defines": defines_str,
+    }
+
+
+def build_split_cache_entry(
+    content: str,
+    chunks: List[Tuple[int, int, str, int, int]],
+    line_index: LineIndex,
+    scan: Optional[JsBraceScan] = None,
+) -> dict:
+    """
+    split_by_limits の結果を「本文を持たない」キャッシュ形式へ変換する。
+    - 本文は元ファイルから offsets で切り出せるので保存しない
+    - PART_SCOPE_HINT（行範囲・先頭/末尾行・頻出識別子・定義名）とパートSHA256は保存する
+    """
+    if scan is None:
+        scan = scan_js_braces(content)
+    source = Utf8Source(content, line_index)
+    parts = [build_split_cache_part(c, line_index, scan, source=source) for c in chunks]
+    return {"version": SPLIT_CACHE_VERSION, "parts": parts}
+
+
+# ============================================================
+# CPU プール（split の重い計算だけをプロセスへ逃がす）
+# ------------------------------------------------------------
+# スレッドだけでは GIL のため split 中に他リクエストの応答が遅くなる。
+# キャッシュ/ファイル書き込みはサーバプロセス側に残し、純粋な計算（分割・ヒント・SCOPE_INDEX）だけを渡す。
+# ============================================================
+_CPU_POOL: Optional[ProcessPoolExecutor] = None
+_CPU_POOL_WORKERS = 0
+_CPU_POOL_LOCK = threading.Lock()
+
+
+def start_cpu_pool(workers: int) -> None:
+    global _CPU_POOL, _CPU_POOL_WORKERS
+    try:
+        n = int(workers)
+    except Exception:
+        n = 0
+    with _CPU_POOL_LOCK:
+        if _CPU_POOL is not None or n <= 0:
+            return
+        _CPU_POOL = ProcessPoolExecutor(max_workers=n)
+        _CPU_POOL_WORKERS = n
+
+
+def shutdown_cpu_pool() -> None:
+    global _CPU_POOL, _CPU_POOL_WORKERS
+    with _CPU_POOL_LOCK:
+        pool = _CPU_POOL
+        _CPU_POOL = None
+        _CPU_POOL_WORKERS = 0
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _restart_broken_cpu_pool(broken: ProcessPoolExecutor) -> Optional[ProcessPoolExecutor]:
+    """
+    ワーカープロセスが落ちて使えなくなったプールを作り直す（他スレッドが作り直し済みならそれを返す）。
+    """
+    global _CPU_POOL
+    with _CPU_POOL_LOCK:
+        if _CPU_POOL is broken and _CPU_POOL_WORKERS > 0:
+            print("[CPU_POOL][WARN] worker process died; restarting pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            _CPU_POOL = ProcessPoolExecutor(max_workers=_CPU_POOL_WORKERS)
+        return _CPU_POOL
+
+
+def run_cpu_task(fn, *args):
+    """
+    fn(*args) を CPU プールで実行して結果を返す（プール未起動ならこの場で実行する）。
+    - ワーカーが落ちてプールが壊れていたら、作り直して1回だけやり直す
+    """
+    return run_cpu_tasks(fn, [args])[0]
+
+
+def run_cpu_tasks(fn, args_list: List[tuple]) -> list:
+    """
+    fn(*args) を args_list の数だけ CPU プールへ一度に投げ、結果を args_list の順で返す（プール未起動なら逐次）。
+    - ワーカーが落ちてプールが壊れていたら（OOM で kill された等）、作り直して1回だけやり直す
+    """
+    pool = _CPU_POOL
+    for attempt in range(2):
+        if pool is None:
+            return [fn(*args) for args in args_list]
+        try:
+            futures = [pool.submit(fn, *args) for args in args_list]
+            return [f.result() for f in futures]
+        except BrokenProcessPool:
+            pool = _restart_broken_cpu_pool(pool)
+            if attempt == 1:
+                raise
+
+
+def compute_split_cache_entry(
+    content: str,
+    maxchars: int,
+    maxlines: int,
+    split_mode: str,
+    iife_grace_ratio: float,
+) -> dict:
+    """
+    1ファイル分の split + PART_SCOPE_HINT を計算し、キャッシュ形式で返す（CPU プール用）。
+    """
+    # 行インデックスと字句スキャンは1ファイル1回だけ作り、split と PART_SCOPE_HINT で共有する
+    line_index = LineIndex(content)
+    scan = scan_js_braces(content)
+
+    chunks = split_by_limits(
+        content,
+        maxchars,
+        maxlines,
+        split_mode=split_mode,
+        iife_grace_ratio=iife_grace_ratio,
+        line_index=line_index,
+        scan=scan,
+    )
+    return build_split_cache_entry(content, chunks, line_index, scan)
+
+
+def compute_split_cache_entry_any(
+    base_content: Optional[str],
+    base_entry: Optional[dict],
+    content: str,
+    maxchars: int,
+    maxlines: int,
+    split_mode: str,
+    iife_grace_ratio: float,
+) -> dict:
+    """
+    前回版（base_content / base_entry）があれば差分再分割、無ければ通常の split を行う（CPU プールへまとめて投げる用）。
+    """
+    if base_content is not None and base_entry is not None:
+        return compute_split_cache_entry_incremental(
+            base_content, base_entry, content, maxchars, maxlines, split_mode, iife_grace_ratio,
+        )
+    return compute_split_cache_entry(content, maxchars, maxlines, split_mode, iife_grace_ratio)
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    """
+    a と b の共通接頭辞の長さ（スライス比較の二分探索。文字単位の Python ループにしない）。
+    """
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix_len(a: str, b: str, max_len: int) -> int:
+    """
+    a と b の共通接尾辞の長さ（max_len を上限にする = 接頭辞と重ならないようにする）。
+    """
+    na, nb = len(a), len(b)
+    lo, hi = 0, max(0, min(int(max_len), na, nb))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[na - mid:] == b[nb - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def compute_split_cache_entry_incremental(
+    base_content: str,
+    base_entry: dict,
+    content: str,
+    maxchars: int,
+    maxlines: int,
+    split_mode: str,
+    iife_grace_ratio: float,
+) -> dict:
+    """
+    前回版（base_content / base_entry）との差分から split をやり直す（CPU プール用）。
+    結果は compute_split_cache_entry(content, ...) と同一になる。
+    - 編集位置より前で「読んだ範囲が全部編集前に収まる」パートは境界ごとそのまま使う
+    - その最後の境界のうち、コード上の改行（depth が確定している地点）から字句スキャンと分割を再開する
+    - 編集より後ろの共通部分に収まるパートは、SHA256 / 先頭末尾行 / ヒントを前回から引き継ぐ
+    """
+    mode, grace = normalize_split_mode(split_mode, iife_grace_ratio)
+    base_parts = list(base_entry.get("parts") or [])
+    if maxchars <= 0 or maxlines <= 0 or not base_parts or content == "" or base_content == "":
+        return compute_split_cache_entry(content, maxchars, maxlines, split_mode, iife_grace_ratio)
+
+    n_base = len(base_content)
+    n = len(content)
+    prefix_len = _common_prefix_len(base_content, content)
+    suffix_len = _common_suffix_len(base_content, content, min(n_base, n) - prefix_len)
+
+    # ------------------------------------------------------------
+    # 1) 前回パートのうち「判定に使った文字が全部 prefix_len より前」のものを数える
+    # ------------------------------------------------------------
+    # 分割ループの状態は「開始位置」だけなので、読んだ範囲が変わっていなければ同じ境界になる。
+    # - C: start + maxchars（tentative_end の上限）と end（改行丸め）まで
+    # - B: さらに IIFE 終端の探索窓（+grace）まで
+    # - A: IIFE 終端が編集前に見つかった場合だけ end まで（見つからなければ末尾まで読んでいる）
+    base_lix = LineIndex(base_content) if mode == "A" else None
+    extra = int(maxchars * grace) if mode == "B" else 0
+    if extra < 0:
+        extra = 0
+
+    stable = 0
+    for bp in base_parts:
+        st = int(bp["start_offset"])
+        ed = int(bp["end_offset"])
+        if mode == "A":
+            tentative_end = min(st + maxchars, base_lix.end_after_lines(st, maxlines))
+            found = any(base_content.find(tok, tentative_end, prefix_len) != -1 for tok in IIFE_END_TOKENS)
+            reach = ed if found else n_base
+        else:
+            reach = max(st + maxchars + extra, ed)
+        if reach + 1 > prefix_len:
+            break
+        stable += 1
+
+    # 再開地点は「コード上の改行の直後」に限る（そこからなら字句状態=コード・深さ=保存値で走査を再開できる）
+    while stable > 0 and (stable >= len(base_parts) or not base_parts[stable].get("code_cut_start")):
+        stable -= 1
+    if stable <= 0:
+        return compute_split_cache_entry(content, maxchars, maxlines, split_mode, iife_grace_ratio)
+
+    resume_at = int(base_parts[stable]["start_offset"])
+    resume_depth = int(base_parts[stable]["brace_depth_start"])
+
+    # ------------------------------------------------------------
+    # 2) 再開地点から字句スキャンと分割をやり直す
+    # ------------------------------------------------------------
+    line_index = LineIndex(content)
+    scan = scan_js_braces(content, start_pos=resume_at, start_depth=resume_depth)
+    chunks = split_by_limits(
+        content,
+        maxchars,
+        maxlines,
+        split_mode=mode,
+        iife_grace_ratio=grace,
+        line_index=line_index,
+        scan=scan,
+        start_offset=resume_at,
+    )
+
+    # ------------------------------------------------------------
+    # 3) 編集より後ろの共通部分に収まるパートは、前回の同じ本文のパートから引き継ぐ
+    # ------------------------------------------------------------
+    delta = n - n_base
+    suffix_from = n - suffix_len
+    base_by_range = {(int(bp["start_offset"]), int(bp["end_offset"])): bp for bp in base_parts}
+
+    source = Utf8Source(content, line_index)
+    parts = [dict(bp) for bp in base_parts[:stable]]
+    for c in chunks:
+        st, ed = int(c[0]), int(c[1])
+        reuse = base_by_range.get((st - delta, ed - delta)) if st >= suffix_from else None
+        parts.append(build_split_cache_part(c, line_index, scan, reuse=reuse, source=source))
+
+    return {"version": SPLIT_CACHE_VERSION, "parts": parts}
 
 
-def enforce_max_log_dirs(outroot: Path, max_keep: int) -> Tuple[int, int]:
+def split_lineage_key(filename: str, maxchars: int, maxlines: int, split_mode: str, iife_grace_ratio: float) -> str:
     """
-    outroot 配下の RUN ディレクトリを max_keep 個までに制限し、
-    超過分は「古い順」に削除する。
+    「このファイル名・この分割パラメータで最後に split した内容」を引くためのキー（差分再分割の前回版）。
+    """
+    mode = str(split_mode or "C").strip().upper()
+    base = f"lineage\n{SPLIT_CACHE_VERSION}\n{filename}\n{int(maxchars)}\n{int(maxlines)}\n{mode}\n{float(iife_grace_ratio)!r}"
+    return sha256_hex(base)
 
-    戻り値:
-      (deleted_count, kept_count)
+
+def load_base_originals(outroot: Path, base_session: str) -> dict:
     """
+    base_session の RUN の manifest.json から {filename: 内容SHA256} を返す（見つからなければ空）。
+    """
+    run_dir = resolve_run_dir_for_session(outroot, base_session)
+    if run_dir is None:
+        return {}
     try:
-        mk = int(max_keep)
+        manifest = json.loads((run_dir / "manifest.json").read_text(encoding="utf-8"))
     except Exception:
-        mk = 0
-
-    if mk <= 0:
-        return (0, 0)
-
-    safe_mkdir(outroot)
-
-    dirs = [p for p in outroot.iterdir() if p.is_dir()]
-    if not dirs:
-        return (0, 0)
-
-    # 新しい順（mtime降順）
-    dirs.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-
-    keep = dirs[:mk]
-    drop = dirs[mk:]
+        return {}
+    out = {}
+    for o in manifest.get("originals") or []:
+        fn = str(o.get("filename") or "")
+        sha = str(o.get("sha256") or "")
+        if fn and sha:
+            out[fn] = sha
+    return out
 
-    deleted = 0
-    for d in drop:
-        try:
-            shutil.rmtree(d)
-            deleted += 1
-        except Exception:
-            # 削除失敗は握りつぶす（次回の実行で再トライされる）
-            pass
 
-    return (deleted, len(keep))
+def load_blob_text(outroot: Path, sha256: str) -> Optional[str]:
+    """
+    blobs/<sha256> の内容を返す（GC 済みなどで無ければ None）。
+    """
+    digest = str(sha256 or "")
+    if not _RE_SHA256_HEX.match(digest):
+        return None
+    blob = outroot / BLOB_STORE_DIRNAME / digest
+    try:
+        return blob.read_bytes().decode("utf-8")
+    except Exception:
+        return None
 
 
 def generate_parts(
@@ -1760,9 +4033,23 @@ def generate_parts(
     task_id: str,
     include_rules: bool,
     scope_extract_code: str,
+    on_part: Optional[Callable[[SplitPart, str], None]] = None,
+    incremental: bool = False,
+    base_session: str = "",
+    parallel_render: Optional[bool] = None,
 ) -> Tuple[str, Path, List[SplitPart], List[str]]:
+    """
+    split_targets を1セッションとして分割し、RUN ディレクトリへ保存する。
+    戻り値: (session_id, out_dir, parts, payloads)
+    - on_part を渡すと、payload が1つ出来るたびに on_part(part, payload) を呼ぶ（ストリーミング応答用）。
+      この場合 payloads は溜めずに空リストを返す（ピークメモリを抑える）。
+    - incremental=True: 前回版（base_session の RUN、省略時は同じファイル名で最後に split した内容）との差分から
+      split をやり直し、コードパートの body_changed（前回に同じ本文のパートが無い）を埋める。
+    - parallel_render: payload の並列組み立て（None なら PARALLEL_PAYLOAD_RENDER）。出力の順序・内容は逐次と同じ。
+    """
     # ★ 追加した処理: 複数ファイルを「1セッション」に束ねる
-    session_id = make_session_id_multi(prefix, split_targets)
+    # 追加した処理: SessionID と内容SHA256 は同じエンコード結果から1回で作る（バイト列は保持しない）
+    session_id, content_sha256s = hash_split_targets(prefix, split_targets)
 
     wrapped_instruction, request_id = wrap_instruction_with_ids(
         instruction=instruction,
@@ -1779,32 +4066,112 @@ def generate_parts(
     # ------------------------------------------------------------
     # 1) まず全ファイルを分割して “全体パート数” を確定
     # ------------------------------------------------------------
+    # 追加した処理: 同じ内容・同じ分割パラメータなら split キャッシュから境界/ヒントを取り出す
+    split_cache = get_split_cache(outroot)
+
     per_file_chunks: List[dict] = []
     global_total = 0
 
+    # 追加した処理: 差分再分割の前回版（base_session 指定時はその RUN の original を使う）
+    base_originals = load_base_originals(outroot, base_session) if (incremental and str(base_session or "").strip()) else {}
+
+    # 追加した処理: ファイルごとの split は独立なので、キャッシュに無いものをまとめて CPU プールへ投げる（2パス）
+    # - 1パス目: キャッシュ照合・前回版の特定・計算が要るファイルの洗い出し（同じ内容は1回だけ計算する）
+    # - 2パス目: 結果をファイル順に並べて “全体パート数” を確定する
+    file_records: List[dict] = []
+    pending: "OrderedDict[str, tuple]" = OrderedDict()
+
     for file_idx, tgt in enumerate(split_targets, start=1):
         t_filename = str(tgt.get("filename") or "input.js")
         t_content = str(tgt.get("content") or "")
         if t_content == "":
             continue
 
-        chunks = split_by_limits(
-            t_content,
-            maxchars,
-            maxlines,
-            split_mode=split_mode,
-            iife_grace_ratio=iife_grace_ratio,
-        )
+        content_sha256 = content_sha256s[file_idx - 1]
+        cache_key = split_cache_key(content_sha256, maxchars, maxlines, split_mode, iife_grace_ratio)
+        entry = split_cache.get(cache_key)
+
+        lineage_key = split_lineage_key(t_filename, maxchars, maxlines, split_mode, iife_grace_ratio)
+        base_sha256 = ""
+        base_key = ""
+        base_entry = None
+        if incremental:
+            if base_originals:
+                base_sha256 = str(base_originals.get(t_filename) or "")
+            else:
+                lineage = split_cache.get(lineage_key)
+                base_sha256 = str((lineage or {}).get("content_sha256") or "")
+            if base_sha256:
+                base_key = split_cache_key(base_sha256, maxchars, maxlines, split_mode, iife_grace_ratio)
+                base_entry = split_cache.get(base_key)
+                if base_entry is None and base_key not in pending:
+                    # 追加した処理: 前回版の split がキャッシュから消えていても（ディスク上限で削除等）、
+                    # 本文が blob に残っていれば分割し直して body_changed の比較元にする
+                    base_text = load_blob_text(outroot, base_sha256)
+                    if base_text is not None:
+                        pending[base_key] = (None, None, base_text, maxchars, maxlines, split_mode, iife_grace_ratio)
+
+        if entry is None and cache_key not in pending:
+            base_content = load_blob_text(outroot, base_sha256) if (base_entry is not None and base_sha256 != content_sha256) else None
+            # 追加した処理: 前回版があれば共通部分の境界・SHA256・ヒントを引き継いで、編集箇所の周辺だけ計算する
+            pending[cache_key] = (
+                base_content,
+                base_entry if base_content is not None else None,
+                t_content,
+                maxchars,
+                maxlines,
+                split_mode,
+                iife_grace_ratio,
+            )
+
+        # 追加した処理: 次回の差分再分割の前回版として、このファイル名の最新内容を記録する
+        split_cache.put(lineage_key, {"version": SPLIT_CACHE_VERSION, "content_sha256": content_sha256})
+
+        file_records.append({
+            "file_idx": int(file_idx),
+            "filename": t_filename,
+            "content": t_content,
+            "content_sha256": content_sha256,
+            "cache_key": cache_key,
+            "entry": entry,
+            "base_key": base_key,
+            "base_entry": base_entry,
+        })
 
+    if pending:
+        computed = run_cpu_tasks(compute_split_cache_entry_any, list(pending.values()))
+        for key, entry in zip(pending.keys(), computed):
+            split_cache.put(key, entry)
+        computed_by_key = dict(zip(pending.keys(), computed))
+    else:
+        computed_by_key = {}
+
+    for rec in file_records:
+        entry = rec["entry"] if rec["entry"] is not None else computed_by_key[rec["cache_key"]]
+
+        # 前回版に同じ本文のパートがあるか（incremental のときだけ判定する）
+        # - 前回版が分からない（記録なし / 本文も残っていない）ときは None のまま = body_changed を出さない
+        base_part_shas = None
+        if incremental:
+            base_entry = rec["base_entry"]
+            if base_entry is None and rec["base_key"]:
+                base_entry = computed_by_key.get(rec["base_key"])
+            if base_entry is not None:
+                base_part_shas = set(str(bp.get("part_sha256") or "") for bp in (base_entry.get("parts") or []))
+
+        file_idx = rec["file_idx"]
         file_tag = f"F{file_idx:02d}"
         per_file_chunks.append({
             "file_idx": int(file_idx),
             "file_tag": file_tag,
-            "filename": t_filename,
-            "content": t_content,
-            "chunks": chunks,
+            "filename": rec["filename"],
+            "content": rec["content"],
+            "content_sha256": rec["content_sha256"],
+            "cache_key": rec["cache_key"],
+            "chunks": entry.get("parts") or [],
+            "base_part_shas": base_part_shas,
         })
-        global_total += int(len(chunks))
+        global_total += int(len(entry.get("parts") or []))
 
     if global_total <= 0:
         raise ValueError("no valid input files (all contents were empty?)")
@@ -1812,14 +4179,47 @@ def generate_parts(
     # ------------------------------------------------------------
     # 2) SCOPE_INDEX は「全ファイル結合テキスト」から1回だけ作る
     # ------------------------------------------------------------
-    concat_lines: List[str] = []
+    # 追加した処理: ファイル名と内容SHA256の並びが同じなら、キャッシュ済みの SCOPE_INDEX を使う
+    scope_key_lines = ["scope", str(SPLIT_CACHE_VERSION)]
     for it in per_file_chunks:
-        concat_lines.append("/* ===CSCS_MULTI_FILE_BEGIN=== */")
-        concat_lines.append(f"/* FILE: {str(it.get('filename') or '')} */")
-        concat_lines.append(str(it.get("content") or ""))
-        concat_lines.append("/* ===CSCS_MULTI_FILE_END=== */")
-    concat_text = "\n".join(concat_lines)
-    scope_index_block = build_scope_index_block(concat_text)
+        scope_key_lines.append(str(it.get("filename") or ""))
+        scope_key_lines.append(str(it.get("content_sha256") or ""))
+    scope_cache_key = sha256_hex("\n".join(scope_key_lines))
+
+    scope_entry = split_cache.get(scope_cache_key)
+    if scope_entry is not None:
+        scope_index_block = str(scope_entry.get("scope_index_block") or "")
+    else:
+        # 追加した処理: 連結テキストは作らず、ファイルごとの断片（内容SHA256でキャッシュ）を連結順に足し込む。
+        # 区切りコメント行は小さいのでその場で走査する（連結してから走査したのと同じ索引になる）
+        frags: dict = {}
+        frag_pending: "OrderedDict[str, str]" = OrderedDict()
+        for it in per_file_chunks:
+            frag_key = scope_fragment_cache_key(str(it.get("content_sha256") or ""))
+            if frag_key in frags or frag_key in frag_pending:
+                continue
+            frag = split_cache.get(frag_key)
+            if frag is None:
+                frag_pending[frag_key] = str(it.get("content") or "")
+            else:
+                frags[frag_key] = frag
+        if frag_pending:
+            computed_frags = run_cpu_tasks(compute_scope_fragment, [(c,) for c in frag_pending.values()])
+            for frag_key, frag in zip(frag_pending.keys(), computed_frags):
+                split_cache.put(frag_key, frag)
+                frags[frag_key] = frag
+
+        scope_data = new_scope_index_data()
+        for it in per_file_chunks:
+            frag = frags[scope_fragment_cache_key(str(it.get("content_sha256") or ""))]
+
+            head_text = "\n".join(["/* ===CSCS_MULTI_FILE_BEGIN=== */", f"/* FILE: {str(it.get('filename') or '')} */"])
+            merge_scope_index(scope_data, scan_scope_index(head_text))
+            merge_scope_index(scope_data, scope_index_from_json(frag))
+            merge_scope_index(scope_data, scan_scope_index("/* ===CSCS_MULTI_FILE_END=== */"))
+
+        scope_index_block = render_scope_index_block(scope_data)
+        split_cache.put(scope_cache_key, {"version": SPLIT_CACHE_VERSION, "scope_index_block": scope_index_block})
 
     # ------------------------------------------------------------
     # 3) SplitPart を “全体連番” で作る
@@ -1832,21 +4232,15 @@ def generate_parts(
         t_content = str(it.get("content") or "")
         file_tag = str(it.get("file_tag") or "")
         chunks = it.get("chunks") or []
-
-        # PART_SCOPE_HINT 用：行番号（1-based）
-        line_starts = _line_start_offsets(t_content)
+        base_part_shas = it.get("base_part_shas")
 
         file_total = int(len(chunks))
-        for local_idx, (st, ed, ch, depth_start, depth_end) in enumerate(chunks, start=1):
+        for local_idx, cp in enumerate(chunks, start=1):
             global_idx += 1
             part_id = build_part_id(session_id, global_idx, global_total)
 
-            lines = ch.splitlines()
-            first_line = lines[0] if lines else ""
-            last_line = lines[-1] if lines else ""
-
-            start_line = _offset_to_line_index(line_starts, st) + 1
-            end_line = _offset_to_line_index(line_starts, max(st, ed - 1)) + 1
+            st = int(cp["start_offset"])
+            ed = int(cp["end_offset"])
 
             parts.append(SplitPart(
                 source_filename=t_filename,
@@ -1858,19 +4252,26 @@ def generate_parts(
                 total=int(file_total),
 
                 part_id=part_id,
-                text=ch,
+                # 追加した処理: 本文はコピーせず、ファイル全文と範囲だけを持つ
+                source_text=t_content,
                 start_offset=st,
                 end_offset=ed,
 
-                start_line=start_line,
-                end_line=end_line,
-                brace_depth_start=int(depth_start),
-                brace_depth_end=int(depth_end),
+                # PART_SCOPE_HINT 用：行番号（1-based）
+                start_line=int(cp["start_line"]),
+                end_line=int(cp["end_line"]),
+                brace_depth_start=int(cp["brace_depth_start"]),
+                brace_depth_end=int(cp["brace_depth_end"]),
 
-                part_sha256=sha256_hex(ch),
+                part_sha256=str(cp["part_sha256"]),
 
-                first_line=first_line,
-                last_line=last_line,
+                first_line=str(cp["first_line"]),
+                last_line=str(cp["last_line"]),
+
+                scope_hints=(str(cp["top_identifiers"]), str(cp["defines"])),
+
+                body_changed=None if base_part_shas is None else (str(cp["part_sha256"]) not in base_part_shas),
+                text_span=(st, ed),
             ))
 
     expected_ids = build_expected_partids(parts)
@@ -1948,7 +4349,7 @@ def generate_parts(
         index=0,
         total=0,
         part_id="",
-        text="",
+        source_text="",
         start_offset=0,
         end_offset=0,
         start_line=0,
@@ -1977,7 +4378,7 @@ def generate_parts(
             index=0,
             total=0,
             part_id="",
-            text=str(t or ""),
+            source_text=str(t or ""),
             start_offset=0,
             end_offset=0,
             start_line=0,
@@ -2016,7 +4417,7 @@ def generate_parts(
         index=0,
         total=0,
         part_id="",
-        text=str(protocol_preamble or ""),
+        source_text=str(protocol_preamble or ""),
         start_offset=0,
         end_offset=0,
         start_line=0,
@@ -2050,42 +4451,104 @@ def generate_parts(
     # 追加した処理: 受領照合用の expected_ids も、再発番後の PartID 群で作り直す
     expected_ids = build_expected_partids(parts)
 
-    payloads: List[str] = []
-    for p in parts:
-        # ★ 追加した処理: 受領確認は “全体連番” を使う
-        cumulative_ids = build_cumulative_partids(parts, p.global_index)
-
-        # ★ 追加した処理: EXEC_TASK を載せるのは “全体の最終パートだけ”（最終パートは EXEC_TASK 専用）
-        is_last_overall = (p.global_index == p.global_total)
-
-        # 追加した処理: 抽出追加パートは本文が “text” なので language_tag を切り替える
-        lang_tag = lang
-        # 追加した処理: PROTOCOL_PREAMBLE / 抽出追加パート / EXEC_TASK はコード本文ではないため text 扱いにする
-        if str(p.source_filename) in ("PROTOCOL_PREAMBLE", "SCOPE_CHECK_EXTRACT_CODE", "EXEC_TASK"):
-            lang_tag = "text"
+    # 追加した処理: コード本文パートの payload は「ファイル内容/分割パラメータ/SessionID/言語/総数」だけで決まる。
+    # 指示文だけが変わった再送では前文/EXEC_TASK だけを作り直し、コード本文パートは前回の payload を使う。
+    payload_key_lines = ["payloads", str(SPLIT_CACHE_VERSION), session_id, str(lang), str(global_total_new)]
+    for it in per_file_chunks:
+        payload_key_lines.append(str(it.get("filename") or ""))
+        payload_key_lines.append(str(it.get("cache_key") or ""))
+    payload_cache_key = sha256_hex("\n".join(payload_key_lines))
+    cached_code_payloads = split_cache.get(payload_cache_key)
+    cached_code_idx = 0
+    # 追加した処理: 新しく作るコード本文 payload は上限内でだけ溜める（超えたら None = このセッションは残さない）
+    code_payloads: Optional[List[str]] = [] if cached_code_payloads is None else None
+    code_payload_chars = 0
+
+    # 受領確認の累積 PartID はパートごとに全件を舐めず、global_index の前置リストから引く
+    partid_prefix_index = build_partid_prefix_index(parts)
+
+    # 追加した処理: opt-in の並列組み立て。キャッシュから出せないパート（最終パート以外）を CPU プールへ分けて先に作る
+    use_parallel = PARALLEL_PAYLOAD_RENDER if parallel_render is None else bool(parallel_render)
+    prerendered: dict = {}
+    if use_parallel and _CPU_POOL is not None:
+        to_render = [
+            p for p in parts
+            if p.global_index != p.global_total
+            and not (cached_code_payloads is not None and str(p.source_filename) not in NON_CODE_PART_SOURCES)
+        ]
+        if len(to_render) >= PARALLEL_PAYLOAD_MIN_PARTS:
+            n_batches = max(1, min(len(to_render), _CPU_POOL_WORKERS * 4))
+            size = (len(to_render) + n_batches - 1) // n_batches
+            batches = [to_render[i:i + size] for i in range(0, len(to_render), size)]
+            rendered = run_cpu_tasks(
+                render_part_payload_batch,
+                [(b, lang, partid_prefix_index, expected_ids, protocol_epilogue) for b in batches],
+            )
+            for b, rs in zip(batches, rendered):
+                for p, payload in zip(b, rs):
+                    prerendered[p.global_index] = payload
+
+    # parts/ への書き込み（並列時はスレッドで並行。on_part は常にパート順で呼ぶ）
+    writer = ThreadPoolExecutor(max_workers=max(1, PAYLOAD_WRITE_THREADS)) if prerendered else None
+    write_futures = []
+
+    def _write_part(p: SplitPart, payload: str) -> None:
+        dest = parts_dir / f"part_{p.global_index:02d}.txt"
+        if writer is None:
+            store_text_via_blob(outroot, dest, payload)
+        else:
+            write_futures.append(writer.submit(store_text_via_blob, outroot, dest, payload))
 
-        receipt_input = build_receipt_input_block(
-            cumulative_ids=cumulative_ids,
-            expected_ids=expected_ids,
-            is_last=bool(is_last_overall),
-            exec_task_text=wrapped_instruction if is_last_overall else "",
-            parts=parts,
-            scope_index_block=scope_index_block if is_last_overall else "",
-            scope_extract_code="",
-        )
+    payloads: List[str] = []
+    try:
+        for p in parts:
+            is_code_part = str(p.source_filename) not in NON_CODE_PART_SOURCES
+            if is_code_part and cached_code_payloads is not None and cached_code_idx < len(cached_code_payloads):
+                payload = str(cached_code_payloads[cached_code_idx])
+                cached_code_idx += 1
+                _write_part(p, payload)
+                if on_part is not None:
+                    on_part(p, payload)
+                else:
+                    payloads.append(payload)
+                continue
 
-        # 追加した処理: protocol_preamble は前文専用パートの本文として出すため、
-        #               make_part_payload() 側へ混在させない（常に空を渡す）
-        payload = make_part_payload(
-            part=p,
-            language_tag=lang_tag,
-            protocol_preamble="",
-            receipt_input_block=receipt_input,
-            protocol_epilogue=protocol_epilogue,
-        )
+            payload = prerendered.pop(p.global_index, None)
+            if payload is None:
+                # ★ 追加した処理: 受領確認は “全体連番” を使う
+                payload = render_part_payload(
+                    part=p,
+                    lang=lang,
+                    cumulative_ids=cumulative_partids_from_index(partid_prefix_index, p.global_index),
+                    expected_ids=expected_ids,
+                    parts=parts,
+                    exec_task_text=wrapped_instruction,
+                    scope_index_block=scope_index_block,
+                    protocol_epilogue=protocol_epilogue,
+                )
+
+            if is_code_part and code_payloads is not None:
+                code_payload_chars += len(payload)
+                if code_payload_chars > DEFAULT_CODE_PAYLOAD_MEMO_MAX_CHARS:
+                    code_payloads = None
+                else:
+                    code_payloads.append(payload)
 
-        (parts_dir / f"part_{p.global_index:02d}.txt").write_text(payload, encoding="utf-8")
-        payloads.append(payload)
+            _write_part(p, payload)
+            if on_part is not None:
+                on_part(p, payload)
+            else:
+                payloads.append(payload)
+    finally:
+        if writer is not None:
+            writer.shutdown(wait=True)
+    # 書き込み失敗は逐次時と同じく generate_parts の例外として返す
+    for f in write_futures:
+        f.result()
+
+    if code_payloads is not None:
+        # payload はディスクの parts/ に実体があるため、メモリ LRU のみに載せる
+        split_cache.put(payload_cache_key, code_payloads, persist=False)
 
     # ------------------------------------------------------------
     # 5) manifest は “MULTI_FILES” として残し、original は全ファイル保存する
@@ -2093,15 +4556,27 @@ def generate_parts(
     original_dir = out_dir / "original"
     safe_mkdir(original_dir)
 
+    # 追加した処理: original は blob ストア経由で保存する（同一内容は RUN をまたいで実体1つ）
+    originals: List[dict] = []
     for it in per_file_chunks:
         fn = Path(str(it.get("filename") or "input.js")).name
-        (original_dir / fn).write_text(str(it.get("content") or ""), encoding="utf-8")
+        digest = store_text_via_blob(
+            outroot,
+            original_dir / fn,
+            str(it.get("content") or ""),
+            sha256=str(it.get("content_sha256") or ""),
+        )
+        originals.append({
+            "filename": str(it.get("filename") or ""),
+            "sha256": digest,
+            "file": f"original/{fn}",
+        })
 
     # manifest は最小限の互換情報として “先頭ファイル” を代表に入れる
     rep_filename = str(per_file_chunks[0].get("filename") or "MULTI_FILES")
-    rep_sha256 = sha256_hex(str(per_file_chunks[0].get("content") or ""))
+    rep_sha256 = str(per_file_chunks[0].get("content_sha256") or "")
 
-    write_manifest_json(
+    manifest = write_manifest_json(
         out_dir=out_dir,
         session_id=session_id,
         input_filename=rep_filename,
@@ -2118,13 +4593,142 @@ def generate_parts(
         project_id=project_id,
         task_id=task_id,
         request_id=request_id,
+        originals=originals,
     )
 
+    # 追加した処理: /api/instructions の索引へこの RUN を追加する（失敗しても split は成功させる。次回の一覧時の突き合わせで拾う）
+    try:
+        get_run_index(outroot).record_run(out_dir, manifest)
+    except Exception as e:
+        print("[RUN_INDEX][WARN] record_run", out_dir.name, repr(e))
+        mark_run_index_stale(outroot)
+
     enforce_max_log_dirs(outroot=outroot, max_keep=max_keep_logs)
 
     return session_id, out_dir, parts, payloads
 
 
+# ============================================================
+# パート単位の遅延取得（/api/part）
+# ------------------------------------------------------------
+# meta_only の /api/split はメタだけ返し、payload は1つずつ /api/part で取りに来る。
+# - 直近の payload はメモリ LRU から返す（キー: output_dir + index）
+# - LRU に無ければ RUN ディレクトリの parts/part_NN.txt を読む
+# ============================================================
+_PART_PAYLOAD_CACHE = SplitCache(cache_dir=None, max_entries=DEFAULT_PART_PAYLOAD_CACHE_ENTRIES, max_bytes=0)
+_RE_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# /api/extract の関数定義インデックス（内容SHA256 → JsDefinitionIndex。メモリのみ）
+_DEFINITION_INDEX_CACHE = SplitCache(cache_dir=None, max_entries=DEFAULT_DEFINITION_INDEX_CACHE_ENTRIES, max_bytes=0)
+
+
+def remember_run_payloads(session_id: str, out_dir: Path, parts: List[SplitPart], payloads: List[str]) -> None:
+    """
+    /api/part 用に、この RUN の payload と「SessionID → 最新 RUN」の対応をメモリへ載せる。
+    """
+    for p, payload in zip(parts, payloads):
+        _PART_PAYLOAD_CACHE.put(f"part\n{out_dir}\n{int(p.global_index)}", payload, persist=False)
+    _PART_PAYLOAD_CACHE.put(f"run\n{session_id}", str(out_dir), persist=False)
+
+
+def forget_run_payloads(run_dir: Path) -> int:
+    """
+    削除した RUN の payload と「SessionID → RUN」の対応を /api/part のメモリから外す。
+    - キーの RUN パスは resolve の有無で表記が揺れ得るので、RUN ディレクトリ名で突き合わせる
+    戻り値: 外した件数
+    """
+    name = Path(run_dir).name
+
+    def _is_this_run(key: str, value) -> bool:
+        kind, _, rest = key.partition("\n")
+        if kind == "part":
+            return Path(rest.rsplit("\n", 1)[0]).name == name
+        if kind == "run":
+            return Path(str(value)).name == name
+        return False
+
+    return _PART_PAYLOAD_CACHE.discard_where(_is_this_run)
+
+
+def resolve_run_dir_for_session(outroot: Path, session_id: str) -> Optional[Path]:
+    """
+    SessionID から RUN ディレクトリを決める（同じ SessionID が複数あれば最新）。
+    """
+    sid = str(session_id or "").strip()
+    if not _RE_SESSION_ID.match(sid):
+        return None
+
+    remembered = _PART_PAYLOAD_CACHE.get(f"run\n{sid}")
+    if remembered and Path(str(remembered)).is_dir():
+        return Path(str(remembered))
+
+    # RUN ディレクトリ名は "<SessionID>_<YYYYmmdd_HHMMSS>" なので名前順の最後が最新
+    cands = sorted(d for d in list_run_dirs(outroot) if d.name.startswith(sid + "_"))
+    return cands[-1] if cands else None
+
+
+def load_part_payload(run_dir: Path, index: int) -> Optional[str]:
+    """
+    RUN ディレクトリの index 番目（1-based）の payload を返す（無ければ None）。
+    """
+    # 別プロセス・手作業で消された RUN の payload をメモリから返さない
+    if not run_dir.is_dir():
+        forget_run_payloads(run_dir)
+        return None
+
+    cached = _PART_PAYLOAD_CACHE.get(f"part\n{run_dir}\n{int(index)}")
+    if cached is not None:
+        return str(cached)
+
+    f = run_dir / "parts" / f"part_{int(index):02d}.txt"
+    if not f.is_file():
+        return None
+    payload = f.read_text(encoding="utf-8")
+    _PART_PAYLOAD_CACHE.put(f"part\n{run_dir}\n{int(index)}", payload, persist=False)
+    return payload
+
+
+def part_response_item(p: SplitPart, payload: Optional[str]) -> dict:
+    """
+    /api/split のレスポンスに載せる1パート分のメタ（payload が None なら payload キー自体を出さない）。
+    """
+    item = {
+        "index": int(p.global_index),
+        "total": int(p.global_total),
+        "part_id": p.part_id,
+
+        "source_filename": str(p.source_filename),
+        "file_tag": str(p.file_tag),
+
+        "part_sha256": p.part_sha256,
+        "part_sha8": p.part_sha256[:8].upper(),
+
+        "start_offset": p.start_offset,
+        "end_offset": p.end_offset,
+        "len_chars": p.text_len,
+    }
+    # 差分再分割（incremental）時のみ: 前回版から本文が変わったか
+    if p.body_changed is not None:
+        item["body_changed"] = bool(p.body_changed)
+    if payload is not None:
+        item["payload"] = payload
+    return item
+
+
+def incremental_response_info(parts: List[SplitPart], base_session: str) -> dict:
+    """
+    incremental=true の /api/split に付ける要約（本文が変わったコードパートの PartID など）。
+    """
+    code_parts = [p for p in parts if p.body_changed is not None]
+    changed = [p for p in code_parts if p.body_changed]
+    return {
+        "base_session": str(base_session or ""),
+        "changed_part_ids": [p.part_id for p in changed],
+        "changed_indexes": [int(p.global_index) for p in changed],
+        "unchanged_parts": int(len(code_parts) - len(changed)),
+    }
+
+
 class Handler(BaseHTTPRequestHandler):
     def _send(self, code: int, body: bytes, content_type: str) -> None:
         self.send_response(code)
@@ -2133,6 +4737,17 @@ class Handler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(body)
 
+    def _start_ndjson(self) -> None:
+        # NDJSON ストリーミング応答（Content-Length なし。HTTP/1.0 なので接続終了が本文の終端）
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+
+    def _write_ndjson(self, obj: dict) -> None:
+        self.wfile.write(json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
     def do_GET(self) -> None:
         if self.path == "/" or self.path.startswith("/?"):
             body = HTML_PAGE.encode("utf-8")
@@ -2161,6 +4776,70 @@ class Handler(BaseHTTPRequestHandler):
             self._send(200, b"OK", "text/plain; charset=utf-8")
             return
 
+        # ------------------------------------------------------------
+        # ★ 追加した処理: パート単位の遅延取得
+        # GET /api/part?session=<SessionID>&index=N（または output_dir=<RUNディレクトリ>&index=N）
+        # - meta_only の /api/split と組み合わせ、コピーするパートだけを取りに来る
+        # ------------------------------------------------------------
+        if self.path == "/api/part" or self.path.startswith("/api/part?"):
+            from urllib.parse import urlparse, parse_qs
+
+            outroot = Path(__file__).resolve().parent / DEFAULT_OUTROOT
+            safe_mkdir(outroot)
+
+            qs = parse_qs(urlparse(self.path).query or "")
+            session_raw = str((qs.get("session") or [""])[0] or "").strip()
+            output_dir_raw = str((qs.get("output_dir") or [""])[0] or "").strip()
+
+            try:
+                index = int(str((qs.get("index") or [""])[0] or "").strip())
+            except Exception:
+                self._send(400, b"index must be an integer", "text/plain; charset=utf-8")
+                return
+            if index <= 0:
+                self._send(400, b"index must be >= 1", "text/plain; charset=utf-8")
+                return
+
+            try:
+                if output_dir_raw != "":
+                    run_dir = Path(output_dir_raw).resolve()
+                    if not str(run_dir).startswith(str(outroot.resolve()) + os.sep):
+                        self._send(403, b"forbidden: target is outside outroot", "text/plain; charset=utf-8")
+                        return
+                elif session_raw != "":
+                    run_dir = resolve_run_dir_for_session(outroot, session_raw)
+                    if run_dir is None:
+                        self._send(404, b"session not found", "text/plain; charset=utf-8")
+                        return
+                else:
+                    self._send(400, b"session or output_dir is required", "text/plain; charset=utf-8")
+                    return
+
+                payload = load_part_payload(run_dir, index)
+                if payload is None:
+                    self._send(404, b"part not found", "text/plain; charset=utf-8")
+                    return
+
+                self._send(200, payload.encode("utf-8"), "text/plain; charset=utf-8")
+                return
+
+            except Exception as e:
+                self._send(500, f"failed: {e}".encode("utf-8"), "text/plain; charset=utf-8")
+                return
+
+        if self.path == "/api/check/stats":
+            # 追加した処理: 構文チェック結果キャッシュのヒット/ミス数（プロセス起動からの累計）と件数
+            outroot = Path(__file__).resolve().parent / DEFAULT_OUTROOT
+            try:
+                stats = get_check_result_cache(outroot).stats()
+            except Exception as e:
+                body = json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8")
+                self._send(500, body, "application/json; charset=utf-8")
+                return
+            body = json.dumps(stats, ensure_ascii=False).encode("utf-8")
+            self._send(200, body, "application/json; charset=utf-8")
+            return
+
         if self.path.startswith("/api/instructions/original"):
             from urllib.parse import urlparse, parse_qs
 
@@ -2237,38 +4916,53 @@ class Handler(BaseHTTPRequestHandler):
                 return
 
         if self.path.startswith("/api/instructions"):
+            from urllib.parse import urlparse, parse_qs
+
             outroot = Path(__file__).resolve().parent / DEFAULT_OUTROOT
             safe_mkdir(outroot)
 
-            items = []
-            total_dirs = 0
+            u = urlparse(self.path)
+            qs = parse_qs(u.query or "")
+
+            def _q(name: str) -> str:
+                v = qs.get(name) or [""]
+                return str(v[0] or "").strip()
+
+            # 追加した処理: 一覧は RUN 索引から返す（outroot の列挙や manifest.json の読み込みをしない）
+            # - 絞り込み: project_id / task_id / session_id / since / until（created_at）/ q（指示文・ファイル名の全文検索）
+            # - ページング: limit 件ずつ。続きは応答の next_cursor を cursor に渡す（既定は従来どおり新しい50件）
+            # - instruction=preview|none で指示文の全文を返さない（既定 full は従来どおり）
             try:
-                dirs = [p for p in outroot.iterdir() if p.is_dir()]
-                total_dirs = len(dirs)
-                dirs.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-                for d in dirs[:50]:
-                    mf = d / "manifest.json"
-                    if not mf.exists():
-                        continue
-                    try:
-                        data = json.loads(mf.read_text(encoding="utf-8"))
-                    except Exception:
-                        continue
-
-                    inp = data.get("input") or {}
-                    wk = data.get("work") or {}
-                    items.append({
-                        "output_dir": str(d),
-                        "session_id": str(data.get("session_id") or ""),
-                        "created_at": str(data.get("created_at") or ""),
-                        "target_file": str(inp.get("filename") or ""),
-                        "original_sha256": str(inp.get("sha256") or ""),
-                        "original_saved_copy": str(inp.get("saved_copy") or ""),
-                        "project_id": str(wk.get("project_id") or ""),
-                        "task_id": str(wk.get("task_id") or ""),
-                        "request_id": str(wk.get("request_id") or ""),
-                        "instruction": str(data.get("instruction") or ""),
-                    })
+                try:
+                    limit = int(_q("limit") or DEFAULT_INSTRUCTIONS_PAGE_SIZE)
+                except ValueError:
+                    self._send(400, b"limit must be an integer", "text/plain; charset=utf-8")
+                    return
+
+                instruction_mode = _q("instruction") or "full"
+                if instruction_mode not in ("full", "preview", "none"):
+                    self._send(400, b"instruction must be full, preview or none", "text/plain; charset=utf-8")
+                    return
+
+                run_index = get_run_index(outroot)
+                # 追加した処理: 別プロセス・手作業で RUN が増減していれば、ここで索引を突き合わせ直す
+                run_index.sync_if_changed()
+                try:
+                    items, matched, next_cursor = run_index.query_runs(
+                        project_id=_q("project_id"),
+                        task_id=_q("task_id"),
+                        session_id=_q("session_id"),
+                        since=_q("since"),
+                        until=_q("until"),
+                        text=_q("q"),
+                        limit=limit,
+                        cursor=_q("cursor"),
+                        instruction_mode=instruction_mode,
+                    )
+                except ValueError as e:
+                    self._send(400, str(e).encode("utf-8"), "text/plain; charset=utf-8")
+                    return
+                total_dirs = run_index.count_runs()
             except Exception as e:
                 body = json.dumps({"error": str(e), "outroot": str(outroot)}, ensure_ascii=False).encode("utf-8")
                 self._send(500, body, "application/json; charset=utf-8")
@@ -2278,6 +4972,8 @@ class Handler(BaseHTTPRequestHandler):
                 {
                     "outroot": str(outroot),
                     "total_dirs": int(total_dirs),
+                    "total_matched": int(matched),
+                    "next_cursor": next_cursor,
                     "items": items,
                 },
                 ensure_ascii=False
@@ -2288,7 +4984,7 @@ class Handler(BaseHTTPRequestHandler):
         self._send(404, b"Not Found", "text/plain; charset=utf-8")
 
     def do_POST(self) -> None:
-        if self.path != "/api/split" and self.path != "/api/check" and self.path != "/api/instructions/delete" and self.path != "/api/extract":
+        if self.path not in ("/api/split", "/api/check", "/api/check/batch", "/api/instructions/delete", "/api/extract"):
             self._send(404, b"Not Found", "text/plain; charset=utf-8")
             return
 
@@ -2328,6 +5024,8 @@ class Handler(BaseHTTPRequestHandler):
                     return
 
                 if not target_path.exists():
+                    # 索引にだけ残っている RUN も一覧から外す
+                    remove_run_from_index(outroot, target_path)
                     body = json.dumps({"ok": True, "deleted": False, "reason": "not found"}, ensure_ascii=False).encode("utf-8")
                     self._send(200, body, "application/json; charset=utf-8")
                     return
@@ -2338,6 +5036,14 @@ class Handler(BaseHTTPRequestHandler):
 
                 shutil.rmtree(target_path)
 
+                # 追加した処理: 一覧の索引から外す
+                remove_run_from_index(outroot, target_path)
+                # 追加した処理: /api/part のメモリからも外す（消した RUN の payload を返し続けない）
+                forget_run_payloads(target_path)
+
+                # 追加した処理: この RUN だけが参照していた blob を片付ける
+                gc_blob_store(outroot)
+
                 body = json.dumps({"ok": True, "deleted": True}, ensure_ascii=False).encode("utf-8")
                 self._send(200, body, "application/json; charset=utf-8")
                 return
@@ -2384,8 +5090,46 @@ class Handler(BaseHTTPRequestHandler):
                 self._send(200, body, "application/json; charset=utf-8")
                 return
 
-            ok, msg = check_js_syntax_with_node(filename=filename, content=content)
-            body = json.dumps({"ok": bool(ok), "error": "" if ok else str(msg)}, ensure_ascii=False).encode("utf-8")
+            # 追加した処理: 結果キャッシュを先に引き、無ければ常駐 node で判定する（リクエストごとに node を起動しない）
+            try:
+                outroot = Path(__file__).resolve().parent / DEFAULT_OUTROOT
+                res = check_js_files(outroot, [{"filename": filename, "content": content}])[0]
+            except Exception as e:
+                body = json.dumps({"ok": False, "error": f"syntax check failed: {e}"}, ensure_ascii=False).encode("utf-8")
+                self._send(500, body, "application/json; charset=utf-8")
+                return
+            body = json.dumps(
+                {
+                    "ok": bool(res["ok"]),
+                    "error": str(res["error"]),
+                    "line": res["line"],
+                    "column": res["column"],
+                    "cached": bool(res["cached"]),
+                },
+                ensure_ascii=False,
+            ).encode("utf-8")
+            self._send(200, body, "application/json; charset=utf-8")
+            return
+
+        if self.path == "/api/check/batch":
+            # 追加した処理: /api/split と同じ files をまとめて構文チェックする（1往復・常駐 node で同時判定・内容SHA256でキャッシュ）
+            if not files:
+                body = json.dumps({"ok": False, "error": "files is empty"}, ensure_ascii=False).encode("utf-8")
+                self._send(200, body, "application/json; charset=utf-8")
+                return
+
+            try:
+                outroot = Path(__file__).resolve().parent / DEFAULT_OUTROOT
+                results = check_js_files(outroot, files)
+            except Exception as e:
+                body = json.dumps({"ok": False, "error": f"syntax check failed: {e}"}, ensure_ascii=False).encode("utf-8")
+                self._send(500, body, "application/json; charset=utf-8")
+                return
+
+            body = json.dumps(
+                {"ok": all(r["ok"] for r in results), "results": results},
+                ensure_ascii=False,
+            ).encode("utf-8")
             self._send(200, body, "application/json; charset=utf-8")
             return
 
@@ -2565,9 +5309,10 @@ class Handler(BaseHTTPRequestHandler):
 
                 blocks = []
 
-                # 1) 関数まるごと抽出
+                # 1) 関数まるごと抽出（定義インデックスはソースの内容ごとに1回だけ作って全シンボルで共有する）
+                src_def_index = get_js_definition_index(src_content) if symbols else None
                 for name in symbols:
-                    found, header, body = extract_function_whole(js_text=src_content, name=name)
+                    found, header, body = extract_function_whole(js_text=src_content, name=name, def_index=src_def_index)
                     blocks.append({
                         "kind": "function_whole",
                         "name": name,
@@ -2577,14 +5322,15 @@ class Handler(BaseHTTPRequestHandler):
                         "sha256": sha256_hex(str(body)) if found else "",
                     })
 
-                # 2) 呼び出し周辺抽出
+                # 2) 呼び出し周辺抽出（全 needle をソースごとに1回の走査でまとめて探す）
+                ctx_by_needle = extract_contexts_multi(
+                    js_text=src_content,
+                    needles=needles,
+                    context_lines=ctx_lines,
+                    max_matches=max_matches,
+                ) if needles else {}
                 for nd in needles:
-                    hit_count, ctx_blocks = extract_context_around(
-                        js_text=src_content,
-                        needle=nd,
-                        context_lines=ctx_lines,
-                        max_matches=max_matches,
-                    )
+                    hit_count, ctx_blocks = ctx_by_needle.get(nd, (0, []))
                     blocks.append({
                         "kind": "context",
                         "needle": nd,
@@ -2672,6 +5418,13 @@ class Handler(BaseHTTPRequestHandler):
         include_rules_raw = req.get("include_rules")
         include_rules = bool(include_rules_raw) if include_rules_raw is not None else False
 
+        # 追加した処理: 差分再分割（opt-in: incremental=true、前回版は base_session か同名ファイルの直近 split）
+        incremental = bool(req.get("incremental"))
+        # 追加した処理: payload の並列組み立て（省略時は PARALLEL_PAYLOAD_RENDER。false で逐次に固定）
+        parallel_render_raw = req.get("parallel_render")
+        parallel_render = None if parallel_render_raw is None else bool(parallel_render_raw)
+        base_session = str(req.get("base_session") or "").strip()
+
         if instruction.strip() == "":
             # 生成時に instruction が空なら拒否する（空EXEC_TASK防止）
             self._send(400, b"instruction is empty", "text/plain; charset=utf-8")
@@ -2694,6 +5447,93 @@ class Handler(BaseHTTPRequestHandler):
                 return
             split_targets = [{"filename": filename, "content": content}]
 
+        # ------------------------------------------------------------
+        # ★ 追加した処理: NDJSON ストリーミング（opt-in: stream="ndjson" または true）
+        # - payload が1つ出来るたびに {"type":"part", ...payload} を1行で送る（UIは先頭パートから貼り始められる）
+        # - 最後に {"type":"summary", ...}（manifest を含む）を1行で送る
+        # - parts と results[].parts の二重返却はしない（part 行は各パート1回だけ）
+        # ------------------------------------------------------------
+        stream_raw = req.get("stream")
+        stream_ndjson = stream_raw is True or str(stream_raw or "").strip().lower() == "ndjson"
+
+        if stream_ndjson:
+            stream_started = False
+
+            def _on_part(p: SplitPart, payload: str) -> None:
+                nonlocal stream_started
+                if not stream_started:
+                    self._start_ndjson()
+                    stream_started = True
+                line = {"type": "part"}
+                line.update(part_response_item(p, payload))
+                self._write_ndjson(line)
+
+            try:
+                session_id, out_dir, parts, _ = generate_parts(
+                    split_targets=split_targets,
+                    prefix=prefix,
+                    lang=lang,
+                    maxchars=maxchars,
+                    maxlines=maxlines,
+                    instruction=instruction,
+                    outroot=outroot,
+                    max_keep_logs=maxlogs,
+                    split_mode=split_mode,
+                    iife_grace_ratio=iife_grace_ratio,
+                    project_id=project_id,
+                    task_id=task_id,
+                    include_rules=include_rules,
+                    scope_extract_code=scope_extract_code,
+                    on_part=_on_part,
+                    incremental=incremental,
+                    base_session=base_session,
+                    parallel_render=parallel_render,
+                )
+            except Exception as e:
+                if not stream_started:
+                    self._send(500, f"Split failed: {e}".encode("utf-8"), "text/plain; charset=utf-8")
+                    return
+                # ヘッダ送信後の失敗は error 行で知らせる（クライアント切断時は送れないので握りつぶす）
+                try:
+                    self._write_ndjson({"type": "error", "ok": False, "error": f"Split failed: {e}"})
+                except Exception:
+                    pass
+                return
+
+            try:
+                manifest = json.loads((out_dir / "manifest.json").read_text(encoding="utf-8"))
+            except Exception:
+                manifest = {}
+
+            stream_results = []
+            for tgt in split_targets:
+                t_filename = str(tgt.get("filename") or "input.js")
+                stream_results.append({
+                    "filename": t_filename,
+                    "session_id": session_id,
+                    "output_dir": str(out_dir),
+                    "part_indexes": [int(p.global_index) for p in parts if str(p.source_filename) == t_filename],
+                })
+
+            summary = {
+                "type": "summary",
+                "ok": True,
+                "session_id": session_id,
+                "output_dir": str(out_dir),
+                "total_parts": int(len(parts)),
+                "multi": bool(len(stream_results) > 1),
+                "results": stream_results,
+                "manifest": manifest,
+            }
+            if incremental:
+                summary["incremental"] = incremental_response_info(parts, base_session)
+
+            try:
+                self._write_ndjson(summary)
+            except Exception:
+                pass
+            return
+
         try:
             session_id, out_dir, parts, payloads = generate_parts(
                 split_targets=split_targets,
@@ -2710,11 +5550,23 @@ class Handler(BaseHTTPRequestHandler):
                 task_id=task_id,
                 include_rules=include_rules,
                 scope_extract_code=scope_extract_code,
+                incremental=incremental,
+                base_session=base_session,
+                parallel_render=parallel_render,
             )
         except Exception as e:
             self._send(500, f"Split failed: {e}".encode("utf-8"), "text/plain; charset=utf-8")
             return
 
+        # ------------------------------------------------------------
+        # ★ 追加した処理: メタのみモード（opt-in: meta_only=true）
+        # - parts / results[].parts から payload を外し、PartID/SHA8/オフセット/長さだけ返す
+        # - payload は GET /api/part?session=...&index=N で1つずつ取得する
+        # ------------------------------------------------------------
+        meta_only = bool(req.get("meta_only"))
+        if meta_only:
+            remember_run_payloads(session_id, out_dir, parts, payloads)
+
         # ★ 追加した処理: UI 互換のため results を “ファイル別” にも組み立てる
         results = []
 
@@ -2727,25 +5579,7 @@ class Handler(BaseHTTPRequestHandler):
                 "filename": t_filename,
                 "session_id": session_id,
                 "output_dir": str(out_dir),
-                "parts": [
-                    {
-                        "index": int(p.global_index),
-                        "total": int(p.global_total),
-                        "part_id": p.part_id,
-
-                        "source_filename": str(p.source_filename),
-                        "file_tag": str(p.file_tag),
-
-                        "part_sha256": p.part_sha256,
-                        "part_sha8": p.part_sha256[:8].upper(),
-
-                        "start_offset": p.start_offset,
-                        "end_offset": p.end_offset,
-                        "len_chars": len(p.text),
-                        "payload": payloads[int(p.global_index) - 1],
-                    }
-                    for p in file_parts
-                ],
+                "parts": [part_response_item(p, None if meta_only else payloads[int(p.global_index) - 1]) for p in file_parts],
             })
 
         # ★ 生成対象が1件も無い場合はエラー（UI側の想定外クラッシュ防止）
@@ -2761,25 +5595,7 @@ class Handler(BaseHTTPRequestHandler):
         # そうすることで manifest.json の total_parts と API の parts 件数が一致し、「7のはずが5」問題を根絶する。
         first = results[0]
 
-        all_parts = [
-            {
-                "index": int(p.global_index),
-                "total": int(p.global_total),
-                "part_id": p.part_id,
-
-                "source_filename": str(p.source_filename),
-                "file_tag": str(p.file_tag),
-
-                "part_sha256": p.part_sha256,
-                "part_sha8": p.part_sha256[:8].upper(),
-
-                "start_offset": p.start_offset,
-                "end_offset": p.end_offset,
-                "len_chars": len(p.text),
-                "payload": payloads[int(p.global_index) - 1],
-            }
-            for p in parts
-        ]
+        all_parts = [part_response_item(p, None if meta_only else payloads[int(p.global_index) - 1]) for p in parts]
 
         resp = {
             "ok": True,
@@ -2788,7 +5604,10 @@ class Handler(BaseHTTPRequestHandler):
             "parts": all_parts,
             "results": results,
             "multi": bool(len(results) > 1),
+            "meta_only": meta_only,
         }
+        if incremental:
+            resp["incremental"] = incremental_response_info(parts, base_session)
 
         body = json.dumps(resp, ensure_ascii=False).encode("utf-8")
         self._send(200, body, "application/json; charset=utf-8")
@@ -2796,11 +5615,21 @@ class Handler(BaseHTTPRequestHandler):
 
 
 def main() -> None:
-    server = HTTPServer((BIND_HOST, BIND_PORT), Handler)
+    # 追加した処理: スレッド化したサーバで、遅いリクエストが /api/instructions や HTML/JS 取得を塞がないようにする
+    server_cls = ThreadingHTTPServer if SERVER_THREADED else HTTPServer
+    server = server_cls((BIND_HOST, BIND_PORT), Handler)
+    start_cpu_pool(DEFAULT_CPU_POOL_WORKERS)
+    # 追加した処理: JS の事前チェックが正しい JS を確実な NG にしないか、既知の例で確かめる
+    for src in js_structure_self_check():
+        print("[CHECK][WARN] structure pre-check rejects valid JS:", src)
     print("OK")
     print(f"Local Tool URL: http://{BIND_HOST}:{BIND_PORT}/")
     print(f"Output root: {Path(__file__).resolve().parent / DEFAULT_OUTROOT}")
-    server.serve_forever()
+    try:
+        server.serve_forever()
+    finally:
+        shutdown_cpu_pool()
+        shutdown_node_check_worker()
 
 
 if __name__ == "__main__":